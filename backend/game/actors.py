@@ -0,0 +1,133 @@
+"""
+Per-game command actors for TI Chess
+
+Every game with live sockets in this process gets one GameActor: a task
+draining a bounded queue. Move, transform and placement commands from all
+sockets of the game are submitted to it and applied strictly in submission
+order, so two sockets of the same game never race each other to the
+database. Each submitter awaits the result of its own command.
+
+Commands that queue up while the actor is busy are applied as a batch: one
+thread hop and one transaction, with a savepoint per command so a failing
+command does not undo the others. An actor stops after ACTOR_IDLE_TIMEOUT
+seconds without commands.
+
+Across worker processes the state_version compare-and-swap in
+services.apply_move still decides which move wins.
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from django.conf import settings  # type: ignore
+from django.db import transaction  # type: ignore
+
+from .syncpool import database_sync_to_async
+from . import metrics, resident
+
+
+logger = logging.getLogger(__name__)
+
+ACTOR_QUEUE_SIZE = getattr(settings, 'GAME_ACTOR_QUEUE_SIZE', 64)
+ACTOR_BATCH_SIZE = getattr(settings, 'GAME_ACTOR_BATCH_SIZE', 16)
+ACTOR_IDLE_TIMEOUT = getattr(settings, 'GAME_ACTOR_IDLE_TIMEOUT', 30)
+
+# game_id -> actor running on this process's event loop
+_actors: Dict[str, 'GameActor'] = {}
+
+
+class GameBusy(Exception):
+    """The command queue of a game is full"""
+
+
+def apply_batch(commands: List[Tuple[Callable, tuple, dict]]) -> List[Any]:
+    """Run commands in order in one transaction; a failed command yields its exception"""
+    results = []
+    with transaction.atomic():
+        for func, args, kwargs in commands:
+            try:
+                with transaction.atomic():
+                    results.append(func(*args, **kwargs))
+            except Exception as e:
+                results.append(e)
+    return results
+
+
+class GameActor:
+    """Applies the commands of one game one batch at a time"""
+
+    def __init__(self, game_id):
+        self.game_id = str(game_id)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ACTOR_QUEUE_SIZE)
+        self.task = self.loop.create_task(self.run())
+
+    def submit(self, func: Callable, /, *args, **kwargs) -> asyncio.Future:
+        """Queue a synchronous command; the future resolves to its result"""
+        future = self.loop.create_future()
+        try:
+            self.queue.put_nowait((func, args, kwargs, future))
+        except asyncio.QueueFull:
+            metrics.incr('actor.commands_rejected')
+            raise GameBusy(self.game_id)
+        return future
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(self.queue.get(), ACTOR_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+
+                batch = [first]
+                while len(batch) < ACTOR_BATCH_SIZE and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                await self.apply(batch)
+        finally:
+            # Nothing runs between the last empty get and this, so no command is lost
+            if _actors.get(self.game_id) is self:
+                del _actors[self.game_id]
+            self.fail_pending()
+
+    async def apply(self, batch):
+        metrics.incr('actor.batches')
+        metrics.incr('actor.commands', len(batch))
+        try:
+            results = await database_sync_to_async(apply_batch)(
+                [(func, args, kwargs) for func, args, kwargs, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Error applying commands for game {self.game_id}: {e}")
+            results = [e] * len(batch)
+            # Whatever the batch left in memory may not match the database
+            resident.drop(self.game_id)
+
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done():
+                # The submitter went away; the command was applied regardless
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def fail_pending(self):
+        while not self.queue.empty():
+            future = self.queue.get_nowait()[3]
+            if not future.done():
+                future.set_exception(GameBusy(self.game_id))
+
+
+def actor_for(game_id) -> GameActor:
+    """The actor of a game on the running event loop, started on first use"""
+    actor = _actors.get(str(game_id))
+    if actor is None or actor.task.done() or actor.loop is not asyncio.get_running_loop():
+        actor = _actors[str(game_id)] = GameActor(game_id)
+    return actor
+
+
+async def submit(game_id, func: Callable, /, *args, **kwargs) -> Any:
+    """Apply a synchronous command in the order of its game; raises GameBusy when the queue is full"""
+    return await actor_for(game_id).submit(func, *args, **kwargs)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Game, Player, Piece, Move, GameSnapshot, GameEvent
+from .models import User, Game, Player, Piece, Move, GameSnapshot, GameEvent, GameArchive
 
 
 @admin.register(User)
@@ -59,4 +59,13 @@ class GameEventAdmin(admin.ModelAdmin):
     list_display = ['game', 'event_type', 'move', 'created_at']
     list_filter = ['event_type', 'created_at']
     search_fields = ['game__id', 'move__id']
-    readonly_fields = ['id', 'created_at']
\ No newline at end of file
+    readonly_fields = ['id', 'created_at']
+
+
+@admin.register(GameArchive)
+class GameArchiveAdmin(admin.ModelAdmin):
+    list_display = ['game', 'codec', 'move_count', 'raw_size', 'archived_at']
+    list_filter = ['codec', 'archived_at']
+    search_fields = ['game__id']
+    readonly_fields = ['game', 'codec', 'format_version', 'raw_size', 'move_count', 'archived_at']
+    exclude = ['payload']
@@ -0,0 +1,254 @@
+"""
+Game affinity across ASGI worker processes
+
+With several workers behind a load balancer, the sockets of one game can
+land on different processes. Each game is therefore owned by one worker,
+chosen by consistent hashing of the game id over the live workers, and
+state-changing commands are applied by the owner's game actor only. A
+worker that receives a command for a game it does not own forwards it
+through the channel layer to the owner's process channel and relays the
+result back to the socket.
+
+Workers announce themselves by holding one of GAME_AFFINITY_MAX_WORKERS
+membership slots in the shared cache, refreshed every third of
+GAME_AFFINITY_MEMBER_TTL. Each worker rebuilds its hash ring from the
+slots on every refresh, so when a worker joins or its slot expires the
+games it gains or loses move to their new owner within one refresh; with
+virtual nodes only about 1/N of the games move. While views of the ring
+differ, a forwarded command is applied where it arrives and is never
+forwarded again; the state_version compare-and-swap keeps such overlaps
+safe.
+
+Every forwarded command carries a command_id. The owner remembers the
+outcome of its last GAME_AFFINITY_COMMAND_MEMORY commands by id and answers
+a repeated delivery with it instead of applying the command twice. A
+forward that gets no reply within GAME_AFFINITY_FORWARD_TIMEOUT is
+reported to the client as timed out rather than applied again locally: the
+owner may still apply it, and the client learns the outcome from the
+game's events.
+
+Affinity needs a channel layer shared by all workers (Redis). It is off
+unless GAME_AFFINITY is set; commands then run on the local actor.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .syncpool import sync_to_async
+from . import actors, metrics, services
+
+
+logger = logging.getLogger(__name__)
+
+AFFINITY_ENABLED = getattr(settings, 'GAME_AFFINITY', False)
+MEMBER_TTL = getattr(settings, 'GAME_AFFINITY_MEMBER_TTL', 15)
+MAX_WORKERS = getattr(settings, 'GAME_AFFINITY_MAX_WORKERS', 64)
+FORWARD_TIMEOUT = getattr(settings, 'GAME_AFFINITY_FORWARD_TIMEOUT', 5)
+COMMAND_MEMORY = getattr(settings, 'GAME_AFFINITY_COMMAND_MEMORY', 1024)
+VIRTUAL_NODES = 64
+
+# Commands that can be forwarded, by name; arguments must survive the channel layer
+COMMANDS: Dict[str, Callable] = {
+    'apply_move': services.apply_move_command,
+    'investor_transform': services.investor_transform_command,
+    'queue_premove': services.queue_premove_command,
+    'clear_premoves': services.clear_premoves_command,
+}
+
+_worker: Optional['AffinityWorker'] = None
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, members: Iterable[str], vnodes: int = VIRTUAL_NODES):
+        self.members = sorted(set(members))
+        points = sorted(
+            (_hash(f'{member}#{n}'), member)
+            for member in self.members
+            for n in range(vnodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key) -> Optional[str]:
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, _hash(str(key))) % len(self.hashes)
+        return self.owners[index]
+
+
+def _slot_key(slot: int) -> str:
+    return f'affinity:member:{slot}'
+
+
+def members() -> List[str]:
+    """Process channels of the live workers"""
+    held = cache.get_many([_slot_key(slot) for slot in range(MAX_WORKERS)])
+    return list(held.values())
+
+
+async def run_local(game_id, name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a named command on this process's actor for the game"""
+    try:
+        return await actors.submit(game_id, COMMANDS[name], **kwargs)
+    except actors.GameBusy:
+        return {'success': False, 'error': 'Game is busy, try again', 'code': 'busy'}
+
+
+class AffinityWorker:
+    """This process's membership, hash ring and forwarding endpoint"""
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.loop = asyncio.get_running_loop()
+        self.channel: Optional[str] = None
+        self.slot: Optional[int] = None
+        self.ring = HashRing([])
+        self.tasks: List[asyncio.Task] = []
+        # command_id -> outcome of a forwarded command, oldest first
+        self.applied: 'OrderedDict[str, asyncio.Future]' = OrderedDict()
+
+    # Membership
+
+    def join(self):
+        """Claim a membership slot, or keep the one already held"""
+        if self.slot is not None and cache.get(_slot_key(self.slot)) == self.channel:
+            cache.set(_slot_key(self.slot), self.channel, timeout=MEMBER_TTL)
+            return
+        for slot in range(MAX_WORKERS):
+            if cache.add(_slot_key(slot), self.channel, timeout=MEMBER_TTL):
+                self.slot = slot
+                return
+        self.slot = None
+        logger.error(f"No free affinity slot for worker {self.channel}")
+
+    def refresh(self):
+        """Renew membership and rebuild the ring from the live workers"""
+        self.join()
+        ring = HashRing(members())
+        if ring.members != self.ring.members:
+            logger.info(f"Affinity ring changed: {len(ring.members)} workers")
+            metrics.incr('affinity.ring_changes')
+        self.ring = ring
+
+    def leave(self):
+        if self.slot is not None and cache.get(_slot_key(self.slot)) == self.channel:
+            cache.delete(_slot_key(self.slot))
+        self.slot = None
+
+    def owner(self, game_id) -> Optional[str]:
+        return self.ring.owner(game_id)
+
+    # Lifecycle
+
+    async def start(self):
+        self.channel = await self.channel_layer.new_channel()
+        await sync_to_async(self.refresh)()
+        self.tasks = [self.loop.create_task(self.listen()), self.loop.create_task(self.heartbeat())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await sync_to_async(self.leave)()
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(MEMBER_TTL / 3)
+            try:
+                await sync_to_async(self.refresh)()
+            except Exception as e:
+                logger.error(f"Error refreshing affinity membership: {e}")
+
+    async def listen(self):
+        """Apply commands forwarded by other workers"""
+        while True:
+            message = await self.channel_layer.receive(self.channel)
+            if message.get('type') == 'affinity.command':
+                # Concurrently, so forwarded commands of a game batch in its actor
+                self.loop.create_task(self.handle(message))
+
+    async def apply_once(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a forwarded command, or return the outcome of its earlier delivery"""
+        command_id = message['command_id']
+        outcome = self.applied.get(command_id)
+        if outcome is not None:
+            metrics.incr('affinity.commands_repeated')
+            return await asyncio.shield(outcome)
+
+        outcome = self.applied[command_id] = self.loop.create_future()
+        while len(self.applied) > COMMAND_MEMORY:
+            self.applied.popitem(last=False)
+        try:
+            result = await run_local(message['game_id'], message['command'], message['kwargs'])
+        except Exception as e:
+            logger.error(f"Error applying forwarded {message['command']} for game {message['game_id']}: {e}")
+            result = {'success': False, 'error': 'Internal server error'}
+        outcome.set_result(result)
+        return result
+
+    async def handle(self, message: Dict[str, Any]):
+        metrics.incr('affinity.commands_received')
+        result = await self.apply_once(message)
+        await self.channel_layer.send(message['reply_to'], {
+            'type': 'affinity.result',
+            'result': result
+        })
+
+    # Commands
+
+    async def submit(self, game_id, name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a command on the owning worker of the game"""
+        owner = self.owner(game_id)
+        if owner is None or owner == self.channel:
+            return await run_local(game_id, name, kwargs)
+
+        metrics.incr('affinity.commands_forwarded')
+        reply_to = await self.channel_layer.new_channel()
+        await self.channel_layer.send(owner, {
+            'type': 'affinity.command',
+            'game_id': str(game_id),
+            'command': name,
+            'command_id': uuid.uuid4().hex,
+            'kwargs': kwargs,
+            'reply_to': reply_to
+        })
+        try:
+            reply = await asyncio.wait_for(self.channel_layer.receive(reply_to), FORWARD_TIMEOUT)
+        except asyncio.TimeoutError:
+            # The owner may still apply it: running it here too could apply it twice
+            metrics.incr('affinity.forward_timeouts')
+            logger.warning(f"Forwarding {name} for game {game_id} to {owner} timed out")
+            return {'success': False, 'error': 'Game server did not respond, try again', 'code': 'timeout'}
+        return reply['result']
+
+
+def ensure_worker(channel_layer):
+    """Join the ring from the current event loop if affinity is on"""
+    global _worker
+    if not AFFINITY_ENABLED:
+        return
+    loop = asyncio.get_running_loop()
+    if _worker is None or _worker.loop is not loop:
+        _worker = AffinityWorker(channel_layer)
+        loop.create_task(_worker.start())
+
+
+async def submit(game_id, name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a named command for a game, on its owning worker when affinity is on"""
+    worker = _worker
+    if worker is None or worker.channel is None or not AFFINITY_ENABLED:
+        return await run_local(game_id, name, kwargs)
+    return await worker.submit(game_id, name, kwargs)
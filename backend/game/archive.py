@@ -0,0 +1,267 @@
+"""
+Cold storage for finished TI Chess games
+
+Games that finished (or were abandoned) more than ARCHIVE_AFTER_DAYS ago and
+went through post-game processing are packed into a single compressed
+GameArchive row: game metadata, the move log with its events, the replay
+keyframes and the final board. The Piece, Move, GameEvent and GameSnapshot
+rows are then deleted in small batches so the hot tables and their indexes
+only hold games that can still change.
+
+Game and Player rows are kept, so game detail pages and foreign keys keep
+working. Replay and board reads decode the archive on demand.
+"""
+
+import json
+import logging
+import zlib
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.core.serializers.json import DjangoJSONEncoder  # type: ignore
+from django.db import transaction  # type: ignore
+from django.db.models import Q  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from .models import Game, GameArchive, GameEvent, GameSnapshot, Move, Piece
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'ARCHIVE_AFTER_DAYS', 30)
+ARCHIVE_DELETE_BATCH_SIZE = getattr(settings, 'ARCHIVE_DELETE_BATCH_SIZE', 1000)
+FORMAT_VERSION = 1
+
+ARCHIVABLE_STATUSES = (Game.Status.FINISHED, Game.Status.ABANDONED)
+
+# Deleted in this order so no delete cascades into another hot table
+HOT_MODELS = (GameEvent, Move, GameSnapshot, Piece)
+
+
+def compress(raw: bytes) -> tuple:
+    """Compress raw bytes with the best available codec"""
+    if zstandard is not None:
+        return GameArchive.Codec.ZSTD, zstandard.ZstdCompressor(level=10).compress(raw)
+    return GameArchive.Codec.ZLIB, zlib.compress(raw, 9)
+
+
+def decompress(codec: str, payload: bytes) -> bytes:
+    if codec == GameArchive.Codec.ZLIB:
+        return zlib.decompress(payload)
+    if codec == GameArchive.Codec.ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this archive")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+
+def build_payload(game: Game) -> Dict[str, Any]:
+    """Collect everything replays need from the hot rows of a game"""
+    from .replay import serialize_pieces
+    from .serializers import GameEventSerializer, MoveSerializer, PlayerSerializer
+
+    moves = (
+        Move.objects.filter(game=game)
+        .select_related('player', 'piece')
+        .prefetch_related('events')
+        .order_by('move_number')
+    )
+
+    return {
+        'game': {
+            'id': game.id,
+            'status': game.status,
+            'winner_id': game.winner_id,
+            'turn_count': game.turn_count,
+            'created_at': game.created_at,
+            'started_at': game.started_at,
+            'finished_at': game.finished_at,
+        },
+        # Serialized with their pieces, which are about to be deleted
+        'players': PlayerSerializer(game.players.with_pieces(), many=True).data,
+        'moves': [
+            {'player_id': move.player_id, 'piece_id': move.piece_id, **MoveSerializer(move).data}
+            for move in moves
+        ],
+        # Events not tied to a move, e.g. piece placement
+        'events': GameEventSerializer(
+            GameEvent.objects.filter(game=game, move__isnull=True).order_by('created_at'),
+            many=True
+        ).data,
+        'keyframes': list(
+            GameSnapshot.objects.filter(game=game)
+            .order_by('move_number')
+            .values('move_number', 'board_state', 'player_states')
+        ),
+        'board': serialize_pieces(Piece.objects.filter(game=game, is_active=True)),
+    }
+
+
+def purge_hot_rows(game: Game, batch_size: Optional[int] = None) -> int:
+    """Delete the hot rows of an archived game in short transactions"""
+    batch_size = batch_size or ARCHIVE_DELETE_BATCH_SIZE
+    deleted = 0
+
+    for model in HOT_MODELS:
+        while True:
+            ids = list(model.objects.filter(game=game).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                deleted += model.objects.filter(pk__in=ids).delete()[0]
+
+    return deleted
+
+
+def archive_game(game: Game, batch_size: Optional[int] = None) -> GameArchive:
+    """
+    Archive a game and remove its hot rows.
+
+    Safe to re-run: a game that already has an archive only has any rows
+    left over from an interrupted purge removed.
+    """
+    with transaction.atomic():
+        archive = GameArchive.objects.select_for_update().filter(game=game).first()
+        if archive is None:
+            payload = build_payload(game)
+            raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+            codec, blob = compress(raw)
+            archive = GameArchive.objects.create(
+                game=game,
+                codec=codec,
+                format_version=FORMAT_VERSION,
+                payload=blob,
+                raw_size=len(raw),
+                move_count=len(payload['moves'])
+            )
+
+    purge_hot_rows(game, batch_size)
+    return archive
+
+
+def archivable_games(days: Optional[int] = None):
+    """
+    Games that ended more than `days` days ago and are not archived yet.
+
+    Games whose post-game processing (see game.postgame) has not run are
+    left alone: it reads the hot rows archiving deletes.
+    """
+    cutoff = timezone.now() - timedelta(days=ARCHIVE_AFTER_DAYS if days is None else days)
+    return Game.objects.filter(
+        Q(finished_at__lt=cutoff) | Q(finished_at__isnull=True, updated_at__lt=cutoff),
+        status__in=ARCHIVABLE_STATUSES,
+        finalized_at__isnull=False,
+        archive__isnull=True
+    ).order_by('finished_at', 'updated_at')
+
+
+def archive_games(days: Optional[int] = None, limit: Optional[int] = None,
+                  batch_size: Optional[int] = None) -> List[GameArchive]:
+    """Archive every eligible game, oldest first"""
+    games = archivable_games(days)
+    if limit is not None:
+        games = games[:limit]
+
+    archives = []
+    for game in games:
+        try:
+            archives.append(archive_game(game, batch_size))
+        except Exception as e:
+            logger.error(f"Error archiving game {game.id}: {e}")
+    return archives
+
+
+class ArchivedGame:
+    """Decoded archive payload with the lookups replays need"""
+
+    def __init__(self, game: Game, data: Dict[str, Any]):
+        self.game = game
+        self.data = data
+        self.moves = data['moves']
+
+    @property
+    def move_count(self) -> int:
+        return len(self.moves)
+
+    @property
+    def board(self) -> List[Dict[str, Any]]:
+        return self.data['board']
+
+    @property
+    def players(self) -> List[Dict[str, Any]]:
+        return self.data['players']
+
+    def player(self, player_id) -> Optional[Dict[str, Any]]:
+        return next((p for p in self.players if p['id'] == str(player_id)), None)
+
+    def keyframe_index(self) -> List[int]:
+        return [keyframe['move_number'] for keyframe in self.data['keyframes']]
+
+    def keyframe_at(self, move_number: int) -> Optional[GameSnapshot]:
+        """Nearest keyframe at or before move_number, as an unsaved snapshot"""
+        candidates = [k for k in self.data['keyframes'] if k['move_number'] <= move_number]
+        if not candidates:
+            return None
+        keyframe = candidates[-1]
+        return GameSnapshot(game_id=self.game.id, **keyframe)
+
+    def moves_between(self, after: int, upto: int) -> List[Move]:
+        """Unsaved Move instances for moves after..upto, for the replay engine"""
+        return [
+            Move(
+                game_id=self.game.id,
+                player_id=move['player_id'],
+                piece_id=move['piece_id'],
+                move_type=move['move_type'],
+                from_x=move['from_x'],
+                from_y=move['from_y'],
+                to_x=move['to_x'],
+                to_y=move['to_y'],
+                move_number=move['move_number'],
+            )
+            for move in self.moves
+            if after < move['move_number'] <= upto
+            and move['to_x'] is not None and move['to_y'] is not None
+        ]
+
+    def move_at(self, move_number: int) -> Optional[Dict[str, Any]]:
+        return next((move for move in self.moves if move['move_number'] == move_number), None)
+
+    def records(self, after_move: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Moves after after_move as MoveSerializer data"""
+        records = [
+            {k: v for k, v in move.items() if k not in ('player_id', 'piece_id')}
+            for move in self.moves
+            if move['move_number'] > after_move
+        ]
+        return records if limit is None else records[:limit]
+
+
+def load(game: Game) -> Optional[ArchivedGame]:
+    """
+    Decode the archive of a game, or None if its rows are still hot.
+
+    Only finished and abandoned games are looked up. Select the 'archive'
+    relation with the game to avoid the extra query.
+    """
+    if game.status not in ARCHIVABLE_STATUSES:
+        return None
+
+    cached = getattr(game, '_archived_game', None)
+    if cached is not None:
+        return cached
+
+    try:
+        archive = game.archive
+    except GameArchive.DoesNotExist:
+        return None
+
+    data = json.loads(decompress(archive.codec, bytes(archive.payload)))
+    game._archived_game = ArchivedGame(game, data)
+    return game._archived_game
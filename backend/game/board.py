@@ -0,0 +1,134 @@
+"""
+Versioned board state for TI Chess
+
+Every state change bumps Game.state_version, so a built board payload is
+immutable for its (game, version) pair. Payloads are cached under that key
+and the version doubles as the HTTP ETag. The async path also keeps recent
+payloads in a process-local LRU, which needs no invalidation for the same
+reason.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .models import Game
+from .syncpool import sync_to_async
+from . import archive, codec
+
+
+BOARD_CACHE_TIMEOUT = getattr(settings, 'BOARD_CACHE_TIMEOUT', 300)
+LOCAL_CACHE_SIZE = 256
+
+_local: 'OrderedDict[Tuple[str, int], Dict[str, Any]]' = OrderedDict()
+
+
+def board_etag(game_id, version: int) -> str:
+    return f'"board-{game_id}-{version}"'
+
+
+def _cache_key(game_id, version: int) -> str:
+    return f'board:{game_id}:{version}'
+
+
+def current_version(game_id) -> Optional[int]:
+    """Current state_version of a game, or None if it does not exist"""
+    return Game.objects.filter(pk=game_id).values_list('state_version', flat=True).first()
+
+
+async def acurrent_version(game_id) -> Optional[int]:
+    """Async current_version"""
+    return await Game.objects.filter(pk=game_id).values_list('state_version', flat=True).afirst()
+
+
+def _public(player: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in player.items() if key != 'player_token'}
+
+
+def build_board(game: Game) -> Dict[str, Any]:
+    """Build the board payload from Piece rows, or the archive once archived"""
+    from .serializers import BoardStateSerializer
+
+    board = [[None for _ in range(8)] for _ in range(8)]
+    players = list(game.players.with_pieces())
+    current_turn_player = next(
+        (p for p in players if p.id == game.current_turn_player_id), None
+    )
+
+    archived = archive.load(game)
+    if archived is not None:
+        # Piece rows are gone; the archive keeps the final board
+        owners = {player['id']: player for player in archived.players}
+        for piece in archived.board:
+            owner = owners.get(piece['owner_id'], {})
+            board[piece['y']][piece['x']] = {
+                'id': piece['id'],
+                'owner_id': piece['owner_id'],
+                'owner_name': owner.get('name'),
+                'owner_color': owner.get('color'),
+                'type': piece['type'],
+                'level': piece['level'],
+                'transform_count': piece['transform_count'],
+                'temporary_buffs': piece['temporary_buffs']
+            }
+    else:
+        for piece in game.pieces.filter(is_active=True).select_related('owner'):
+            board[piece.position_y][piece.position_x] = {
+                'id': str(piece.id),
+                'owner_id': str(piece.owner.id),
+                'owner_name': piece.owner.name,
+                'owner_color': piece.owner.color,
+                'type': piece.piece_type,
+                'level': piece.level,
+                'transform_count': piece.transform_count,
+                'temporary_buffs': piece.temporary_buffs
+            }
+
+    data = {
+        'board': board,
+        'players': players,
+        'current_turn_player': current_turn_player,
+        'game_status': game.status,
+        'turn_count': game.turn_count,
+        'state_version': game.state_version
+    }
+
+    data = BoardStateSerializer(data).data
+    if archived is not None:
+        # Board payloads reach spectators: leave the archived tokens out
+        data['players'] = [_public(player) for player in archived.players]
+        current_turn_player = archived.player(game.current_turn_player_id)
+        data['current_turn_player'] = _public(current_turn_player) if current_turn_player else None
+
+    # Round-trip through JSON so the cached value is plain data
+    return codec.loads(codec.dumps_bytes(data))
+
+
+def get_board(game_id, version: int) -> Dict[str, Any]:
+    """Board payload for a game, served from the cache when version matches"""
+    payload = cache.get(_cache_key(game_id, version))
+    if payload is not None:
+        return payload
+
+    game = Game.objects.select_related('archive').get(pk=game_id)
+    payload = build_board(game)
+    cache.set(_cache_key(game_id, game.state_version), payload, timeout=BOARD_CACHE_TIMEOUT)
+    return payload
+
+
+async def aget_board(game_id, version: int) -> Dict[str, Any]:
+    """Async get_board, served from this process when it built or fetched the version before"""
+    payload = _local.get((str(game_id), version))
+    if payload is None:
+        payload = await cache.aget(_cache_key(game_id, version))
+    if payload is None:
+        payload = await sync_to_async(get_board)(game_id, version)
+
+    key = (str(game_id), payload['state_version'])
+    _local[key] = payload
+    _local.move_to_end(key)
+    while len(_local) > LOCAL_CACHE_SIZE:
+        _local.popitem(last=False)
+    return payload
@@ -0,0 +1,141 @@
+"""
+Turn clocks and abandonment for TI Chess
+
+Timed games store when the player to move runs out of time in
+Game.turn_deadline. Each move moves the deadline (services.apply_move) and,
+once it commits, hands the new deadline to the timer wheel of the process
+that applied it with request_flag; the wheel picks it up on its next tick.
+Sockets also schedule the deadline of the game they join.
+Every worker process keeps one hierarchical timer wheel holding:
+
+- a flag timer per timed game it has seen a deadline for: when it fires,
+  services.flag_game ends the game for the opponent if the deadline has
+  really passed
+- an abandon timer per player whose presence lapsed on this process: if
+  the player is still offline GAME_ABANDON_TIMEOUT seconds later,
+  services.abandon_game marks the game abandoned
+
+Both run on the game's actor and end the game through the post-game
+pipeline, then announce game_ended with a reason. The database condition
+makes them idempotent, so a timer left over after a newer move, or fired
+on several workers, is harmless. One task per process ticks the wheel
+every GAME_TIMER_TICK seconds.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from .timerwheel import Timer, TimerWheel
+from . import actors, events, metrics, services
+
+
+logger = logging.getLogger(__name__)
+
+TIMER_TICK = getattr(settings, 'GAME_TIMER_TICK', 0.25)
+ABANDON_TIMEOUT = getattr(settings, 'GAME_ABANDON_TIMEOUT', 120)
+BUSY_RETRY = 1.0
+
+_wheel = TimerWheel(tick=TIMER_TICK)
+# game_id -> (deadline, timer)
+_flags: Dict[str, Tuple[datetime, Timer]] = {}
+# (game_id, player_id) -> timer
+_abandons: Dict[Tuple[str, str], Timer] = {}
+# (game_id, deadline) handed over by request_flag from other threads
+_requested: deque = deque()
+_runner = None
+_channel_layer = None
+
+
+def schedule_flag(game_id, deadline: Optional[datetime]):
+    """Check the game for a flag once deadline passes; None clears its timer"""
+    game_id = str(game_id)
+    current = _flags.get(game_id)
+    if current is not None:
+        if current[0] == deadline and current[1].active:
+            return
+        _wheel.cancel(current[1])
+        del _flags[game_id]
+    if deadline is None:
+        return
+
+    delay = (deadline - timezone.now()).total_seconds()
+    _flags[game_id] = (deadline, _wheel.schedule(delay, _flag, game_id))
+
+
+def request_flag(game_id, deadline: Optional[datetime]):
+    """schedule_flag from any thread, e.g. the one a move was applied on"""
+    _requested.append((game_id, deadline))
+
+
+def schedule_abandon(game_id, player_id):
+    """Start the abandonment countdown of a player who went offline"""
+    key = (str(game_id), str(player_id))
+    if key in _abandons:
+        _wheel.cancel(_abandons[key])
+    _abandons[key] = _wheel.schedule(ABANDON_TIMEOUT, _abandon, *key)
+
+
+def cancel_abandon(game_id, player_id):
+    """The player is back online"""
+    timer = _abandons.pop((str(game_id), str(player_id)), None)
+    if timer is not None:
+        _wheel.cancel(timer)
+
+
+async def _end(game_id, func, *args) -> bool:
+    """Apply an end-of-game check on the game's actor and announce the result"""
+    try:
+        result = await actors.submit(game_id, func, game_id, *args)
+    except actors.GameBusy:
+        return False
+    if result is not None:
+        metrics.incr(f"clocks.games_{result['reason']}")
+        await events.publish(_channel_layer, game_id, 'game_ended', {
+            'winner': result['winner'],
+            'reason': result['reason']
+        })
+    return True
+
+
+async def _flag(game_id: str):
+    deadline, _ = _flags.pop(game_id, (None, None))
+    if not await _end(game_id, services.flag_game):
+        _flags[game_id] = (deadline, _wheel.schedule(BUSY_RETRY, _flag, game_id))
+
+
+async def _abandon(game_id: str, player_id: str):
+    _abandons.pop((game_id, player_id), None)
+    if not await _end(game_id, services.abandon_game, player_id):
+        _abandons[(game_id, player_id)] = _wheel.schedule(BUSY_RETRY, _abandon, game_id, player_id)
+
+
+async def tick():
+    """Fire the timers that expired since the last tick"""
+    while _requested:
+        schedule_flag(*_requested.popleft())
+    due = _wheel.advance()
+    results = await asyncio.gather(*(timer.fire() for timer in due), return_exceptions=True)
+    for timer, result in zip(due, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error firing game timer {timer.callback.__name__}{timer.args}: {result}")
+
+
+async def _run():
+    while True:
+        await asyncio.sleep(TIMER_TICK)
+        await tick()
+
+
+def ensure_running(channel_layer):
+    """Start ticking the wheel on the current event loop if it is not running"""
+    global _runner, _channel_layer
+    _channel_layer = channel_layer
+    loop = asyncio.get_running_loop()
+    if _runner is None or _runner.done() or _runner.get_loop() is not loop:
+        _runner = loop.create_task(_run())
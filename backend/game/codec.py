@@ -0,0 +1,79 @@
+"""
+JSON codec for TI Chess
+
+WebSocket frames, cached payloads and REST responses are encoded here.
+orjson is used when it is installed; it serializes UUIDs, datetimes and
+dict/list subclasses such as DRF's ReturnDict natively. Without it, or for
+values orjson cannot encode, the stdlib json module with DjangoJSONEncoder
+is used. Both produce compact output, with UTC datetimes ending in Z.
+"""
+
+import json
+from decimal import Decimal
+from typing import Any, Union
+
+from django.core.serializers.json import DjangoJSONEncoder  # type: ignore
+from django.utils.functional import Promise  # type: ignore
+from rest_framework.exceptions import ParseError  # type: ignore
+from rest_framework.parsers import JSONParser  # type: ignore
+from rest_framework.renderers import JSONRenderer  # type: ignore
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+DecodeError = getattr(orjson, 'JSONDecodeError', json.JSONDecodeError)
+
+_ORJSON_OPTIONS = orjson.OPT_UTC_Z if orjson is not None else 0
+
+
+def _default(obj):
+    # Types orjson does not know; DjangoJSONEncoder turns them into strings too
+    if isinstance(obj, (Decimal, Promise)):
+        return str(obj)
+    raise TypeError
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Encode to UTF-8 JSON"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def dumps(obj: Any) -> str:
+    """Encode to a JSON string, e.g. for a WebSocket text frame"""
+    return dumps_bytes(obj).decode()
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decode JSON text; raises DecodeError (a ValueError) for malformed input"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with the codec; indented output still uses the stdlib"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps_bytes(data)
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser that decodes with the codec"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -2,17 +2,23 @@
 WebSocket consumer for real-time TI Chess gameplay
 """
 
-import json
+import asyncio
 import logging
+from collections import deque
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
-from asgiref.sync import sync_to_async
-from typing import Dict, Any, Optional
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+from typing import Dict, Any, List, Optional
 
-from .models import Game, Player, Piece, Move, GameEvent
-from .engine import GameEngine, GamePiece, Position, PieceType
-from .serializers import GameSerializer, MoveSerializer
+from .models import Game, Player, Piece
+from .engine import Position
+from .serializers import GameSerializer
+from .syncpool import database_sync_to_async, sync_to_async
+from . import (
+    affinity, clocks, codec, events, lobby, metrics, presence, protocol, ratelimit, replay,
+    serverloop, spectators
+)
 
 
 logger = logging.getLogger(__name__)
@@ -27,11 +33,18 @@ class GameConsumer(AsyncWebsocketConsumer):
         self.game_group_name = None
         self.player = None
         self.game = None
+        self.subprotocol = None
+        self.piece_index = None
+        # Highest event seq covered by the snapshot or resume this client got
+        self.covered_seq = None
+        self.limiter = ratelimit.ConnectionLimiter()
+        self.inbox = asyncio.Queue(maxsize=ratelimit.INBOUND_QUEUE_SIZE)
+        self.worker = None
         
     async def connect(self):
         """Handle WebSocket connection"""
         self.game_id = self.scope['url_route']['kwargs']['game_id']
-        self.game_group_name = f'game_{self.game_id}'
+        self.game_group_name = events.group_name(self.game_id)
         
         # Join game group
         await self.channel_layer.group_add(
@@ -39,14 +52,22 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
-        logger.info(f"WebSocket connected to game {self.game_id}")
+        self.subprotocol = protocol.negotiate(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.subprotocol)
+        serverloop.bind()
+        affinity.ensure_worker(self.channel_layer)
+        clocks.ensure_running(self.channel_layer)
+        spectators.ensure_running(self.channel_layer)
+        logger.info(f"WebSocket connected to game {self.game_id} ({self.subprotocol or 'json'})")
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        # Mark player as disconnected
+        if self.worker is not None:
+            self.worker.cancel()
+        
+        # Player goes offline only if no socket reconnects within the grace period
         if self.player:
-            await self.update_player_connection(self.player.id, False)
+            await sync_to_async(presence.disconnect)(self.game_id, self.player.id, self.channel_name)
         
         # Leave game group
         await self.channel_layer.group_discard(
@@ -56,17 +77,84 @@ class GameConsumer(AsyncWebsocketConsumer):
         
         logger.info(f"WebSocket disconnected from game {self.game_id}")
     
-    async def receive(self, text_data):
-        """Handle incoming WebSocket message"""
+    @property
+    def is_binary(self) -> bool:
+        return self.subprotocol == protocol.MSGPACK_SUBPROTOCOL
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Decode an incoming frame, check the rate limits and queue it.
+        
+        Frames are handled in order by a per-socket worker. When the client
+        sends faster than they are handled, frames beyond the bounded queue
+        are dropped.
+        """
+        if not self.limiter.allow_frame():
+            await self.reject('frames_rejected', "Rate limit exceeded")
+            return
+        
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None and self.is_binary:
+                data = await self.decode_frame(bytes_data)
+            else:
+                data = codec.loads(text_data)
             action = data.get('action')
             message_data = data.get('data', {})
+        except (ValueError, TypeError, AttributeError):
+            await self.send_error("Invalid JSON format")
+            return
+        except protocol.ProtocolError as e:
+            await self.send_error(str(e))
+            return
+        
+        # Actions key the rate-limit tables; a list or dict would not even hash
+        if not isinstance(action, str) or not isinstance(message_data, dict):
+            await self.send_error("Malformed message: action must be a string and data an object")
+            return
+        
+        if not self.limiter.allow(action):
+            metrics.incr(f"ws.frames_rejected.{action if action in ratelimit.ACTION_RATES else 'other'}")
+            await self.reject('frames_rejected', "Rate limit exceeded", action=action)
+            return
+        
+        try:
+            self.inbox.put_nowait((action, message_data))
+        except asyncio.QueueFull:
+            await self.reject('frames_dropped', "Too many pending messages", action=action)
+            return
+        
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.process_inbox())
+    
+    async def reject(self, counter: str, message: str, **extra):
+        """Refuse a frame; sockets that keep violating the limits are closed"""
+        metrics.incr(f'ws.{counter}')
+        if self.limiter.violation():
+            metrics.incr('ws.connections_closed')
+            logger.warning(f"Closing socket {self.channel_name} of game {self.game_id}: rate limits exceeded")
+            await self.close(code=ratelimit.CLOSE_POLICY_VIOLATION)
+            return
+        await self.send_error(message, code='rate_limited', **extra)
+    
+    async def process_inbox(self):
+        """Handle queued frames one at a time"""
+        while not self.inbox.empty():
+            action, message_data = self.inbox.get_nowait()
+            await self.handle_action(action, message_data)
+    
+    async def handle_action(self, action: Optional[str], message_data: Dict[str, Any]):
+        """Route an action to its handler"""
+        try:
+            logger.debug(f"Received action: {action} for game {self.game_id}")
             
-            logger.info(f"Received action: {action} for game {self.game_id}")
+            # Any message from an authenticated player counts as a heartbeat
+            if self.player:
+                await sync_to_async(presence.heartbeat)(self.game_id, self.player.id, self.channel_name)
             
             # Route to appropriate handler
-            if action == 'join_game':
+            if action == 'heartbeat':
+                pass
+            elif action == 'join_game':
                 await self.handle_join_game(message_data)
             elif action == 'select_color':
                 await self.handle_select_color(message_data)
@@ -74,6 +162,10 @@ class GameConsumer(AsyncWebsocketConsumer):
                 await self.handle_player_ready(message_data)
             elif action == 'make_move':
                 await self.handle_make_move(message_data)
+            elif action == 'premove':
+                await self.handle_premove(message_data)
+            elif action == 'clear_premoves':
+                await self.handle_clear_premoves(message_data)
             elif action == 'investor_transform':
                 await self.handle_investor_transform(message_data)
             elif action == 'place_piece':
@@ -83,8 +175,6 @@ class GameConsumer(AsyncWebsocketConsumer):
             else:
                 await self.send_error(f"Unknown action: {action}")
                 
-        except json.JSONDecodeError:
-            await self.send_error("Invalid JSON format")
         except Exception as e:
             logger.error(f"Error handling message: {e}")
             await self.send_error("Internal server error")
@@ -112,8 +202,7 @@ class GameConsumer(AsyncWebsocketConsumer):
                     await self.send_error("Could not join game")
                     return
             
-            # Update connection status
-            await self.update_player_connection(self.player.id, True)
+            await self.mark_online()
             
             # Send player info
             await self.send_json({
@@ -128,18 +217,14 @@ class GameConsumer(AsyncWebsocketConsumer):
             })
             
             # Broadcast to other players
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'player_joined_broadcast',
-                    'player_id': str(self.player.id),
-                    'player_name': self.player.name,
-                    'color': self.player.color
-                }
-            )
+            await self.broadcast('player_joined', {
+                'player_id': str(self.player.id),
+                'player_name': self.player.name,
+                'color': self.player.color
+            })
             
-            # Send current game state
-            await self.send_game_state()
+            # Send what the client missed, or the current game state
+            await self.send_game_state(data.get('last_seq'))
             
         except Exception as e:
             logger.error(f"Error joining game: {e}")
@@ -156,14 +241,10 @@ class GameConsumer(AsyncWebsocketConsumer):
             await self.update_player_color(self.player.id, color)
             
             # Broadcast color change
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'color_changed',
-                    'player_id': str(self.player.id),
-                    'color': color
-                }
-            )
+            await self.broadcast('color_changed', {
+                'player_id': str(self.player.id),
+                'color': color
+            })
             
         except Exception as e:
             logger.error(f"Error selecting color: {e}")
@@ -182,17 +263,14 @@ class GameConsumer(AsyncWebsocketConsumer):
             # Check if game can start
             can_start = await self.check_can_start_game()
             if can_start:
-                await self.start_game()
+                turn_deadline = await self.start_game()
+                clocks.schedule_flag(self.game_id, turn_deadline)
             
             # Broadcast ready status
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'player_ready_changed',
-                    'player_id': str(self.player.id),
-                    'ready': is_ready
-                }
-            )
+            await self.broadcast('player_ready_changed', {
+                'player_id': str(self.player.id),
+                'ready': is_ready
+            })
             
         except Exception as e:
             logger.error(f"Error updating ready status: {e}")
@@ -217,30 +295,68 @@ class GameConsumer(AsyncWebsocketConsumer):
             move_result = await self.process_move(
                 piece_id, 
                 Position(from_pos[0], from_pos[1]),
-                Position(to_pos[0], to_pos[1])
+                Position(to_pos[0], to_pos[1]),
+                expected_version=data.get('state_version')
             )
             
-            if move_result['success']:
-                # Broadcast move to all players
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'move_made',
-                        'move_data': move_result
-                    }
-                )
-                
-                # Check for game end
-                winner = move_result.get('winner')
-                if winner:
-                    await self.end_game(winner)
-            else:
-                await self.send_error(move_result.get('error', 'Invalid move'))
+            await self.report_move(move_result, 'Invalid move')
                 
         except Exception as e:
             logger.error(f"Error processing move: {e}")
             await self.send_error("Failed to process move")
     
+    async def handle_premove(self, data: Dict[str, Any]):
+        """Queue a move to play as soon as the turn passes to this player"""
+        if not self.player:
+            await self.send_error("Not authenticated")
+            return
+        
+        from_pos = data.get('from')
+        to_pos = data.get('to')
+        piece_id = data.get('piece_id')
+        if not all([from_pos, to_pos, piece_id]):
+            await self.send_error("Missing move data")
+            return
+        
+        await self.submit_premoves('queue_premove', {
+            'piece_id': str(piece_id),
+            'from_pos': [from_pos[0], from_pos[1]],
+            'to_pos': [to_pos[0], to_pos[1]],
+        })
+    
+    async def handle_clear_premoves(self, data: Dict[str, Any]):
+        """Drop this player's queued premoves"""
+        if not self.player:
+            await self.send_error("Not authenticated")
+            return
+        
+        await self.submit_premoves('clear_premoves', {})
+    
+    async def submit_premoves(self, command: str, kwargs: Dict[str, Any]):
+        """Run a premove command on the game's owner and report the queue to this player"""
+        try:
+            result = await affinity.submit(self.game_id, command, {
+                'game_id': str(self.game_id),
+                'player_id': str(self.player.id),
+                **kwargs,
+            })
+            if not result['success']:
+                await self.send_error(result.get('error', 'Invalid premove'), **(
+                    {'code': result['code']} if result.get('code') else {}
+                ))
+                return
+            
+            await self.send_json({
+                'event': 'premoves',
+                'data': {'premoves': result['premoves']}
+            })
+            # The turn had already passed to this player: the premove was played at once
+            if result['moves']:
+                await self.broadcast_moves(result['moves'])
+        except Exception as e:
+            logger.error(f"Error handling premove: {e}")
+            await self.send_error("Failed to process premove")
+    
     async def handle_investor_transform(self, data: Dict[str, Any]):
         """Handle Investor transform action"""
         if not self.player:
@@ -255,56 +371,24 @@ class GameConsumer(AsyncWebsocketConsumer):
                 await self.send_error("Missing transform data")
                 return
             
-            result = await self.process_investor_transform(investor_id, target_piece_id)
-            
-            if result['success']:
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'investor_transform_made',
-                        'transform_data': result
-                    }
-                )
-            else:
-                await self.send_error(result.get('error', 'Invalid transform'))
+            # A turn like a move: applied by the game's owner and announced as move_made
+            result = await affinity.submit(self.game_id, 'investor_transform', {
+                'game_id': str(self.game_id),
+                'player_id': str(self.player.id),
+                'investor_id': str(investor_id),
+                'target_piece_id': str(target_piece_id),
+                'expected_version': data.get('state_version'),
+            })
+            await self.report_move(result, 'Invalid transform')
                 
         except Exception as e:
             logger.error(f"Error processing investor transform: {e}")
             await self.send_error("Failed to process transform")
     
     async def handle_place_piece(self, data: Dict[str, Any]):
-        """Handle Strategist piece placement"""
-        if not self.player:
-            await self.send_error("Not authenticated")
-            return
-        
-        try:
-            piece_id = data.get('piece_id')
-            position = data.get('position')  # [x, y]
-            
-            if not all([piece_id, position]):
-                await self.send_error("Missing placement data")
-                return
-            
-            result = await self.process_piece_placement(
-                piece_id, 
-                Position(position[0], position[1])
-            )
-            
-            if result['success']:
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'piece_placed',
-                        'placement_data': result
-                    }
-                )
-            else:
-                await self.send_error(result.get('error', 'Invalid placement'))
-                
-        except Exception as e:
-            logger.error(f"Error processing piece placement: {e}")
-            await self.send_error("Failed to process placement")
+        """Strategist piece placement is not supported yet"""
+        # The engine only loads pieces on the board, so it never sees the captured piece to place
+        await self.send_error("Piece placement is not supported", code='unsupported')
     
     async def handle_reconnect(self, data: Dict[str, Any]):
         """Handle player reconnection"""
@@ -320,33 +404,33 @@ class GameConsumer(AsyncWebsocketConsumer):
                 await self.send_error("Invalid player token")
                 return
             
-            # Update connection status
-            await self.update_player_connection(self.player.id, True)
-            
-            # Send current game state
-            await self.send_game_state()
+            # Notifies other players unless the player never went offline
+            await self.mark_online()
             
-            # Notify other players
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'player_reconnected',
-                    'player_id': str(self.player.id),
-                    'player_name': self.player.name
-                }
-            )
+            # Send what the client missed, or the current game state
+            await self.send_game_state(data.get('last_seq'))
             
         except Exception as e:
             logger.error(f"Error reconnecting: {e}")
             await self.send_error("Failed to reconnect")
     
+    async def mark_online(self):
+        """Register this socket for the player and announce them if they just came online"""
+        presence.ensure_running(self.channel_layer)
+        came_online = await sync_to_async(presence.connect)(self.game_id, self.player.id, self.channel_name)
+        clocks.cancel_abandon(self.game_id, self.player.id)
+        if came_online:
+            await self.broadcast('presence_changed', {
+                'player_id': str(self.player.id),
+                'is_connected': True
+            })
+    
     # Database operations
     
-    @database_sync_to_async
-    def get_player_by_token(self, token: str) -> Optional[Player]:
+    async def get_player_by_token(self, token: str) -> Optional[Player]:
         """Get player by token"""
         try:
-            return Player.objects.get(player_token=token, game_id=self.game_id)
+            return await Player.objects.aget(player_token=token, game_id=self.game_id)
         except ObjectDoesNotExist:
             return None
     
@@ -372,42 +456,40 @@ class GameConsumer(AsyncWebsocketConsumer):
                 name=name,
                 is_host=is_host
             )
+            Game.objects.filter(pk=game.pk).bump_state_version()
+            lobby.players_changed(game)
             return player
             
         except ObjectDoesNotExist:
             return None
     
-    @database_sync_to_async
-    def update_player_connection(self, player_id: str, is_connected: bool):
-        """Update player connection status"""
-        Player.objects.filter(id=player_id).update(is_connected=is_connected)
-    
-    @database_sync_to_async
-    def update_player_color(self, player_id: str, color: str):
+    async def update_player_color(self, player_id: str, color: str):
         """Update player color"""
-        Player.objects.filter(id=player_id).update(color=color)
+        await Player.objects.filter(id=player_id).aupdate(color=color)
+        await Game.objects.filter(id=self.game_id).abump_state_version()
         self.player.color = color
     
-    @database_sync_to_async
-    def update_player_ready(self, player_id: str, is_ready: bool):
+    async def update_player_ready(self, player_id: str, is_ready: bool):
         """Update player ready status"""
-        Player.objects.filter(id=player_id).update(is_ready=is_ready)
+        await Player.objects.filter(id=player_id).aupdate(is_ready=is_ready)
+        await Game.objects.filter(id=self.game_id).abump_state_version()
         self.player.is_ready = is_ready
     
-    @database_sync_to_async
-    def check_can_start_game(self) -> bool:
-        """Check if game can start"""
-        try:
-            game = Game.objects.get(id=self.game_id)
-            return (game.players.count() == 2 and 
-                   game.players.filter(is_ready=True).count() == 2 and
-                   game.status == Game.Status.WAITING)
-        except ObjectDoesNotExist:
-            return False
+    async def check_can_start_game(self) -> bool:
+        """Check if game can start: two players of a waiting game, both ready"""
+        counts = await Player.objects.filter(
+            game_id=self.game_id,
+            game__status=Game.Status.WAITING
+        ).aaggregate(
+            players=Count('id'),
+            ready=Count('id', filter=Q(is_ready=True))
+        )
+        return counts['players'] == 2 and counts['ready'] == 2
     
     @database_sync_to_async
     def start_game(self):
-        """Start the game"""
+        """Start the game; returns when the first player runs out of time, if timed"""
+        from datetime import timedelta
         from django.utils import timezone
         
         game = Game.objects.get(id=self.game_id)
@@ -417,10 +499,21 @@ class GameConsumer(AsyncWebsocketConsumer):
         # Set first player as current turn
         first_player = game.players.first()
         game.current_turn_player = first_player
-        game.save()
+        
+        # Start the clocks
+        if game.clock_initial:
+            game.players.update(clock_remaining_ms=game.clock_initial * 1000)
+            game.turn_deadline = game.started_at + timedelta(seconds=game.clock_initial)
+        game.save(update_fields=['status', 'started_at', 'current_turn_player', 'turn_deadline', 'updated_at'])
         
         # Initialize pieces for both players
         self._initialize_game_pieces(game)
+        
+        # Starting position is the first replay keyframe
+        replay.capture_snapshot(game, 0)
+        Game.objects.filter(pk=game.pk).bump_state_version()
+        lobby.status_changed(game)
+        return game.turn_deadline
     
     def _initialize_game_pieces(self, game: Game):
         """Initialize starting pieces for the game"""
@@ -448,62 +541,19 @@ class GameConsumer(AsyncWebsocketConsumer):
                 position_y=6  # Seventh row
             )
     
-    async def process_move(self, piece_id: str, from_pos: Position, to_pos: Position) -> Dict[str, Any]:
+    async def process_move(self, piece_id: str, from_pos: Position, to_pos: Position,
+                           expected_version: Optional[int] = None) -> Dict[str, Any]:
         """Process and validate a move"""
         try:
-            # Load current game state
-            game_pieces = await self.get_game_pieces()
-            players = await self.get_game_players()
-            
-            # Initialize engine with current state
-            engine = GameEngine()
-            engine_pieces = []
-            
-            for piece in game_pieces:
-                engine_pieces.append(GamePiece(
-                    id=str(piece.id),
-                    owner_id=str(piece.owner.id),
-                    piece_type=PieceType(piece.piece_type),
-                    level=piece.level,
-                    position=Position(piece.position_x, piece.position_y),
-                    transform_count=piece.transform_count,
-                    temporary_buffs=piece.temporary_buffs,
-                    is_active=piece.is_active
-                ))
-            
-            engine.load_board_state(engine_pieces, {str(p.id): p for p in players})
-            
-            # Validate and apply move
-            result = engine.apply_move(piece_id, from_pos, to_pos, str(self.player.id))
-            
-            if result.success:
-                # Save move to database
-                move_number = await self.get_next_move_number()
-                move = await self.save_move(piece_id, from_pos, to_pos, move_number, result)
-                
-                # Update pieces in database
-                await self.update_pieces_from_engine(engine_pieces)
-                
-                # Check for winner
-                winner = engine.check_win_condition()
-                
-                return {
-                    'success': True,
-                    'move_id': str(move.id),
-                    'player_id': str(self.player.id),
-                    'from': [from_pos.x, from_pos.y],
-                    'to': [to_pos.x, to_pos.y],
-                    'events': result.events,
-                    'board_changes': result.board_changes,
-                    'winner': winner,
-                    'turn': await self.advance_turn()
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': result.error_message
-                }
-                
+            # Applied by the worker that owns the game
+            return await affinity.submit(self.game_id, 'apply_move', {
+                'game_id': str(self.game_id),
+                'player_id': str(self.player.id),
+                'piece_id': str(piece_id),
+                'from_pos': [from_pos.x, from_pos.y],
+                'to_pos': [to_pos.x, to_pos.y],
+                'expected_version': expected_version,
+            })
         except Exception as e:
             logger.error(f"Error in process_move: {e}")
             return {
@@ -511,149 +561,216 @@ class GameConsumer(AsyncWebsocketConsumer):
                 'error': 'Internal server error'
             }
     
-    @database_sync_to_async
-    def get_game_pieces(self):
-        """Get all active pieces for the game"""
-        return list(Piece.objects.filter(game_id=self.game_id, is_active=True))
-    
-    @database_sync_to_async
-    def get_game_players(self):
-        """Get all players for the game"""
-        return list(Player.objects.filter(game_id=self.game_id))
-    
-    @database_sync_to_async
-    def get_next_move_number(self) -> int:
-        """Get next move number"""
-        game = Game.objects.get(id=self.game_id)
-        last_move = game.moves.last()
-        return (last_move.move_number + 1) if last_move else 1
-    
-    @database_sync_to_async
-    def save_move(self, piece_id: str, from_pos: Position, to_pos: Position, 
-                  move_number: int, result) -> Move:
-        """Save move to database"""
-        piece = Piece.objects.get(id=piece_id)
-        
-        move = Move.objects.create(
-            game_id=self.game_id,
-            player=self.player,
-            piece=piece,
-            move_type=Move.MoveType.MOVE,
-            from_x=from_pos.x,
-            from_y=from_pos.y,
-            to_x=to_pos.x,
-            to_y=to_pos.y,
-            move_number=move_number,
-            move_data={'events': result.events, 'changes': result.board_changes},
-            is_valid=True
-        )
-        
-        # Save events
-        for event in result.events:
-            GameEvent.objects.create(
-                game_id=self.game_id,
-                move=move,
-                event_type=event['type'],
-                event_data=event.get('data', {})
-            )
-        
-        return move
-    
-    @database_sync_to_async
-    def advance_turn(self) -> str:
-        """Advance to next player's turn"""
-        game = Game.objects.get(id=self.game_id)
-        players = list(game.players.all())
-        
-        # Find current player index and advance
-        current_index = 0
-        for i, player in enumerate(players):
-            if player.id == game.current_turn_player_id:
-                current_index = i
-                break
-        
-        next_index = (current_index + 1) % len(players)
-        game.current_turn_player = players[next_index]
-        game.turn_count += 1
-        game.save()
+    async def report_move(self, result: Dict[str, Any], default_error: str):
+        """Announce an applied move and the premoves it triggered, or tell this client why it failed"""
+        if result['success']:
+            await self.broadcast_moves([result] + result.pop('premoves_played', []))
+        elif result.get('code') == 'stale_state':
+            await self.send_error(result['error'], code=result['code'], state_version=result['state_version'])
+        elif result.get('code') in ('busy', 'flagged', 'timeout'):
+            await self.send_error(result['error'], code=result['code'])
+        else:
+            await self.send_error(result.get('error', default_error))
+    
+    async def broadcast_moves(self, results: List[Dict[str, Any]]):
+        """Announce applied moves, including premoves they triggered, back to back"""
+        await events.publish_moves(self.channel_layer, self.game_id, results)
+    
+    # Broadcasting
+    
+    async def broadcast(self, event: str, data: Dict[str, Any]):
+        """Send a sequenced event to every socket of this game"""
+        await events.publish(self.channel_layer, self.game_id, event, data)
+    
+    async def game_frame(self, event):
+        """Forward a game event encoded once by the sender"""
+        seq = event.get('seq')
+        # Already in the snapshot or resume this client got. Frames are not
+        # deduplicated against each other: they can arrive out of seq order
+        if seq is not None and self.covered_seq is not None and seq <= self.covered_seq:
+            return
         
-        return str(players[next_index].id)
-    
-    # WebSocket message handlers for broadcasting
-    
-    async def player_joined_broadcast(self, event):
-        """Broadcast player joined event"""
-        await self.send_json({
-            'event': 'player_joined',
-            'data': {
-                'player_id': event['player_id'],
-                'player_name': event['player_name'],
-                'color': event['color']
-            }
-        })
-    
-    async def move_made(self, event):
-        """Broadcast move made event"""
-        await self.send_json({
-            'event': 'move_made',
-            'data': event['move_data']
-        })
-    
-    async def color_changed(self, event):
-        """Broadcast color change event"""
-        await self.send_json({
-            'event': 'color_changed',
-            'data': {
-                'player_id': event['player_id'],
-                'color': event['color']
-            }
-        })
-    
-    async def player_ready_changed(self, event):
-        """Broadcast ready status change"""
-        await self.send_json({
-            'event': 'player_ready_changed',
-            'data': {
-                'player_id': event['player_id'],
-                'ready': event['ready']
-            }
-        })
-    
-    async def game_started(self, event):
-        """Broadcast game started"""
-        await self.send_json({
-            'event': 'game_started',
-            'data': event.get('data', {})
-        })
+        if not self.is_binary:
+            await self.send(text_data=event['text'])
+        elif event.get('bytes') is not None:
+            await self.send(bytes_data=event['bytes'])
+        else:
+            # The sender could not encode MessagePack
+            await self.send_json(codec.loads(event['text']))
     
     async def send_json(self, data: Dict[str, Any]):
-        """Send JSON message"""
-        await self.send(text_data=json.dumps(data))
-    
-    async def send_error(self, message: str):
+        """Send a message in the negotiated format"""
+        if not self.is_binary:
+            await self.send(text_data=codec.dumps(data))
+            return
+        
+        if data.get('event') == 'move_made':
+            # Pieces placed since the index was loaded need references
+            piece_ids = protocol.move_piece_ids(data.get('data', {}))
+            index = await self.get_piece_index()
+            if any(piece_id not in index for piece_id in piece_ids):
+                await self.get_piece_index(refresh=True)
+        elif self.piece_index is None:
+            await self.get_piece_index()
+        await self.send(bytes_data=protocol.encode(data, self.piece_index))
+    
+    async def decode_frame(self, frame: bytes) -> Dict[str, Any]:
+        """Decode a binary frame, reloading piece references if it names an unknown piece"""
+        message = protocol.decode(frame, await self.get_piece_index())
+        if message['action'] in ('make_move', 'premove') and message['data'].get('piece_id') is None:
+            message = protocol.decode(frame, await self.get_piece_index(refresh=True))
+        return message
+    
+    async def get_piece_index(self, refresh: bool = False) -> protocol.PieceIndex:
+        """Small-integer piece references for binary frames"""
+        if self.piece_index is None or refresh:
+            self.piece_index = await database_sync_to_async(protocol.PieceIndex.load)(self.game_id)
+        return self.piece_index
+    
+    async def send_error(self, message: str, **extra):
         """Send error message"""
         await self.send_json({
             'event': 'error',
-            'data': {'message': message}
+            'data': {'message': message, **extra}
         })
     
-    async def send_game_state(self):
-        """Send current game state"""
+    async def send_game_state(self, last_seq: Optional[int] = None):
+        """
+        Bring the client up to date.
+        
+        A client that reports the last sequence number it saw gets only the
+        events it missed, as long as they are still buffered; everyone else
+        gets the full game state, tagged with the sequence it reflects.
+        """
         try:
+            if isinstance(last_seq, int):
+                missed = await sync_to_async(events.since)(self.game_id, last_seq)
+                if missed is not None:
+                    self.mark_covered(missed[-1]['seq'] if missed else last_seq)
+                    for message in missed:
+                        await self.send_json(message)
+                    await self.send_json({'event': 'resumed', 'data': {'count': len(missed)}})
+                    return
+            
+            # Read the sequence first: later events may repeat, never go missing
+            seq = await sync_to_async(events.current_seq)(self.game_id)
             game_data = await self.get_game_data()
+            if game_data['status'] == Game.Status.ACTIVE:
+                # Covers deadlines set by another worker or before a restart
+                clocks.schedule_flag(self.game_id, parse_datetime(game_data['turn_deadline'] or ''))
+            if self.is_binary:
+                index = await self.get_piece_index(refresh=True)
+                game_data = {**game_data, 'piece_index': index.ids}
+            self.mark_covered(seq)
             await self.send_json({
                 'event': 'game_state',
-                'data': game_data
+                'data': game_data,
+                'seq': seq
             })
         except Exception as e:
             logger.error(f"Error sending game state: {e}")
             await self.send_error("Failed to load game state")
     
-    @database_sync_to_async
-    def get_game_data(self) -> Dict[str, Any]:
+    def mark_covered(self, seq: int):
+        """Drop group frames up to seq from now on; the client got them from a snapshot or resume"""
+        self.covered_seq = seq if self.covered_seq is None else max(self.covered_seq, seq)
+    
+    async def get_game_data(self) -> Dict[str, Any]:
         """Get complete game data"""
-        from .serializers import GameSerializer
+        # with_details() fetches everything the serializer reads, so it runs on the loop
+        game = await Game.objects.with_details().aget(id=self.game_id)
+        return GameSerializer(game).data
+
+
+class SpectatorConsumer(AsyncWebsocketConsumer):
+    """Read-only WebSocket consumer streaming coalesced board frames to watchers"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.game_id = None
+        self.subprotocol = None
+        self.frames = deque(maxlen=spectators.SPECTATOR_QUEUE_SIZE)
+        self.writer = None
+        self.watching = False
+    
+    async def connect(self):
+        """Join the spectator group and send the current board"""
+        self.game_id = self.scope['url_route']['kwargs']['game_id']
+        if not await Game.objects.filter(pk=self.game_id).aexists():
+            await self.close()
+            return
         
-        game = Game.objects.get(id=self.game_id)
-        serializer = GameSerializer(game)
-        return serializer.data
\ No newline at end of file
+        await self.channel_layer.group_add(spectators.group_name(self.game_id), self.channel_name)
+        self.subprotocol = protocol.negotiate(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.subprotocol)
+        await sync_to_async(spectators.joined)(self.game_id)
+        self.watching = True
+        serverloop.bind()
+        spectators.ensure_running(self.channel_layer)
+        
+        frames = await database_sync_to_async(spectators.build_frame)(self.game_id, [])
+        await self.spectator_frame(frames)
+    
+    async def disconnect(self, close_code):
+        """Leave the spectator group"""
+        if self.writer is not None:
+            self.writer.cancel()
+        if self.watching:
+            await self.channel_layer.group_discard(spectators.group_name(self.game_id), self.channel_name)
+            await sync_to_async(spectators.left)(self.game_id)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """Spectators cannot act on the game"""
+        await self.send(text_data=codec.dumps({
+            'event': 'error',
+            'data': {'message': 'Spectator channel is read-only'}
+        }))
+    
+    async def spectator_frame(self, event):
+        """Queue a frame, dropping the oldest undelivered one when the queue is full"""
+        self.frames.append(event)
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.ensure_future(self.write_frames())
+    
+    async def write_frames(self):
+        """Send queued frames without holding up the channel layer"""
+        while self.frames:
+            event = self.frames.popleft()
+            if self.subprotocol == protocol.MSGPACK_SUBPROTOCOL and event.get('bytes') is not None:
+                await self.send(bytes_data=event['bytes'])
+            else:
+                await self.send(text_data=event['text'])
+
+
+class LobbyConsumer(AsyncWebsocketConsumer):
+    """Read-only WebSocket consumer pushing lobby changes"""
+    
+    async def connect(self):
+        """Send the lobby snapshot once, then stream deltas"""
+        await self.channel_layer.group_add(lobby.LOBBY_GROUP, self.channel_name)
+        await self.accept()
+        
+        snapshot = await lobby.aget_lobby()
+        await self.send_json({
+            'event': 'lobby_snapshot',
+            'data': snapshot['data']
+        })
+    
+    async def disconnect(self, close_code):
+        """Leave the lobby group"""
+        await self.channel_layer.group_discard(lobby.LOBBY_GROUP, self.channel_name)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """The lobby channel does not accept actions"""
+        await self.send_json({
+            'event': 'error',
+            'data': {'message': 'Lobby channel is read-only'}
+        })
+    
+    async def lobby_delta(self, event):
+        """Forward a lobby delta encoded once by the sender"""
+        await self.send(text_data=event['text'])
+    
+    async def send_json(self, data: Dict[str, Any]):
+        """Send JSON message"""
+        await self.send(text_data=codec.dumps(data))
@@ -42,6 +42,9 @@ class Position:
             return (self.x, self.y) == other
         return isinstance(other, Position) and self.x == other.x and self.y == other.y
     
+    def __hash__(self):
+        return hash((self.x, self.y))
+    
     def distance(self, other):
         """Calculate Chebyshev distance (max of x and y differences)"""
         return max(abs(self.x - other.x), abs(self.y - other.y))
@@ -0,0 +1,128 @@
+"""
+Sequenced game events for TI Chess
+
+Every event broadcast to a game group gets the next sequence number of that
+game and is kept in the cache for EVENT_BUFFER_TTL seconds. The last
+EVENT_BUFFER_SIZE events form a ring buffer that reconnecting clients
+resume from: a client reporting the last sequence number it saw receives
+only the events it missed, and a full game_state only when the gap is
+larger than the buffer or has expired.
+
+Broadcasts are encoded once, by the sender, into a JSON text frame and a
+MessagePack binary frame. Consumers forward the frame for their format
+without serializing anything per socket.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .syncpool import sync_to_async
+from . import codec, protocol
+
+
+EVENT_BUFFER_SIZE = getattr(settings, 'GAME_EVENT_BUFFER_SIZE', 100)
+EVENT_BUFFER_TTL = getattr(settings, 'GAME_EVENT_BUFFER_TTL', 60 * 60)
+
+
+def group_name(game_id) -> str:
+    return f'game_{game_id}'
+
+
+def _seq_key(game_id) -> str:
+    return f'game_events:{game_id}:seq'
+
+
+def _event_key(game_id, seq: int) -> str:
+    return f'game_events:{game_id}:{seq}'
+
+
+def _initial_seq() -> int:
+    # Time-based so an evicted counter restarts past every sequence a
+    # client has seen, which forces those clients onto a full snapshot
+    return int(time.time() * 1000)
+
+
+def current_seq(game_id) -> int:
+    """Sequence number of the latest event of a game"""
+    seq = cache.get(_seq_key(game_id))
+    if seq is None:
+        cache.add(_seq_key(game_id), _initial_seq(), timeout=None)
+        seq = cache.get(_seq_key(game_id), 0)
+    return seq
+
+
+def record(game_id, event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Assign the next sequence number to an event and buffer it"""
+    try:
+        seq = cache.incr(_seq_key(game_id))
+    except ValueError:
+        current_seq(game_id)
+        seq = cache.incr(_seq_key(game_id))
+    message = {'event': event, 'data': data, 'seq': seq}
+    cache.set(_event_key(game_id, seq), message, timeout=EVENT_BUFFER_TTL)
+    return message
+
+
+def since(game_id, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Events after last_seq, oldest first.
+
+    None means the client is too far behind and needs a full snapshot.
+    """
+    seq = current_seq(game_id)
+    if last_seq > seq or seq - last_seq > EVENT_BUFFER_SIZE:
+        return None
+
+    keys = [_event_key(game_id, n) for n in range(last_seq + 1, seq + 1)]
+    buffered = cache.get_many(keys)
+    if len(buffered) != len(keys):
+        return None
+    return [buffered[key] for key in keys]
+
+
+def encode(game_id, message: Dict[str, Any],
+           index: Optional[protocol.PieceIndex] = None) -> Dict[str, Any]:
+    """Wire frames of a message: 'text' for JSON sockets, 'bytes' for binary ones"""
+    frames = {'text': codec.dumps(message), 'bytes': None}
+    if protocol.msgpack is not None:
+        if index is None and message['event'] == 'move_made':
+            index = protocol.shared_index(game_id, protocol.move_piece_ids(message['data']))
+        frames['bytes'] = protocol.encode(message, index)
+    return frames
+
+
+def _prepare(game_id, event: str, data: Dict[str, Any]):
+    message = record(game_id, event, data)
+    return message, encode(game_id, message)
+
+
+async def publish(channel_layer, game_id, event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sequence an event, encode it once and send it to every player socket.
+
+    Spectators get the change in their next coalesced frame.
+    """
+    from . import spectators
+
+    message, frames = await sync_to_async(_prepare)(game_id, event, data)
+    await channel_layer.group_send(group_name(game_id), {
+        'type': 'game_frame',
+        'seq': message['seq'],
+        **frames
+    })
+    spectators.mark(game_id, event)
+    return message
+
+
+async def publish_moves(channel_layer, game_id, results: List[Dict[str, Any]]):
+    """Announce applied moves, including premoves they triggered, back to back, then a win"""
+    for result in results:
+        await publish(channel_layer, game_id, 'move_made', result)
+
+    winner = results[-1].get('winner')
+    if winner:
+        # Stats and the final snapshot are handled by the post-game pipeline
+        await publish(channel_layer, game_id, 'game_ended', {'winner': winner})
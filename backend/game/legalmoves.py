@@ -0,0 +1,97 @@
+"""
+Legal moves for TI Chess
+
+Clients ask the server where a piece can go instead of guessing or
+submitting a move and waiting for the refusal. GameEngine.get_valid_moves
+is run for every active piece at once and, like board payloads, the result
+is cached per (game, state_version), since a version's moves never change.
+
+services.apply_move computes the moves of the version it commits from the
+engine it already holds, so the cache is primed without another board
+load. With GAME_PUSH_LEGAL_MOVES, move_made also carries the moves of the
+side to move in compact form: one [from, to, to, ...] list per piece that
+can move, with squares numbered y * 8 + x.
+"""
+
+from typing import Any, Dict, List
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .engine import GameEngine, Position
+from .syncpool import sync_to_async
+
+
+LEGAL_MOVES_CACHE_TIMEOUT = getattr(settings, 'BOARD_CACHE_TIMEOUT', 300)
+PUSH_LEGAL_MOVES = getattr(settings, 'GAME_PUSH_LEGAL_MOVES', True)
+
+
+def moves_etag(game_id, piece_id, version: int) -> str:
+    return f'"moves-{game_id}-{piece_id}-{version}"'
+
+
+def _cache_key(game_id, version: int) -> str:
+    return f'moves:{game_id}:{version}'
+
+
+def square(position: Position) -> int:
+    return position.y * 8 + position.x
+
+
+def from_engine(engine: GameEngine) -> Dict[str, Dict[str, Any]]:
+    """Valid moves of every active piece on the engine's board, by piece id"""
+    pieces = {}
+    for piece in engine.board.values():
+        if not piece.is_active:
+            continue
+        # get_valid_moves uses up one-shot range buffs; leave the engine's pieces as they were
+        buffs = dict(piece.temporary_buffs)
+        moves = engine.get_valid_moves(piece)
+        piece.temporary_buffs = buffs
+        pieces[piece.id] = {
+            'owner_id': piece.owner_id,
+            'from': [piece.position.x, piece.position.y],
+            'moves': [[move.x, move.y] for move in moves],
+        }
+    return pieces
+
+
+def store(game_id, version: int, pieces: Dict[str, Dict[str, Any]]):
+    cache.set(_cache_key(game_id, version), pieces, timeout=LEGAL_MOVES_CACHE_TIMEOUT)
+
+
+def get_moves(game_id, version: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Valid moves of every active piece, served from the cache when version matches.
+
+    The board is loaded after version was read, so it is only known to be
+    that version's board if the game is still at version once it is loaded;
+    otherwise the moves are returned but not cached.
+    """
+    from .board import current_version
+    from .services import load_engine
+
+    pieces = cache.get(_cache_key(game_id, version))
+    if pieces is None:
+        engine, _, _ = load_engine(game_id)
+        pieces = from_engine(engine)
+        if current_version(game_id) == version:
+            store(game_id, version, pieces)
+    return pieces
+
+
+async def aget_moves(game_id, version: int) -> Dict[str, Dict[str, Any]]:
+    """Async get_moves"""
+    pieces = await cache.aget(_cache_key(game_id, version))
+    if pieces is None:
+        pieces = await sync_to_async(get_moves)(game_id, version)
+    return pieces
+
+
+def compact(pieces: Dict[str, Dict[str, Any]], player_id) -> List[List[int]]:
+    """Moves of one player's pieces as [from, to, to, ...] square lists"""
+    return [
+        [square(Position(*entry['from']))] + [square(Position(*move)) for move in entry['moves']]
+        for entry in pieces.values()
+        if entry['owner_id'] == str(player_id) and entry['moves']
+    ]
@@ -0,0 +1,226 @@
+"""
+Cached lobby listing for TI Chess
+
+The lobby payload is serialized once and shared through the Django cache.
+Game lifecycle events (create, join, start, finish) bump a generation
+counter, which retires every cached payload at once. Concurrent cache misses
+are collapsed into a single rebuild guarded by a cache lock.
+
+The same events are pushed as small deltas to the lobby WebSocket group, so
+connected lobby viewers never need to poll. Like game events, a delta is
+encoded once by the sender and forwarded as is by every lobby socket.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+from asgiref.sync import async_to_sync  # type: ignore
+from channels.layers import get_channel_layer  # type: ignore
+
+from .models import Game
+from .syncpool import sync_to_async
+from . import codec
+
+
+logger = logging.getLogger(__name__)
+
+LOBBY_SIZE = 20
+LOBBY_CACHE_TIMEOUT = getattr(settings, 'LOBBY_CACHE_TIMEOUT', 30)
+REBUILD_LOCK_TIMEOUT = 5
+REBUILD_WAIT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+
+GENERATION_KEY = 'lobby:generation'
+LOBBY_GROUP = 'lobby'
+
+
+def _initial_generation() -> int:
+    # Time-based so an evicted counter never revives an old payload key
+    return int(time.time() * 1000)
+
+
+def _generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, _initial_generation(), timeout=None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def _payload_key(generation: int, include_private: bool) -> str:
+    variant = 'all' if include_private else 'public'
+    return f'lobby:payload:{generation}:{variant}'
+
+
+def build_lobby(include_private: bool = False) -> Dict[str, Any]:
+    """Query and serialize the lobby, returning the data and its ETag"""
+    from .serializers import GameSerializer
+
+    games = Game.objects.filter(status__in=[Game.Status.WAITING, Game.Status.ACTIVE])
+    if not include_private:
+        games = games.filter(is_public=True)
+    games = games.with_details().order_by('-created_at')[:LOBBY_SIZE]
+
+    encoded = codec.dumps_bytes(GameSerializer(games, many=True).data)
+    return {
+        'etag': '"lobby-%s"' % hashlib.md5(encoded).hexdigest(),
+        'data': codec.loads(encoded),
+    }
+
+
+def get_lobby(include_private: bool = False) -> Dict[str, Any]:
+    """Return the cached lobby payload, rebuilding it at most once per miss"""
+    generation = _generation()
+    key = _payload_key(generation, include_private)
+
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, timeout=REBUILD_LOCK_TIMEOUT):
+        # Another request is rebuilding; wait for its result
+        deadline = time.monotonic() + REBUILD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REBUILD_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        logger.warning("Timed out waiting for lobby rebuild")
+        return build_lobby(include_private)
+
+    try:
+        entry = cache.get(key)
+        if entry is None:
+            entry = build_lobby(include_private)
+            cache.set(key, entry, timeout=LOBBY_CACHE_TIMEOUT)
+        return entry
+    finally:
+        cache.delete(lock_key)
+
+
+async def aget_lobby(include_private: bool = False) -> Dict[str, Any]:
+    """Async get_lobby: cache reads are awaited and a rebuild is one sync call"""
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        return await sync_to_async(get_lobby)(include_private)
+    key = _payload_key(generation, include_private)
+
+    entry = await cache.aget(key)
+    if entry is not None:
+        return entry
+
+    lock_key = f'{key}:lock'
+    if not await cache.aadd(lock_key, 1, timeout=REBUILD_LOCK_TIMEOUT):
+        # Wait on the loop, not on the sync thread
+        deadline = time.monotonic() + REBUILD_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(REBUILD_POLL_INTERVAL)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry
+        logger.warning("Timed out waiting for lobby rebuild")
+        return await sync_to_async(build_lobby)(include_private)
+
+    try:
+        entry = await cache.aget(key)
+        if entry is None:
+            entry = await sync_to_async(build_lobby)(include_private)
+            await cache.aset(key, entry, timeout=LOBBY_CACHE_TIMEOUT)
+        return entry
+    finally:
+        await cache.adelete(lock_key)
+
+
+def listing_key(include_private: bool, *page) -> str:
+    """
+    Cache key of one page of the paginated game listing.
+
+    Pages share the lobby generation, so lifecycle events retire them
+    together with the lobby payloads. page is whatever selects the page,
+    e.g. the cursor, page size and host the links are built for.
+    """
+    variant = 'all' if include_private else 'public'
+    digest = hashlib.md5(repr(page).encode()).hexdigest()
+    return f'lobby:listing:{_generation()}:{variant}:{digest}'
+
+
+def invalidate():
+    """Retire all cached lobby payloads after a game lifecycle event"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, _initial_generation(), timeout=None)
+
+
+def _broadcast(event: str, data: Dict[str, Any]):
+    """Push a lobby delta, encoded once, to every connected lobby viewer"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    try:
+        async_to_sync(channel_layer.group_send)(LOBBY_GROUP, {
+            'type': 'lobby_delta',
+            'text': codec.dumps({'event': event, 'data': data}),
+        })
+    except Exception as e:
+        logger.error(f"Error broadcasting lobby delta {event}: {e}")
+
+
+def _player_rows(game: Game) -> List[Dict[str, Any]]:
+    """Public fields of a game's players; tokens and pieces stay out of lobby deltas"""
+    return [
+        {'id': str(player['id']), 'name': player['name'], 'color': player['color']}
+        for player in game.players.values('id', 'name', 'color')
+    ]
+
+
+def lobby_row(game: Game) -> Dict[str, Any]:
+    """The lobby's view of one game, as pushed in game_added"""
+    players = _player_rows(game)
+    return {
+        'id': str(game.id),
+        'name': game.name,
+        'is_public': game.is_public,
+        'status': game.status,
+        'player_count': len(players),
+        'players': players,
+        'created_at': game.created_at.isoformat(),
+    }
+
+
+def game_added(game: Game):
+    """A game was created"""
+    invalidate()
+    if game.is_public:
+        _broadcast('game_added', lobby_row(game))
+
+
+def players_changed(game: Game):
+    """A player joined or left a waiting game"""
+    invalidate()
+    if game.is_public:
+        players = _player_rows(game)
+        _broadcast('player_count_changed', {
+            'game_id': str(game.id),
+            'player_count': len(players),
+            'players': players,
+        })
+
+
+def status_changed(game: Game):
+    """A game started or ended; ended games leave the lobby"""
+    invalidate()
+    if not game.is_public:
+        return
+
+    if game.status in (Game.Status.WAITING, Game.Status.ACTIVE):
+        _broadcast('game_status_changed', {'game_id': str(game.id), 'status': game.status})
+    else:
+        _broadcast('game_removed', {'game_id': str(game.id)})
@@ -0,0 +1,29 @@
+"""
+Management command to show the game-affinity ring
+"""
+
+from django.core.management.base import BaseCommand
+from game import affinity
+
+
+class Command(BaseCommand):
+    help = 'List the live workers of the affinity ring and the owners of games'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'game_ids',
+            nargs='*',
+            help='Games to look up the owning worker of'
+        )
+
+    def handle(self, *args, **options):
+        ring = affinity.HashRing(affinity.members())
+
+        if not affinity.AFFINITY_ENABLED:
+            self.stdout.write('Game affinity is off (GAME_AFFINITY); commands run where they arrive')
+        self.stdout.write(f'{len(ring.members)} workers')
+        for member in ring.members:
+            self.stdout.write(f'  {member}')
+
+        for game_id in options['game_ids']:
+            self.stdout.write(f'{game_id} -> {ring.owner(game_id) or "no worker"}')
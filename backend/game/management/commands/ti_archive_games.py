@@ -0,0 +1,59 @@
+"""
+Management command to move long-finished games into the compressed archive
+"""
+
+from django.core.management.base import BaseCommand
+from game import archive
+
+
+class Command(BaseCommand):
+    help = 'Archive finished and abandoned games and delete their hot rows'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=archive.ARCHIVE_AFTER_DAYS,
+            help='Archive games that ended more than this many days ago'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Maximum number of games to archive in this run'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=archive.ARCHIVE_DELETE_BATCH_SIZE,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many games would be archived'
+        )
+        
+    def handle(self, *args, **options):
+        games = archive.archivable_games(options['days'])
+        
+        if options['dry_run']:
+            count = games.count()
+            if options['limit'] is not None:
+                count = min(count, options['limit'])
+            self.stdout.write(f'{count} games would be archived')
+            return
+        
+        archives = archive.archive_games(
+            days=options['days'],
+            limit=options['limit'],
+            batch_size=options['batch_size']
+        )
+        
+        raw_size = sum(a.raw_size for a in archives)
+        stored_size = sum(len(a.payload) for a in archives)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Archived {len(archives)} games ({raw_size} bytes compressed to {stored_size})'
+            )
+        )
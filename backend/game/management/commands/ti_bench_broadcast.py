@@ -0,0 +1,129 @@
+"""
+Management command to benchmark fan-out of game broadcasts
+
+Compares the per-socket path, where every consumer serializes the event
+dict it receives, with frames encoded once by the sender. Runs against an
+in-memory channel layer and needs no database.
+"""
+
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from game import events, protocol
+from game.consumers import GameConsumer
+
+
+class BenchChannelLayer(InMemoryChannelLayer):
+    """In-memory layer without the expiry sweep, which scans every channel on every receive"""
+
+    def _clean_expired(self):
+        pass
+
+
+def sample_move(piece_ids):
+    """A move_made message shaped like a capture in a four-player game"""
+    return {
+        'event': 'move_made',
+        'data': {
+            'move_id': str(uuid.uuid4()),
+            'player_id': str(uuid.uuid4()),
+            'piece_id': piece_ids[0],
+            'from': [3, 1],
+            'to': [3, 5],
+            'events': [
+                {'type': 'capture', 'data': {'piece_id': piece_ids[1], 'by': piece_ids[0]}},
+                {'type': 'ability', 'data': {'ability': 'ceo_rally', 'targets': piece_ids[2:6]}},
+            ],
+            'board_changes': [
+                {'x': 3, 'y': 1, 'piece': None},
+                {'x': 3, 'y': 5, 'piece': piece_ids[0]},
+            ],
+            'turn': str(uuid.uuid4()),
+            'winner': None,
+            'state_version': 42,
+        },
+        'seq': 1,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark broadcasting a move to 2, 50 and 500 sockets of a game'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscribers',
+            type=int,
+            nargs='+',
+            default=[2, 50, 500],
+            help='Sockets per game to benchmark'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=200,
+            help='Broadcasts per measurement'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['json', 'msgpack'],
+            default='json',
+            help='Wire format of the subscribed sockets'
+        )
+
+    def handle(self, *args, **options):
+        if options['format'] == 'msgpack' and protocol.msgpack is None:
+            self.stderr.write('msgpack is not installed')
+            return
+
+        piece_ids = [str(uuid.uuid4()) for _ in range(64)]
+        index = protocol.PieceIndex(piece_ids)
+        message = sample_move(piece_ids)
+        subprotocol = protocol.MSGPACK_SUBPROTOCOL if options['format'] == 'msgpack' else None
+
+        self.stdout.write(f"{'sockets':>8} {'per-socket':>12} {'encode once':>12} {'speedup':>8}")
+        for count in options['subscribers']:
+            per_socket = async_to_sync(self.measure)(
+                count, options['rounds'], subprotocol, index, lambda: {
+                    'type': 'game_event', 'message': message
+                }, lambda consumer, event: consumer.send_json(event['message'])
+            )
+            encode_once = async_to_sync(self.measure)(
+                count, options['rounds'], subprotocol, index, lambda: {
+                    'type': 'game_frame', **events.encode(None, message, index)
+                }, lambda consumer, event: consumer.game_frame(event)
+            )
+            self.stdout.write(
+                f'{count:>8} {per_socket * 1000:>10.3f}ms {encode_once * 1000:>10.3f}ms '
+                f'{per_socket / encode_once:>7.1f}x'
+            )
+
+    async def measure(self, count, rounds, subprotocol, index, build, handle) -> float:
+        """Seconds per broadcast, from group_send until every socket has sent its frame"""
+        layer = BenchChannelLayer(capacity=rounds + 1)
+        sent = []
+
+        async def sink(message):
+            sent.append(message)
+
+        subscribers = []
+        for _ in range(count):
+            channel = await layer.new_channel()
+            await layer.group_add('bench', channel)
+            consumer = GameConsumer()
+            consumer.subprotocol = subprotocol
+            consumer.piece_index = index
+            consumer.base_send = sink
+            subscribers.append((channel, consumer))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await layer.group_send('bench', build())
+            for channel, consumer in subscribers:
+                await handle(consumer, await layer.receive(channel))
+        elapsed = time.perf_counter() - start
+
+        assert len(sent) == count * rounds
+        return elapsed / rounds
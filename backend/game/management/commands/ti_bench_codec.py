@@ -0,0 +1,89 @@
+"""
+Management command to benchmark the JSON codec against the stdlib
+
+Encodes and decodes a real GameSerializer payload and a move_made message.
+The game is created inside a transaction that is rolled back.
+"""
+
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from game import codec
+from game.models import Game, Piece, Player
+from game.serializers import GameSerializer
+from game.management.commands.ti_bench_broadcast import sample_move
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark JSON encoding and decoding of game payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=2000,
+            help='Encodes and decodes per measurement'
+        )
+
+    def handle(self, *args, **options):
+        if codec.orjson is None:
+            raise CommandError('orjson is not installed; the codec falls back to the stdlib')
+
+        rounds = options['rounds']
+        payloads = {
+            'GameSerializer': self.game_payload(),
+            'move_made': sample_move([str(uuid.uuid4()) for _ in range(64)]),
+        }
+
+        self.stdout.write(f"{'payload':<16} {'bytes':>7} {'':>7} {'stdlib':>10} {'codec':>10} {'speedup':>8}")
+        for name, payload in payloads.items():
+            encoded = stdlib_dumps(payload)
+            for step, stdlib, fast in (
+                ('encode', lambda: stdlib_dumps(payload), lambda: codec.dumps(payload)),
+                ('decode', lambda: json.loads(encoded), lambda: codec.loads(encoded)),
+            ):
+                slow_time = self.measure(stdlib, rounds)
+                fast_time = self.measure(fast, rounds)
+                self.stdout.write(
+                    f'{name:<16} {len(encoded):>7} {step:>7} {slow_time * 1e6:>8.1f}us '
+                    f'{fast_time * 1e6:>8.1f}us {slow_time / fast_time:>7.1f}x'
+                )
+
+    def measure(self, func, rounds) -> float:
+        """Seconds per call"""
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return (time.perf_counter() - start) / rounds
+
+    def game_payload(self):
+        """Serialized four-player game with a full board"""
+        with transaction.atomic():
+            game = Game.objects.create(name='Codec Benchmark', status=Game.Status.ACTIVE)
+            players = [
+                Player.objects.create(game=game, name=f'Player {n}', color=color)
+                for n, color in enumerate(['#ff6b6b', '#4ecdc4', '#45b7d1', '#f9ca24'])
+            ]
+            piece_types = [choice for choice, _ in Piece.PieceType.choices]
+            Piece.objects.bulk_create([
+                Piece(
+                    game=game,
+                    owner=player,
+                    piece_type=piece_types[x % len(piece_types)],
+                    position_x=x,
+                    position_y=row
+                )
+                for player, row in zip(players, [0, 1, 6, 7])
+                for x in range(8)
+            ])
+            data = GameSerializer(Game.objects.with_details().get(pk=game.pk)).data
+            transaction.set_rollback(True)
+        return data
@@ -0,0 +1,154 @@
+"""
+Management command to benchmark the async REST views against sync ones
+
+Concurrent requests go through Django's ASGI request handler in this
+process, as under Daphne. The sync baselines are the DRF views that served
+the lobby, board and health endpoints before they became async. A game
+with a full board is created for the run and deleted afterwards.
+"""
+
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import include, path
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.utils import timezone
+from game import board as board_state, lobby
+from game.models import Game, Piece, Player
+
+
+class SyncHealthView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return Response({'status': 'healthy', 'timestamp': timezone.now()})
+
+
+class SyncActiveGamesView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        entry = lobby.get_lobby()
+        if request.headers.get('If-None-Match') == entry['etag']:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        return response
+
+
+class SyncBoardView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pk):
+        version = board_state.current_version(pk)
+        if request.headers.get('If-None-Match') == board_state.board_etag(pk, version):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(board_state.get_board(pk, version))
+        response['ETag'] = board_state.board_etag(pk, version)
+        return response
+
+
+urlpatterns = [
+    path('sync/health/', SyncHealthView.as_view()),
+    path('sync/games/active/', SyncActiveGamesView.as_view()),
+    path('sync/games/<uuid:pk>/board/', SyncBoardView.as_view()),
+    path('', include('ti_chess.urls')),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the async lobby, board and health views against sync versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Requests per measurement'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            default=[1, 50],
+            help='Requests in flight at once; one measurement per value'
+        )
+
+    def handle(self, *args, **options):
+        game = self.create_game()
+        try:
+            endpoints = {
+                'health': ('/sync/health/', '/api/health/'),
+                'active games': ('/sync/games/active/', '/api/games/active/'),
+                'board': (f'/sync/games/{game.pk}/board/', f'/api/games/{game.pk}/board/'),
+            }
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=['testserver']):
+                async_to_sync(self.run)(endpoints, options['requests'], options['concurrency'])
+        finally:
+            game.delete()
+
+    async def run(self, endpoints, requests, concurrencies):
+        client = AsyncClient()
+        self.stdout.write(
+            f"{'endpoint':<14} {'conc':>5} {'':>6} {'req/s':>8} {'p50':>9} {'p99':>9}"
+        )
+        for name, paths in endpoints.items():
+            for concurrency in concurrencies:
+                for kind, url in zip(('sync', 'async'), paths):
+                    # Warm caches and connections outside the measurement
+                    await client.get(url)
+                    elapsed, latencies = await self.measure(client, url, requests, concurrency)
+                    latencies.sort()
+                    p50 = latencies[len(latencies) // 2]
+                    p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+                    self.stdout.write(
+                        f'{name:<14} {concurrency:>5} {kind:>6} {requests / elapsed:>8.0f} '
+                        f'{p50 * 1000:>7.2f}ms {p99 * 1000:>7.2f}ms'
+                    )
+
+    async def measure(self, client, url, requests, concurrency):
+        """Wall time and per-request latencies of requests sent concurrency at a time"""
+        remaining = requests
+        latencies = []
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                sent = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - sent)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{url} answered {response.status_code}')
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies
+
+    def create_game(self) -> Game:
+        game = Game.objects.create(name='Views Benchmark', status=Game.Status.ACTIVE)
+        players = [
+            Player.objects.create(game=game, name=f'Player {n}', color=color)
+            for n, color in enumerate(['#ff6b6b', '#4ecdc4'])
+        ]
+        piece_types = [choice for choice, _ in Piece.PieceType.choices]
+        Piece.objects.bulk_create([
+            Piece(
+                game=game,
+                owner=player,
+                piece_type=piece_types[x % len(piece_types)],
+                position_x=x,
+                position_y=row
+            )
+            for player, rows in zip(players, [(0, 1), (6, 7)])
+            for row in rows
+            for x in range(8)
+        ])
+        return game
@@ -0,0 +1,36 @@
+"""
+Process-local counters for TI Chess
+
+Cheap enough to bump on hot and abusive paths alike: a dictionary update
+under a lock, no I/O. Values are per worker process and reset on restart;
+scrape every worker to get totals.
+"""
+
+import threading
+from collections import Counter
+from typing import Dict
+
+
+_lock = threading.Lock()
+_counters: Counter = Counter()
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters[name]
+
+
+def snapshot() -> Dict[str, int]:
+    """All counters of this process"""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
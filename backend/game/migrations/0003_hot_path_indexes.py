@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_game_state_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'is_public', '-created_at'], name='game_lobby_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gameevent',
+            index=models.Index(fields=['game', 'created_at'], name='event_game_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='piece',
+            index=models.Index(fields=['game', 'is_active'], name='piece_game_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['player_token'], name='player_token_idx'),
+        ),
+    ]
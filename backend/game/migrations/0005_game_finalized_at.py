@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_game_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='finalized_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
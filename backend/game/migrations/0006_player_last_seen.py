@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_game_finalized_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
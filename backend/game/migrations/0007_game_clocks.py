@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_player_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='clock_increment',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='clock_initial',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='turn_deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='clock_remaining_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_game_clocks'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='piece',
+            name='piece_game_active_idx',
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['status', '-created_at'], name='game_public_lobby_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('finalized_at__isnull', True)), fields=['status'], name='game_unfinalized_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='piece',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['game'], name='piece_game_active_idx'),
+        ),
+    ]
@@ -2,6 +2,9 @@
 import uuid
 import json
 from django.db import models  # type: ignore
+from django.db.models import Q  # type: ignore
+from django.db.models.functions import Coalesce  # type: ignore
+from django.utils import timezone  # type: ignore
 from django.contrib.auth.models import AbstractUser  # type: ignore
 from django.core.validators import MinValueValidator, MaxValueValidator  # type: ignore
 
@@ -44,6 +47,35 @@ class User(AbstractUser):
         return round((self.games_won / self.games_played) * 100, 2)
 
 
+class GameQuerySet(models.QuerySet):
+    """Query helpers for games"""
+    
+    def with_details(self):
+        """Fetch everything GameSerializer reads in a fixed number of queries"""
+        return self.select_related('current_turn_player', 'winner').annotate(
+            # Archived games no longer have Move rows
+            moves_total=Coalesce('archive__move_count', models.Count('moves'))
+        ).prefetch_related(
+            models.Prefetch('players', queryset=Player.objects.with_pieces())
+        )
+    
+    def bump_state_version(self):
+        """Atomically increment state_version for every game in the queryset"""
+        return self.update(state_version=models.F('state_version') + 1)
+    
+    async def abump_state_version(self):
+        """Async variant of bump_state_version"""
+        return await self.aupdate(state_version=models.F('state_version') + 1)
+
+
+class PlayerQuerySet(models.QuerySet):
+    """Query helpers for players"""
+    
+    def with_pieces(self):
+        """Prefetch pieces so PlayerSerializer needs no per-player queries"""
+        return self.prefetch_related('pieces')
+
+
 class Game(models.Model):
     """Game model representing a TI Chess match"""
     
@@ -77,14 +109,43 @@ class Game(models.Model):
     turn_count = models.PositiveIntegerField(default=0)
     no_progress_turns = models.PositiveIntegerField(default=0)
     
+    # Incremented on every state change; used for ETags and cache keys
+    state_version = models.PositiveBigIntegerField(default=0)
+    
+    # Time control: seconds per player and seconds added after each move; untimed when null
+    clock_initial = models.PositiveIntegerField(null=True, blank=True)
+    clock_increment = models.PositiveIntegerField(default=0)
+    # When the player to move runs out of time; see game.clocks
+    turn_deadline = models.DateTimeField(null=True, blank=True)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     started_at = models.DateTimeField(null=True, blank=True)
     finished_at = models.DateTimeField(null=True, blank=True)
+    # Set once post-game processing (stats, final snapshot) has run
+    finalized_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = GameQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Lobby including private games: open games, newest first
+            models.Index(fields=['status', 'is_public', '-created_at'], name='game_lobby_idx'),
+            # Public lobby: private games are left out of the index
+            models.Index(
+                fields=['status', '-created_at'],
+                name='game_public_lobby_idx',
+                condition=Q(is_public=True)
+            ),
+            # Post-game sweep: ended games still waiting for finalization
+            models.Index(
+                fields=['status'],
+                name='game_unfinalized_idx',
+                condition=Q(finalized_at__isnull=True)
+            ),
+        ]
     
     def __str__(self):
         return f"Game {self.id} ({self.status})"
@@ -110,15 +171,24 @@ class Player(models.Model):
     is_host = models.BooleanField(default=False)
     
     # Connection tracking
+    # Written in batches by game.presence, not on every save
     is_connected = models.BooleanField(default=False)
-    last_seen = models.DateTimeField(auto_now=True)
+    last_seen = models.DateTimeField(default=timezone.now)
     player_token = models.UUIDField(default=uuid.uuid4, editable=False)
+    # Milliseconds left on the player's clock when their next turn starts
+    clock_remaining_ms = models.PositiveIntegerField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = PlayerQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['game', 'name']
         ordering = ['created_at']
+        indexes = [
+            # Every reconnect and REST move authenticates by token
+            models.Index(fields=['player_token'], name='player_token_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} in {self.game.id}"
@@ -126,6 +196,9 @@ class Player(models.Model):
     @property
     def investor_count(self):
         """Count of active Investor pieces"""
+        # Reuse prefetched pieces instead of issuing a COUNT per player
+        if 'pieces' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum(1 for piece in self.pieces.all() if piece.is_active and piece.level == 4)
         return self.pieces.filter(is_active=True, level=4).count()
 
 
@@ -169,6 +242,10 @@ class Piece(models.Model):
     class Meta:
         unique_together = ['game', 'position_x', 'position_y', 'is_active']
         ordering = ['created_at']
+        indexes = [
+            # Board loads and engine state: only pieces still on the board are indexed
+            models.Index(fields=['game'], name='piece_game_active_idx', condition=Q(is_active=True)),
+        ]
     
     def __str__(self):
         return f"{self.piece_type.title()} L{self.level} at ({self.position_x},{self.position_y})"
@@ -285,6 +362,30 @@ class GameEvent(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['game', 'created_at'], name='event_game_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} in {self.game.id}"
+
+class GameArchive(models.Model):
+    """Compressed move log of a game whose hot rows have been removed"""
+    
+    class Codec(models.TextChoices):
+        ZLIB = 'zlib', 'zlib'
+        ZSTD = 'zstd', 'Zstandard'
+    
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    codec = models.CharField(max_length=10, choices=Codec.choices)
+    format_version = models.PositiveSmallIntegerField(default=1)
+    
+    # Compressed JSON: game metadata, players, moves with events, keyframes
+    payload = models.BinaryField()
+    raw_size = models.PositiveIntegerField()
+    move_count = models.PositiveIntegerField(default=0)
+    
+    archived_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"{self.event_type} in {self.game.id}"
\ No newline at end of file
+        return f"Archive of {self.game_id} ({self.move_count} moves)"
@@ -0,0 +1,31 @@
+# type: ignore
+"""
+Keyset (cursor) pagination for TI Chess listings
+
+Cursor pagination seeks on an indexed ordering instead of using OFFSET and
+never runs COUNT(*), so deep pages cost the same as the first one.
+"""
+
+from rest_framework.pagination import CursorPagination  # type: ignore
+
+
+class KeysetPagination(CursorPagination):
+    """Base cursor pagination with a hard page-size cap"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class GameCursorPagination(KeysetPagination):
+    """Newest games first, on (created_at, id)"""
+    ordering = ('-created_at', '-id')
+
+
+class PlayerCursorPagination(KeysetPagination):
+    """Players in join order, on (created_at, id)"""
+    ordering = ('created_at', 'id')
+
+
+class MoveCursorPagination(KeysetPagination):
+    """Moves of a single game in play order, on move_number"""
+    ordering = ('move_number',)
@@ -0,0 +1,127 @@
+"""
+Post-game processing for TI Chess
+
+The winning move, a flag or an abandonment only marks the game ended. Everything else that
+happens at the end of a game runs off the move path, from a "game
+finished" message handled by a Celery task (or in-process when Celery is
+not installed):
+
+- User.games_played / games_won are updated
+- the final board is stored as a replay keyframe
+- lobby viewers are notified
+
+Processing is idempotent: a game is claimed by setting Game.finalized_at,
+so redelivered messages and the periodic sweep never count a game twice.
+"""
+
+import logging
+from collections import Counter
+from typing import Iterable, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.db import transaction  # type: ignore
+from django.db.models import F, Max  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from .models import Game, Move, Player, User
+from . import lobby, replay
+
+
+logger = logging.getLogger(__name__)
+
+FINALIZE_BATCH_SIZE = getattr(settings, 'POSTGAME_BATCH_SIZE', 100)
+ENDED_STATUSES = (Game.Status.FINISHED, Game.Status.ABANDONED)
+
+
+def game_finished(game_id):
+    """Queue post-game processing once the current transaction commits"""
+    transaction.on_commit(lambda: _dispatch([str(game_id)]))
+
+
+def _dispatch(game_ids: List[str]):
+    try:
+        from .tasks import finalize_finished_games
+    except ImportError:
+        finalize_games(game_ids)
+        return
+
+    try:
+        finalize_finished_games.delay(game_ids)
+    except Exception as e:
+        # The periodic sweep picks the game up if the broker is unavailable
+        logger.error(f"Error queueing post-game processing for {game_ids}: {e}")
+
+
+def _add_to_users(field: str, counts: Counter):
+    """Increment a User counter field, one UPDATE per distinct increment"""
+    by_increment = {}
+    for user_id, count in counts.items():
+        by_increment.setdefault(count, []).append(user_id)
+
+    for increment, user_ids in by_increment.items():
+        User.objects.filter(pk__in=user_ids).update(**{field: F(field) + increment})
+
+
+def _finalize_batch(game_ids: List) -> List[Game]:
+    """Claim and process one batch of finished games"""
+    now = timezone.now()
+
+    with transaction.atomic():
+        games = list(
+            Game.objects.select_for_update()
+            .filter(pk__in=game_ids, status__in=ENDED_STATUSES, finalized_at__isnull=True)
+        )
+        if not games:
+            return []
+        claimed = [game.pk for game in games]
+        Game.objects.filter(pk__in=claimed).update(finalized_at=now)
+        last_moves = dict(
+            Move.objects.filter(game_id__in=claimed)
+            .values('game_id').annotate(last=Max('move_number'))
+            .values_list('game_id', 'last')
+        )
+
+        played = Counter()
+        won = Counter()
+        winners = {game.winner_id for game in games}
+        for player_id, user_id in Player.objects.filter(
+            game_id__in=claimed, user__isnull=False
+        ).values_list('id', 'user_id'):
+            played[user_id] += 1
+            if player_id in winners:
+                won[user_id] += 1
+        _add_to_users('games_played', played)
+        _add_to_users('games_won', won)
+
+        for game in games:
+            replay.capture_snapshot(game, last_moves.get(game.pk, 0))
+
+    for game in games:
+        lobby.status_changed(game)
+    return games
+
+
+def finalize_games(game_ids: Optional[Iterable] = None, batch_size: Optional[int] = None) -> int:
+    """
+    Run post-game processing for finished games.
+
+    Without game_ids, every finished game that has not been processed yet is
+    swept. Returns the number of games processed by this call.
+    """
+    batch_size = batch_size or FINALIZE_BATCH_SIZE
+    pending = Game.objects.filter(status__in=ENDED_STATUSES, finalized_at__isnull=True)
+    if game_ids is not None:
+        pending = pending.filter(pk__in=list(game_ids))
+
+    processed = 0
+    seen = set()
+    while True:
+        batch = [
+            pk for pk in pending.exclude(pk__in=seen).order_by('finished_at')
+            .values_list('pk', flat=True)[:batch_size]
+        ]
+        if not batch:
+            break
+        seen.update(batch)
+        processed += len(_finalize_batch(batch))
+    return processed
@@ -0,0 +1,44 @@
+"""
+Premove queues for TI Chess
+
+A player waiting for the opponent can queue up to GAME_PREMOVE_LIMIT
+moves. When a move passes the turn to them, services.play_premoves applies
+their first queued move right away, in the same command, if the engine
+still accepts it. Both moves are broadcast back to back, so the premover
+skips the round trip of seeing the opponent's move and answering it. A
+queued move the engine refuses discards the player's whole queue, since
+the moves after it assumed it would be played.
+
+Queues are kept in the shared cache, one per player of a game. They are
+only read and written by commands on the game's actor, so a queue never
+changes under a move that is playing from it.
+"""
+
+from typing import Any, Dict, List
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+
+PREMOVE_LIMIT = getattr(settings, 'GAME_PREMOVE_LIMIT', 3)
+PREMOVE_TTL = getattr(settings, 'GAME_PREMOVE_TTL', 60 * 60)
+
+
+def _key(game_id, player_id) -> str:
+    return f'premoves:{game_id}:{player_id}'
+
+
+def get(game_id, player_id) -> List[Dict[str, Any]]:
+    """Queued premoves of a player, oldest first"""
+    return cache.get(_key(game_id, player_id)) or []
+
+
+def put(game_id, player_id, premoves: List[Dict[str, Any]]):
+    if premoves:
+        cache.set(_key(game_id, player_id), premoves, timeout=PREMOVE_TTL)
+    else:
+        cache.delete(_key(game_id, player_id))
+
+
+def clear(game_id, player_id):
+    cache.delete(_key(game_id, player_id))
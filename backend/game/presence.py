@@ -0,0 +1,159 @@
+"""
+Player presence for TI Chess
+
+Presence lives in the cache rather than the Player table. Each connected
+player has a key with a TTL that is refreshed by socket activity and
+heartbeats. A closed socket only shortens the TTL to PRESENCE_GRACE, so a
+flaky connection that drops and comes back within the grace period is never
+reported offline.
+
+Online/offline transitions are queued in process and flushed to
+Player.is_connected / last_seen in one batch every PRESENCE_FLUSH_INTERVAL
+seconds. Repeated transitions of the same player within one interval
+collapse into a single write. Presence is not board state, so flushing it
+leaves Game.state_version alone: a connect or disconnect never makes an
+in-flight move stale or retires the per-version board and move caches.
+Clients follow presence through presence_changed events.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+from django.db import transaction  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from .models import Player
+from .syncpool import database_sync_to_async, sync_to_async
+from . import events
+
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL = getattr(settings, 'PRESENCE_TTL', 60)
+PRESENCE_GRACE = getattr(settings, 'PRESENCE_GRACE', 10)
+FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 5)
+
+_lock = threading.Lock()
+# player_id -> (game_id, is_connected), latest transition wins
+_pending: Dict[str, Tuple[str, bool]] = {}
+# player_id -> game_id for players that connected through this process
+_tracked: Dict[str, str] = {}
+_runner = None
+
+
+def _key(game_id, player_id) -> str:
+    return f'presence:{game_id}:{player_id}'
+
+
+def _mark(game_id, player_id, is_connected: bool):
+    with _lock:
+        _pending[str(player_id)] = (str(game_id), is_connected)
+
+
+def online_players(game_id, player_ids: Iterable) -> Set[str]:
+    """The subset of player_ids that are currently online"""
+    keys = {_key(game_id, player_id): str(player_id) for player_id in player_ids}
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def connect(game_id, player_id, channel_name: str) -> bool:
+    """Record a live socket for a player; True if the player just came online"""
+    key = _key(game_id, player_id)
+    came_online = cache.get(key) is None
+    cache.set(key, channel_name, timeout=PRESENCE_TTL)
+
+    with _lock:
+        _tracked[str(player_id)] = str(game_id)
+    if came_online:
+        _mark(game_id, player_id, True)
+    return came_online
+
+
+def heartbeat(game_id, player_id, channel_name: str):
+    """Keep a player online for another PRESENCE_TTL seconds"""
+    cache.set(_key(game_id, player_id), channel_name, timeout=PRESENCE_TTL)
+
+
+def disconnect(game_id, player_id, channel_name: str):
+    """A socket closed; the player stays online for PRESENCE_GRACE seconds"""
+    key = _key(game_id, player_id)
+    # A newer socket of the same player owns the key; leave it alone
+    if cache.get(key) == channel_name:
+        cache.set(key, channel_name, timeout=PRESENCE_GRACE)
+
+
+def expire() -> List[Tuple[str, str]]:
+    """Find players tracked by this process whose presence has lapsed"""
+    with _lock:
+        tracked = dict(_tracked)
+    if not tracked:
+        return []
+
+    present = cache.get_many([_key(game_id, player_id) for player_id, game_id in tracked.items()])
+    lapsed = [
+        (game_id, player_id) for player_id, game_id in tracked.items()
+        if _key(game_id, player_id) not in present
+    ]
+
+    with _lock:
+        for game_id, player_id in lapsed:
+            if _tracked.get(player_id) == game_id:
+                del _tracked[player_id]
+            _pending[player_id] = (game_id, False)
+    return lapsed
+
+
+def flush() -> int:
+    """Write queued presence transitions to the database in one batch"""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+
+    by_state: Dict[bool, List[str]] = {}
+    for player_id, (game_id, is_connected) in pending.items():
+        by_state.setdefault(is_connected, []).append(player_id)
+
+    with transaction.atomic():
+        now = timezone.now()
+        for is_connected, player_ids in by_state.items():
+            Player.objects.filter(pk__in=player_ids).update(is_connected=is_connected, last_seen=now)
+    return len(pending)
+
+
+async def tick(channel_layer):
+    """Expire lapsed players, announce them, start their abandonment countdown and flush"""
+    from . import clocks
+
+    lapsed = await sync_to_async(expire)()
+    for game_id, player_id in lapsed:
+        clocks.schedule_abandon(game_id, player_id)
+        await events.publish(channel_layer, game_id, 'presence_changed', {
+            'player_id': player_id,
+            'is_connected': False
+        })
+    await database_sync_to_async(flush)()
+
+
+async def _run(channel_layer):
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await tick(channel_layer)
+        except Exception as e:
+            logger.error(f"Error flushing presence: {e}")
+
+
+def ensure_running(channel_layer):
+    """Start the flush loop on the current event loop if it is not running"""
+    global _runner
+    if FLUSH_INTERVAL <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    if _runner is None or _runner.done() or _runner.get_loop() is not loop:
+        _runner = loop.create_task(_run(channel_layer))
@@ -0,0 +1,257 @@
+"""
+WebSocket wire formats for TI Chess
+
+Clients pick a format with the WebSocket subprotocol:
+
+- no subprotocol or 'ti-chess.json': JSON text frames, {"action"/"event", "data"}
+- 'ti-chess.msgpack': MessagePack binary frames, [code, payload] or
+  [code, payload, seq] for sequenced game events
+
+Binary frames name actions and events by small integer codes, carry UUIDs
+as 16 raw bytes (ext type 1) and refer to pieces by per-game small
+integers. The reference table is sent as piece_index in binary game_state
+events. Moves, the hottest messages, are packed as positional arrays:
+
+    make_move   [piece_ref, from_x, from_y, to_x, to_y, state_version]
+    premove     [piece_ref, from_x, from_y, to_x, to_y]
+    move_made   [move_id, player_id, piece_ref, from_x, from_y, to_x, to_y,
+                 state_version, turn, winner, events, board_changes, clocks,
+                 legal_moves, turn_deadline, premove]
+
+where board_changes is a list of [x, y, piece_ref or nil], clocks is a
+list of [player_id, remaining_ms], or nil for untimed games, legal_moves
+is the [from, to, ...] square lists of the side to move, or nil when not
+pushed, turn_deadline is the ISO 8601 deadline of the next player, or nil,
+and premove is true for a move played from a premove queue.
+"""
+
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from .models import Piece
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+
+JSON_SUBPROTOCOL = 'ti-chess.json'
+MSGPACK_SUBPROTOCOL = 'ti-chess.msgpack'
+
+UUID_EXT = 1
+
+ACTION_CODES = {
+    'join_game': 1,
+    'select_color': 2,
+    'ready': 3,
+    'make_move': 4,
+    'investor_transform': 5,
+    'place_piece': 6,
+    'reconnect': 7,
+    'heartbeat': 8,
+    'premove': 9,
+    'clear_premoves': 10,
+}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+
+EVENT_CODES = {
+    'player_joined': 1,
+    'player_joined_broadcast': 2,
+    'game_state': 3,
+    'move_made': 4,
+    'error': 5,
+    'color_changed': 6,
+    'player_ready_changed': 7,
+    'game_started': 8,
+    'game_ended': 9,
+    'presence_changed': 10,
+    'resumed': 11,
+    'spectator_frame': 12,
+    'premoves': 13,
+}
+
+# Games whose piece index is kept for encoding broadcasts in this process
+SHARED_INDEX_SIZE = 1024
+
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+class ProtocolError(Exception):
+    """Raised for frames that cannot be decoded"""
+
+
+def negotiate(subprotocols: Iterable[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from those offered by the client"""
+    subprotocols = list(subprotocols or [])
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in subprotocols:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in subprotocols:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+class PieceIndex:
+    """
+    Small-integer references for the pieces of a game.
+
+    Pieces are numbered in creation order. Captured pieces keep their row, so
+    references never change; pieces created later are appended.
+    """
+
+    def __init__(self, piece_ids: Iterable):
+        self.ids = [str(piece_id) for piece_id in piece_ids]
+        self.refs = {piece_id: ref for ref, piece_id in enumerate(self.ids)}
+
+    @classmethod
+    def load(cls, game_id) -> 'PieceIndex':
+        return cls(
+            Piece.objects.filter(game_id=game_id)
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)
+        )
+
+    def ref(self, piece_id) -> Optional[int]:
+        if piece_id is None:
+            return None
+        return self.refs.get(str(piece_id))
+
+    def piece_id(self, ref) -> Optional[str]:
+        if isinstance(ref, int) and 0 <= ref < len(self.ids):
+            return self.ids[ref]
+        return None
+
+    def __contains__(self, piece_id) -> bool:
+        return str(piece_id) in self.refs
+
+
+_shared_lock = threading.Lock()
+_shared: 'OrderedDict[str, PieceIndex]' = OrderedDict()
+
+
+def shared_index(game_id, piece_ids: Iterable = ()) -> PieceIndex:
+    """
+    Piece index of a game shared by every broadcast encoded in this process.
+
+    References only depend on piece creation order, so the index is reloaded
+    only when it is missing one of piece_ids.
+    """
+    key = str(game_id)
+    with _shared_lock:
+        index = _shared.get(key)
+        if index is not None:
+            _shared.move_to_end(key)
+    if index is None or any(piece_id not in index for piece_id in piece_ids):
+        index = PieceIndex.load(game_id)
+        with _shared_lock:
+            _shared[key] = index
+            _shared.move_to_end(key)
+            while len(_shared) > SHARED_INDEX_SIZE:
+                _shared.popitem(last=False)
+    return index
+
+
+def _pack_uuids(value: Any) -> Any:
+    """Replace UUID strings with 16-byte ext values, recursively"""
+    if isinstance(value, uuid.UUID):
+        return msgpack.ExtType(UUID_EXT, value.bytes)
+    if isinstance(value, str):
+        if len(value) == 36 and _UUID_RE.match(value):
+            return msgpack.ExtType(UUID_EXT, uuid.UUID(value).bytes)
+        return value
+    if isinstance(value, dict):
+        return {key: _pack_uuids(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pack_uuids(item) for item in value]
+    return value
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == UUID_EXT:
+        return str(uuid.UUID(bytes=data))
+    return msgpack.ExtType(code, data)
+
+
+def _default(obj):
+    # Datetimes and decimals from serializers travel as strings, like in JSON
+    return str(obj)
+
+
+def move_piece_ids(data: Dict[str, Any]) -> List[str]:
+    """Piece ids referenced by a move_made payload"""
+    ids = [data.get('piece_id')]
+    ids.extend(change.get('piece') for change in data.get('board_changes', []))
+    return [piece_id for piece_id in ids if piece_id]
+
+
+def _compact_move(data: Dict[str, Any], index: PieceIndex) -> List[Any]:
+    from_x, from_y = data['from']
+    to_x, to_y = data['to']
+    return [
+        _pack_uuids(data.get('move_id')),
+        _pack_uuids(data.get('player_id')),
+        index.ref(data.get('piece_id')),
+        from_x, from_y, to_x, to_y,
+        data.get('state_version'),
+        _pack_uuids(data.get('turn')),
+        _pack_uuids(data.get('winner')),
+        _pack_uuids(data.get('events', [])),
+        [
+            [change['x'], change['y'], index.ref(change.get('piece'))]
+            for change in data.get('board_changes', [])
+        ],
+        [
+            [_pack_uuids(player_id), remaining_ms]
+            for player_id, remaining_ms in data['clocks'].items()
+        ] if data.get('clocks') else None,
+        data.get('legal_moves'),
+        data.get('turn_deadline'),
+        bool(data.get('premove')),
+    ]
+
+
+def encode(message: Dict[str, Any], index: Optional[PieceIndex] = None) -> bytes:
+    """
+    Pack an outgoing {'event', 'data'} message as a binary frame.
+
+    The piece index is only needed for move_made.
+    """
+    event = message['event']
+    data = message.get('data', {})
+
+    if event == 'move_made' and 'from' in data:
+        payload = _compact_move(data, index)
+    else:
+        payload = _pack_uuids(data)
+
+    frame = [EVENT_CODES.get(event, event), payload]
+    if message.get('seq') is not None:
+        frame.append(message['seq'])
+    return msgpack.packb(frame, use_bin_type=True, default=_default)
+
+
+def decode(frame: bytes, index: PieceIndex) -> Dict[str, Any]:
+    """Unpack an incoming binary frame into the {'action', 'data'} shape of JSON frames"""
+    try:
+        code, payload = msgpack.unpackb(frame, raw=False, ext_hook=_ext_hook)
+    except Exception as e:
+        raise ProtocolError(f"Malformed frame: {e}")
+
+    action = ACTION_NAMES.get(code, code)
+    if action in ('make_move', 'premove') and isinstance(payload, (list, tuple)):
+        if len(payload) < 5:
+            raise ProtocolError(f"{action} needs piece, from and to")
+        piece_ref, from_x, from_y, to_x, to_y = payload[:5]
+        payload = {
+            'piece_id': index.piece_id(piece_ref),
+            'from': [from_x, from_y],
+            'to': [to_x, to_y],
+            'state_version': payload[5] if len(payload) > 5 else None,
+        }
+
+    if not isinstance(payload, dict):
+        raise ProtocolError(f"Unexpected payload for {action}")
+    return {'action': action, 'data': payload}
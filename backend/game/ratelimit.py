@@ -0,0 +1,90 @@
+"""
+Per-connection rate limits for TI Chess WebSockets
+
+Every socket gets a token bucket for all of its frames, checked before a
+frame is even decoded, and one per action type. Frames over a limit are
+rejected with a rate_limited error. Rejections, and frames dropped because
+the socket's inbound queue is full, are violations; violations drain a
+bucket of their own, and a socket that runs it dry is disconnected. A
+client that hits a limit now and then is never cut off; one that keeps
+flooding is.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings  # type: ignore
+
+
+# action -> (tokens per second, burst)
+ACTION_RATES: Dict[str, Tuple[float, int]] = getattr(settings, 'WS_ACTION_RATES', {
+    'heartbeat': (1, 3),
+    'join_game': (0.5, 3),
+    'reconnect': (0.5, 3),
+    'select_color': (2, 5),
+    'ready': (2, 5),
+    'make_move': (5, 10),
+    'premove': (5, 10),
+    'clear_premoves': (2, 5),
+    'investor_transform': (2, 5),
+    'place_piece': (2, 5),
+})
+DEFAULT_RATE = (2, 5)
+FRAME_RATE = getattr(settings, 'WS_FRAME_RATE', (20, 40))
+VIOLATION_RATE = getattr(settings, 'WS_VIOLATION_RATE', (1, 20))
+INBOUND_QUEUE_SIZE = getattr(settings, 'WS_INBOUND_QUEUE_SIZE', 16)
+
+# WebSocket close code for policy violations
+CLOSE_POLICY_VIOLATION = 1008
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average and bursts of up to `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'clock')
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ConnectionLimiter:
+    """Rate limits and violation tracking for one socket"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.frames = TokenBucket(*FRAME_RATE, clock=clock)
+        self.violations = TokenBucket(*VIOLATION_RATE, clock=clock)
+        self.actions: Dict[str, TokenBucket] = {}
+        self.exhausted = False
+
+    def allow_frame(self) -> bool:
+        """Check the limit on all frames of the socket"""
+        return self.frames.take()
+
+    def allow(self, action: Optional[str]) -> bool:
+        """Check the limit of an action; unknown actions share one bucket"""
+        key = action if action in ACTION_RATES else None
+        bucket = self.actions.get(key)
+        if bucket is None:
+            rate = ACTION_RATES.get(key, DEFAULT_RATE)
+            bucket = self.actions[key] = TokenBucket(*rate, clock=self.clock)
+        return bucket.take()
+
+    def violation(self) -> bool:
+        """Record a rejected or dropped frame; True once the socket should be closed"""
+        if not self.violations.take():
+            self.exhausted = True
+        return self.exhausted
@@ -0,0 +1,315 @@
+"""
+Replay seeking for TI Chess games
+
+Board states are captured as GameSnapshot keyframes every
+REPLAY_KEYFRAME_INTERVAL moves. The exact board at any move is rebuilt from
+the nearest keyframe at or before it plus the few moves that follow.
+
+Archived games are read from their GameArchive instead of the hot tables.
+"""
+
+import itertools
+import logging
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .models import Game, GameSnapshot, Move, Piece
+from .syncpool import sync_to_async
+from .engine import GameEngine, GamePiece, Position, PieceType
+from . import archive, codec
+
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME_INTERVAL = getattr(settings, 'REPLAY_KEYFRAME_INTERVAL', 10)
+STREAM_CHUNK_SIZE = getattr(settings, 'REPLAY_STREAM_CHUNK_SIZE', 200)
+
+
+class ReplayUnavailable(Exception):
+    """Raised when no keyframe exists to rebuild the requested position"""
+
+
+def serialize_pieces(pieces) -> List[Dict[str, Any]]:
+    """Serialize active pieces for a snapshot"""
+    return [
+        {
+            'id': str(piece.id),
+            'owner_id': str(piece.owner_id),
+            'type': piece.piece_type,
+            'level': piece.level,
+            'x': piece.position_x,
+            'y': piece.position_y,
+            'transform_count': piece.transform_count,
+            'temporary_buffs': piece.temporary_buffs,
+        }
+        for piece in pieces
+        if piece.is_active
+    ]
+
+
+def capture_snapshot(game: Game, move_number: int) -> GameSnapshot:
+    """Store the current board of a game as the keyframe for move_number"""
+    pieces = Piece.objects.filter(game=game, is_active=True)
+    player_states = {
+        str(player.id): {'name': player.name, 'color': player.color}
+        for player in game.players.all()
+    }
+
+    snapshot, _ = GameSnapshot.objects.update_or_create(
+        game=game,
+        move_number=move_number,
+        defaults={
+            'board_state': serialize_pieces(pieces),
+            'player_states': player_states,
+        }
+    )
+    return snapshot
+
+
+def record_keyframe(game: Game, move_number: int, force: bool = False) -> Optional[GameSnapshot]:
+    """Capture a snapshot if move_number falls on a keyframe boundary"""
+    if force or move_number % KEYFRAME_INTERVAL == 0:
+        return capture_snapshot(game, move_number)
+    return None
+
+
+def keyframe_index(game: Game) -> List[int]:
+    """Move numbers that have a stored keyframe"""
+    archived = archive.load(game)
+    if archived is not None:
+        return archived.keyframe_index()
+    
+    return list(
+        GameSnapshot.objects.filter(game=game)
+        .order_by('move_number')
+        .values_list('move_number', flat=True)
+    )
+
+
+def _engine_pieces(board_state: List[Dict[str, Any]]) -> List[GamePiece]:
+    return [
+        GamePiece(
+            id=data['id'],
+            owner_id=data['owner_id'],
+            piece_type=PieceType(data['type']),
+            level=data['level'],
+            position=Position(data['x'], data['y']),
+            transform_count=data.get('transform_count', 0),
+            temporary_buffs=dict(data.get('temporary_buffs') or {}),
+        )
+        for data in board_state
+    ]
+
+
+def _replay_move(engine: GameEngine, move: Move):
+    """Apply a recorded move to the engine board"""
+    from_pos = Position(move.from_x, move.from_y)
+    to_pos = Position(move.to_x, move.to_y)
+
+    result = engine.apply_move(str(move.piece_id), from_pos, to_pos, str(move.player_id))
+    if result.success:
+        return
+
+    # Recorded moves were accepted when played; relocate the piece directly
+    # if the rules have changed since.
+    logger.warning(f"Replaying move {move.move_number} of game {move.game_id} failed: {result.error_message}")
+    piece = engine.get_piece_at(from_pos)
+    if piece:
+        engine.board.pop(to_pos, None)
+        del engine.board[from_pos]
+        piece.position = to_pos
+        engine.board[to_pos] = piece
+
+
+def board_at(game: Game, move_number: int) -> List[List[Optional[Dict[str, Any]]]]:
+    """Rebuild the 8x8 board as it stood after move_number moves"""
+    archived = archive.load(game)
+    if archived is not None:
+        snapshot = archived.keyframe_at(move_number)
+    else:
+        snapshot = (
+            GameSnapshot.objects.filter(game=game, move_number__lte=move_number)
+            .order_by('-move_number')
+            .first()
+        )
+    if snapshot is None:
+        raise ReplayUnavailable(f"No keyframe at or before move {move_number}")
+
+    pieces = _engine_pieces(snapshot.board_state)
+    engine = GameEngine()
+    engine.load_board_state(pieces, {player_id: None for player_id in snapshot.player_states})
+
+    if archived is not None:
+        moves = archived.moves_between(snapshot.move_number, move_number)
+    else:
+        moves = (
+            Move.objects.filter(
+                game=game,
+                move_number__gt=snapshot.move_number,
+                move_number__lte=move_number,
+                to_x__isnull=False,
+                to_y__isnull=False,
+            )
+            .order_by('move_number')
+            .only('game_id', 'player_id', 'piece_id', 'from_x', 'from_y', 'to_x', 'to_y', 'move_number')
+        )
+    for move in moves:
+        _replay_move(engine, move)
+
+    board = [[None for _ in range(8)] for _ in range(8)]
+    for position, piece in engine.board.items():
+        owner = snapshot.player_states.get(piece.owner_id, {})
+        board[position.y][position.x] = {
+            'id': piece.id,
+            'owner_id': piece.owner_id,
+            'owner_name': owner.get('name'),
+            'owner_color': owner.get('color'),
+            'type': piece.piece_type.value,
+            'level': piece.level,
+            'transform_count': piece.transform_count,
+            'temporary_buffs': piece.temporary_buffs
+        }
+    return board
+
+
+def _position_cache_key(game: Game, move_number: int) -> str:
+    return f'replay_position:{game.id}:{move_number}'
+
+
+def get_position(game: Game, move_number: int) -> Dict[str, Any]:
+    """Board at move_number plus the keyframe index, cached for ended games"""
+    cacheable = game.status in (Game.Status.FINISHED, Game.Status.ABANDONED)
+    cache_key = _position_cache_key(game, move_number)
+
+    if cacheable:
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return payload
+
+    archived = archive.load(game)
+    total_moves = archived.move_count if archived is not None else game.moves.count()
+    if move_number < 0 or move_number > total_moves:
+        raise ValueError(f"Move {move_number} is out of range (0-{total_moves})")
+
+    if archived is not None:
+        move = archived.move_at(move_number)
+    else:
+        move = (
+            Move.objects.filter(game=game, move_number=move_number)
+            .values('player_id', 'move_type', 'from_x', 'from_y', 'to_x', 'to_y')
+            .first()
+        )
+
+    payload = {
+        'game_id': str(game.id),
+        'move_number': move_number,
+        'total_moves': total_moves,
+        'keyframe_interval': KEYFRAME_INTERVAL,
+        'keyframes': keyframe_index(game),
+        'board': board_at(game, move_number),
+        'move': {
+            'player_id': str(move['player_id']),
+            'move_type': move['move_type'],
+            'from': [move['from_x'], move['from_y']],
+            'to': [move['to_x'], move['to_y']],
+        } if move else None,
+    }
+
+    if cacheable:
+        # Finished games are immutable, so their positions never expire
+        cache.set(cache_key, payload, timeout=None)
+    return payload
+
+
+def _ndjson(record: Dict[str, Any]) -> str:
+    return codec.dumps(record) + '\n'
+
+
+def iter_replay_ndjson(game: Game, after_move: int = 0, limit: Optional[int] = None,
+                       chunk_size: int = None) -> Iterator[str]:
+    """
+    Stream a game replay as NDJSON lines.
+
+    The first line describes the game, then one line per move after
+    after_move, then an end line carrying the cursor for the next page.
+    Moves are read with a server-side iterator so memory stays flat.
+    """
+    from .serializers import MoveSerializer
+
+    yield _ndjson({
+        'type': 'game',
+        'game_id': game.id,
+        'status': game.status,
+        'players': list(game.players.values('id', 'name', 'color')),
+        'winner_id': game.winner_id,
+        'created_at': game.created_at,
+        'finished_at': game.finished_at,
+    })
+
+    count = 0
+    last_move = after_move
+    archived = archive.load(game)
+    if archived is not None:
+        for record in archived.records(after_move, limit):
+            count += 1
+            last_move = record['move_number']
+            yield _ndjson({'type': 'move', **record})
+
+        has_more = limit is not None and count == limit and bool(archived.records(last_move, 1))
+    else:
+        moves = (
+            Move.objects.filter(game=game, move_number__gt=after_move)
+            .select_related('player', 'piece')
+            .prefetch_related('events')
+            .order_by('move_number')
+        )
+        if limit is not None:
+            moves = moves[:limit]
+
+        rows = moves.iterator(chunk_size=chunk_size or STREAM_CHUNK_SIZE)
+        try:
+            for move in rows:
+                count += 1
+                last_move = move.move_number
+                yield _ndjson({'type': 'move', **MoveSerializer(move).data})
+        finally:
+            # Release the server-side cursor now if the client went away mid-stream
+            rows.close()
+
+        has_more = (
+            limit is not None and count == limit and
+            Move.objects.filter(game=game, move_number__gt=last_move).exists()
+        )
+    yield _ndjson({
+        'type': 'end',
+        'count': count,
+        'next_after_move': last_move if has_more else None,
+    })
+
+
+async def aiter_replay_ndjson(game: Game, after_move: int = 0,
+                              limit: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Async variant of iter_replay_ndjson for ASGI servers.
+
+    Django buffers synchronous iterators completely before serving them over
+    ASGI, so lines are pulled from the database in batches on the
+    thread-sensitive executor and yielded as they arrive.
+    """
+    lines = iter_replay_ndjson(game, after_move=after_move, limit=limit)
+    next_batch = sync_to_async(
+        lambda: list(itertools.islice(lines, STREAM_CHUNK_SIZE)),
+        thread_sensitive=True
+    )
+
+    try:
+        while True:
+            batch = await next_batch()
+            if not batch:
+                break
+            yield ''.join(batch)
+    finally:
+        # Runs when the response is abandoned too; the cursor lives on the executor thread
+        await sync_to_async(lines.close, thread_sensitive=True)()
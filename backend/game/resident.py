@@ -0,0 +1,92 @@
+"""
+Resident game state for TI Chess
+
+The worker that owns a game (see game.affinity) applies all of its moves,
+so it keeps the pieces, players and last move number of recently played
+games in memory instead of loading them for every move. An entry is only
+used while the game is still at the state_version it was stored for:
+anything else that changes the game bumps the version and the next move
+reloads from the database, so a stale entry is never applied.
+
+services.apply_move takes a copy of the entry, applies the move to it and,
+once the new version is written, stores the result. Entries are kept for
+the GAME_RESIDENT_GAMES most recently played games of the process.
+"""
+
+import threading
+from collections import OrderedDict
+from copy import copy
+from dataclasses import dataclass, replace
+from typing import List, Optional
+
+from django.conf import settings  # type: ignore
+
+from .engine import GamePiece, Position
+from .models import Player
+
+
+RESIDENT_GAMES = getattr(settings, 'GAME_RESIDENT_GAMES', 512)
+
+
+@dataclass
+class ResidentGame:
+    state_version: int
+    pieces: List[GamePiece]
+    players: List[Player]
+    move_number: int
+
+
+_lock = threading.Lock()
+_games: 'OrderedDict[str, ResidentGame]' = OrderedDict()
+
+
+def _copy_piece(piece: GamePiece) -> GamePiece:
+    return replace(
+        piece,
+        position=Position(piece.position.x, piece.position.y),
+        temporary_buffs=dict(piece.temporary_buffs)
+    )
+
+
+def get(game_id, state_version: int) -> Optional[ResidentGame]:
+    """A private copy of the game's state if it is resident at state_version"""
+    with _lock:
+        entry = _games.get(str(game_id))
+        if entry is None:
+            return None
+        if entry.state_version != state_version:
+            del _games[str(game_id)]
+            return None
+        _games.move_to_end(str(game_id))
+
+    return ResidentGame(
+        state_version=entry.state_version,
+        pieces=[_copy_piece(piece) for piece in entry.pieces],
+        players=[copy(player) for player in entry.players],
+        move_number=entry.move_number
+    )
+
+
+def put(game_id, state_version: int, pieces: List[GamePiece], players: List[Player], move_number: int):
+    """Keep the state a game has at state_version; captured pieces are left out"""
+    entry = ResidentGame(
+        state_version=state_version,
+        pieces=[_copy_piece(piece) for piece in pieces if piece.is_active],
+        players=[copy(player) for player in players],
+        move_number=move_number
+    )
+    with _lock:
+        _games[str(game_id)] = entry
+        _games.move_to_end(str(game_id))
+        while len(_games) > RESIDENT_GAMES:
+            _games.popitem(last=False)
+
+
+def drop(game_id):
+    with _lock:
+        _games.pop(str(game_id), None)
+
+
+def clear():
+    with _lock:
+        _games.clear()
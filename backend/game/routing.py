@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/game/(?P<game_id>[0-9a-f-]+)/$', consumers.GameConsumer.as_asgi()),
+    re_path(r'ws/game/(?P<game_id>[0-9a-f-]+)/spectate/$', consumers.SpectatorConsumer.as_asgi()),
+    re_path(r'ws/lobby/$', consumers.LobbyConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -39,9 +39,16 @@ class PlayerSerializer(serializers.ModelSerializer):
         model = Player
         fields = [
             'id', 'name', 'color', 'is_ready', 'is_host', 'is_connected',
-            'investor_count', 'player_token', 'pieces', 'created_at'
+            'investor_count', 'player_token', 'pieces', 'clock_remaining_ms', 'created_at'
         ]
-        read_only_fields = ['id', 'player_token', 'investor_count', 'created_at']
+        read_only_fields = ['id', 'player_token', 'investor_count', 'clock_remaining_ms', 'created_at']
+
+
+class PublicPlayerSerializer(PlayerSerializer):
+    """Player serializer for payloads anyone watching a game can see; no player_token"""
+    
+    class Meta(PlayerSerializer.Meta):
+        fields = [field for field in PlayerSerializer.Meta.fields if field != 'player_token']
 
 
 class GameEventSerializer(serializers.ModelSerializer):
@@ -80,31 +87,44 @@ class GameSerializer(serializers.ModelSerializer):
         read_only=True
     )
     winner_name = serializers.CharField(source='winner.name', read_only=True)
-    moves_count = serializers.IntegerField(source='moves.count', read_only=True)
+    moves_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Game
         fields = [
             'id', 'name', 'is_public', 'status', 'turn_count',
             'no_progress_turns', 'current_turn_player_name', 'winner_name',
-            'moves_count', 'players', 'created_at', 'updated_at',
-            'started_at', 'finished_at'
+            'moves_count', 'players', 'state_version', 'clock_initial', 'clock_increment',
+            'turn_deadline', 'created_at', 'updated_at', 'started_at', 'finished_at'
         ]
         read_only_fields = [
             'id', 'status', 'turn_count', 'no_progress_turns',
             'current_turn_player_name', 'winner_name', 'moves_count',
-            'created_at', 'updated_at', 'started_at', 'finished_at'
+            'state_version', 'turn_deadline', 'created_at', 'updated_at', 'started_at', 'finished_at'
         ]
+    
+    def get_moves_count(self, obj) -> int:
+        """Use the with_details() annotation when present"""
+        if hasattr(obj, 'moves_total'):
+            return obj.moves_total
+        return obj.moves.count()
 
 
 class GameCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating games"""
     hostName = serializers.CharField(write_only=True, max_length=100)
     isPublic = serializers.BooleanField(source='is_public', default=True)
+    # Time control in seconds; omitted or null for an untimed game
+    clockInitial = serializers.IntegerField(
+        source='clock_initial', required=False, allow_null=True, min_value=10, max_value=3 * 60 * 60
+    )
+    clockIncrement = serializers.IntegerField(
+        source='clock_increment', default=0, min_value=0, max_value=10 * 60
+    )
     
     class Meta:
         model = Game
-        fields = ['name', 'isPublic', 'password', 'hostName']
+        fields = ['name', 'isPublic', 'password', 'hostName', 'clockInitial', 'clockIncrement']
         extra_kwargs = {
             'password': {'write_only': True}
         }
@@ -154,6 +174,7 @@ class MoveCreateSerializer(serializers.Serializer):
         choices=Move.MoveType.choices, 
         default=Move.MoveType.MOVE
     )
+    state_version = serializers.IntegerField(min_value=0, required=False)
 
 
 class InvestorTransformSerializer(serializers.Serializer):
@@ -182,7 +203,8 @@ class GameReplaySerializer(serializers.Serializer):
 class BoardStateSerializer(serializers.Serializer):
     """Serializer for board state"""
     board = serializers.JSONField(read_only=True)
-    players = PlayerSerializer(many=True, read_only=True)
-    current_turn_player = PlayerSerializer(read_only=True)
+    players = PublicPlayerSerializer(many=True, read_only=True)
+    current_turn_player = PublicPlayerSerializer(read_only=True)
     game_status = serializers.CharField(read_only=True)
-    turn_count = serializers.IntegerField(read_only=True)
\ No newline at end of file
+    turn_count = serializers.IntegerField(read_only=True)
+    state_version = serializers.IntegerField(read_only=True)
\ No newline at end of file
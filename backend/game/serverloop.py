@@ -0,0 +1,82 @@
+"""
+The ASGI server's event loop
+
+Long-lived tasks (game actors, the affinity worker, the timer wheel, the
+spectator relay) must run on the event loop of the ASGI server, in a
+context of their own. A task started inside async_to_sync, as a sync REST
+view would, inherits the request thread's CurrentThreadExecutor: once the
+request returns, every sync_to_async call of the task fails.
+
+ServerLoopMiddleware wraps the ASGI application, binds the server loop on
+the first connection of any kind and starts the timer wheel and the
+spectator relay there, so a process serving only REST moves still flags
+their deadlines; consumers bind the loop and start them too. Nothing else
+starts them. Sync code hands coroutines to the loop with run(), which
+starts them in an empty context. Where no server loop runs (management commands, the test client)
+run() falls back to async_to_sync, whose private loop and tasks end with
+the call.
+"""
+
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Optional
+
+from asgiref.sync import async_to_sync  # type: ignore
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind():
+    """Remember the running loop as the one long-lived tasks belong to"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
+def running() -> bool:
+    """Whether a bound server loop is running on another thread than the caller's"""
+    loop = _loop
+    if loop is None or not loop.is_running():
+        return False
+    try:
+        return asyncio.get_running_loop() is not loop
+    except RuntimeError:
+        return True
+
+
+def run(func: Callable[..., Awaitable[Any]], *args, timeout: Optional[float] = None) -> Any:
+    """
+    Run func(*args) on the server loop from sync code and wait for its result.
+
+    Raises concurrent.futures.TimeoutError after timeout seconds; the
+    coroutine keeps running on the loop.
+    """
+    if not running():
+        return async_to_sync(func)(*args)
+    # An empty context keeps the caller's executor out of the tasks func starts
+    future = contextvars.Context().run(asyncio.run_coroutine_threadsafe, func(*args), _loop)
+    return future.result(timeout)
+
+
+def start_background():
+    """Start the per-process loops on the running server loop"""
+    from channels.layers import get_channel_layer  # type: ignore
+    from . import clocks, spectators
+
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        clocks.ensure_running(channel_layer)
+        spectators.ensure_running(channel_layer)
+
+
+class ServerLoopMiddleware:
+    """ASGI middleware binding the server loop before the first request is handled"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _loop is not asyncio.get_running_loop():
+            bind()
+            start_background()
+        return await self.app(scope, receive, send)
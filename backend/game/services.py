@@ -0,0 +1,455 @@
+"""
+Move processing shared by the REST API and the WebSocket consumer
+
+Moves are evaluated by the engine without holding any locks and committed
+with a compare-and-swap on Game.state_version. A move evaluated against a
+state that changed in the meantime is rejected with the current version
+instead of overwriting the newer state.
+"""
+
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from django.core.exceptions import ValidationError  # type: ignore
+from django.db import transaction  # type: ignore
+from django.db.models import F  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from .models import Game, Player, Piece, Move, GameEvent
+from .engine import GameEngine, GamePiece, Position, PieceType
+from . import legalmoves, postgame, premoves, presence, replay, resident
+
+
+logger = logging.getLogger(__name__)
+
+
+def stale_result(current_version: int) -> Dict[str, Any]:
+    """Rejection returned when a move was based on an outdated state"""
+    return {
+        'success': False,
+        'error': 'Game state has changed',
+        'code': 'stale_state',
+        'state_version': current_version,
+    }
+
+
+def load_engine(game_id) -> tuple:
+    """Build an engine from the active pieces of a game"""
+    engine_pieces = [
+        GamePiece(
+            id=str(piece.id),
+            owner_id=str(piece.owner_id),
+            piece_type=PieceType(piece.piece_type),
+            level=piece.level,
+            position=Position(piece.position_x, piece.position_y),
+            transform_count=piece.transform_count,
+            temporary_buffs=piece.temporary_buffs,
+            is_active=piece.is_active
+        )
+        for piece in Piece.objects.filter(game_id=game_id, is_active=True)
+    ]
+    players = list(Player.objects.filter(game_id=game_id))
+
+    engine = GameEngine()
+    engine.load_board_state(engine_pieces, {str(p.id): p for p in players})
+    return engine, engine_pieces, players
+
+
+def _piece_state(piece: GamePiece) -> tuple:
+    return (
+        piece.piece_type, piece.level, piece.position.x, piece.position.y,
+        piece.transform_count, dict(piece.temporary_buffs), piece.is_active
+    )
+
+
+def save_engine_pieces(engine_pieces: List[GamePiece], before: Optional[Dict[str, tuple]] = None):
+    """
+    Persist engine piece state.
+
+    before maps piece ids to their _piece_state when the engine was loaded;
+    when given, only pieces whose state changed are written.
+    """
+    changed = [
+        piece for piece in engine_pieces
+        if before is None or before.get(piece.id) != _piece_state(piece)
+    ]
+    # Save captured pieces first so they free their squares
+    changed.sort(key=lambda piece: piece.is_active)
+
+    now = timezone.now()
+    for piece in changed:
+        Piece.objects.filter(pk=piece.id).update(
+            piece_type=piece.piece_type.value,
+            level=piece.level,
+            position_x=piece.position.x,
+            position_y=piece.position.y,
+            transform_count=piece.transform_count,
+            temporary_buffs=piece.temporary_buffs,
+            is_active=piece.is_active,
+            updated_at=now
+        )
+
+
+def _next_player_id(players: List[Player], current_id) -> Optional[Any]:
+    if not players:
+        return None
+
+    current_index = 0
+    for i, player in enumerate(players):
+        if player.id == current_id:
+            current_index = i
+            break
+    return players[(current_index + 1) % len(players)].id
+
+
+def apply_move_command(game_id, player_id, piece_id: str, from_pos: List[int], to_pos: List[int],
+                       expected_version: Optional[int] = None,
+                       move_type: str = Move.MoveType.MOVE) -> Dict[str, Any]:
+    """
+    apply_move with plain arguments, for commands forwarded between workers.
+
+    Premoves the move triggers are applied too and returned in premoves_played.
+    """
+    player = Player.objects.filter(pk=player_id).first()
+    if player is None:
+        return {'success': False, 'error': 'Player not found'}
+    result = apply_move(game_id, player, piece_id, Position(*from_pos), Position(*to_pos),
+                        expected_version=expected_version, move_type=move_type)
+    if result['success']:
+        result['premoves_played'] = play_premoves(game_id, result)
+    return result
+
+
+def investor_transform_command(game_id, player_id, investor_id: str, target_piece_id: str,
+                               expected_version: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Transform an allied piece next to one of the player's Investors, as their turn.
+
+    Premoves the transform triggers are applied too, like for apply_move_command.
+    """
+    player = Player.objects.filter(pk=player_id).first()
+    if player is None:
+        return {'success': False, 'error': 'Player not found'}
+    try:
+        pieces = {
+            str(piece.id): piece
+            for piece in Piece.objects.filter(game_id=game_id, is_active=True, pk__in=[investor_id, target_piece_id])
+        }
+    except ValidationError:
+        return {'success': False, 'error': 'Invalid piece id'}
+    investor, target = pieces.get(str(investor_id)), pieces.get(str(target_piece_id))
+    if investor is None:
+        return {'success': False, 'error': 'Investor piece not found'}
+    if target is None:
+        return {'success': False, 'error': 'Target piece not found'}
+
+    result = apply_move(
+        game_id, player, str(investor_id),
+        Position(investor.position_x, investor.position_y), Position(target.position_x, target.position_y),
+        expected_version=expected_version,
+        move_type=Move.MoveType.INVESTOR_TRANSFORM,
+        target_piece_id=str(target_piece_id)
+    )
+    if result['success']:
+        result['premoves_played'] = play_premoves(game_id, result)
+    return result
+
+
+def queue_premove_command(game_id, player_id, piece_id: str, from_pos: List[int],
+                          to_pos: List[int]) -> Dict[str, Any]:
+    """
+    Queue a move to play as soon as the turn passes to the player.
+
+    If the turn already has, the move is applied now instead. Returns the
+    player's queue and the moves applied, if any.
+    """
+    game = Game.objects.filter(pk=game_id).only('status', 'current_turn_player').first()
+    player = Player.objects.filter(pk=player_id, game_id=game_id).first()
+    if game is None or player is None:
+        return {'success': False, 'error': 'Game not found'}
+    if game.status != Game.Status.ACTIVE:
+        return {'success': False, 'error': 'Game is not active'}
+
+    if game.current_turn_player_id == player.id:
+        premoves.clear(game_id, player_id)
+        result = apply_move(game_id, player, piece_id, Position(*from_pos), Position(*to_pos))
+        if not result['success']:
+            return result
+        return {'success': True, 'premoves': [], 'moves': [result] + play_premoves(game_id, result)}
+
+    queued = premoves.get(game_id, player_id)
+    if len(queued) >= premoves.PREMOVE_LIMIT:
+        return {
+            'success': False,
+            'error': f'At most {premoves.PREMOVE_LIMIT} premoves can be queued',
+            'code': 'premove_limit'
+        }
+    queued.append({'piece_id': str(piece_id), 'from': list(from_pos), 'to': list(to_pos)})
+    premoves.put(game_id, player_id, queued)
+    return {'success': True, 'premoves': queued, 'moves': []}
+
+
+def clear_premoves_command(game_id, player_id) -> Dict[str, Any]:
+    """Drop every queued premove of a player"""
+    premoves.clear(game_id, player_id)
+    return {'success': True, 'premoves': [], 'moves': []}
+
+
+def play_premoves(game_id, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Apply the premoves of whoever each move passes the turn to.
+
+    apply_move validates every premove with GameEngine.validate_move
+    against the board it meets. The first one refused discards the rest
+    of its player's queue. Each premove consumes one queued entry, so
+    the chain ends.
+    """
+    played = []
+    while result.get('success') and not result.get('winner') and result.get('turn'):
+        player_id = result['turn']
+        queued = premoves.get(game_id, player_id)
+        player = Player.objects.filter(pk=player_id).first() if queued else None
+        if player is None:
+            break
+
+        premove = queued[0]
+        result = apply_move(game_id, player, premove['piece_id'],
+                            Position(*premove['from']), Position(*premove['to']))
+        if not result['success']:
+            # A lost version race says nothing about the premove; keep it for the next turn
+            if result.get('code') != 'stale_state':
+                logger.debug(f"Discarding premoves of {player_id} in game {game_id}: {result.get('error')}")
+                premoves.clear(game_id, player_id)
+            break
+
+        premoves.put(game_id, player_id, queued[1:])
+        result['premove'] = True
+        played.append(result)
+    return played
+
+
+def _schedule_flag(game_id, deadline):
+    """Have this process's timer wheel check the game at its new deadline once the move commits"""
+    from . import clocks
+
+    transaction.on_commit(lambda: clocks.request_flag(game_id, deadline))
+
+
+def apply_move(game_id, player: Player, piece_id: str, from_pos: Position, to_pos: Position,
+               expected_version: Optional[int] = None,
+               move_type: str = Move.MoveType.MOVE,
+               target_piece_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Validate, apply and persist a move.
+
+    expected_version is the state_version the client based its move on.
+    Whether or not it is given, the commit only succeeds if the game is
+    still at the version the engine evaluated.
+
+    An investor transform is a turn too: piece_id is the Investor,
+    target_piece_id the piece it transforms, and from_pos and to_pos their
+    squares.
+    """
+    game = Game.objects.filter(pk=game_id).only(
+        'status', 'state_version', 'current_turn_player', 'clock_increment', 'turn_deadline'
+    ).first()
+    if game is None:
+        return {'success': False, 'error': 'Game not found'}
+
+    # Cheap rejections before touching the board
+    if expected_version is not None and expected_version != game.state_version:
+        return stale_result(game.state_version)
+    if game.status != Game.Status.ACTIVE:
+        return {'success': False, 'error': 'Game is not active'}
+    if game.current_turn_player_id and game.current_turn_player_id != player.id:
+        return {'success': False, 'error': 'Not your turn'}
+    now = timezone.now()
+    if game.turn_deadline is not None and now >= game.turn_deadline:
+        # game.clocks ends the game; the move cannot beat the flag
+        return {'success': False, 'error': 'Out of time', 'code': 'flagged'}
+
+    base_version = game.state_version
+    # The owner of a game (see game.affinity) usually still holds the board of base_version
+    held = resident.get(game_id, base_version)
+    if held is not None:
+        engine_pieces, players, last_move_number = held.pieces, held.players, held.move_number
+        engine = GameEngine()
+        engine.load_board_state(engine_pieces, {str(p.id): p for p in players})
+    else:
+        engine, engine_pieces, players = load_engine(game_id)
+        last_move_number = None
+    before = {piece.id: _piece_state(piece) for piece in engine_pieces}
+    if move_type == Move.MoveType.INVESTOR_TRANSFORM:
+        result = engine.investor_transform_adjacent(str(piece_id), str(target_piece_id), str(player.id))
+    else:
+        result = engine.apply_move(str(piece_id), from_pos, to_pos, str(player.id))
+    if not result.success:
+        return {'success': False, 'error': result.error_message}
+
+    winner = engine.check_win_condition()
+    next_player_id = _next_player_id(players, game.current_turn_player_id)
+    new_version = base_version + 1
+
+    game_updates = {
+        'state_version': new_version,
+        'current_turn_player_id': next_player_id,
+        'turn_count': F('turn_count') + 1,
+        'updated_at': now,
+    }
+    if winner:
+        game_updates.update(
+            winner_id=winner,
+            status=Game.Status.FINISHED,
+            finished_at=now,
+            turn_deadline=None
+        )
+    
+    clocks = None
+    if game.turn_deadline is not None and not winner:
+        # The mover banks what is left plus the increment; the opponent's clock starts
+        remaining_ms = int((game.turn_deadline - now).total_seconds() * 1000) + game.clock_increment * 1000
+        next_ms = next(p.clock_remaining_ms for p in players if p.id == next_player_id)
+        if next_ms is None:
+            # The next player is untimed: nobody can flag on this turn
+            game_updates['turn_deadline'] = None
+        else:
+            game_updates['turn_deadline'] = now + timedelta(milliseconds=next_ms)
+            clocks = {str(player.id): remaining_ms, str(next_player_id): next_ms}
+
+    with transaction.atomic():
+        # Compare-and-swap: only the first move based on base_version wins
+        swapped = Game.objects.filter(pk=game_id, state_version=base_version).update(**game_updates)
+        if not swapped:
+            current = Game.objects.filter(pk=game_id).values_list('state_version', flat=True).first()
+            return stale_result(current)
+
+        if clocks is not None:
+            Player.objects.filter(pk=player.id).update(clock_remaining_ms=clocks[str(player.id)])
+        
+        if last_move_number is None:
+            last_move = Move.objects.filter(game_id=game_id).order_by('-move_number').first()
+            last_move_number = last_move.move_number if last_move else 0
+        move_number = last_move_number + 1
+
+        move = Move.objects.create(
+            game_id=game_id,
+            player=player,
+            piece_id=piece_id,
+            move_type=move_type,
+            from_x=from_pos.x,
+            from_y=from_pos.y,
+            to_x=to_pos.x,
+            to_y=to_pos.y,
+            move_number=move_number,
+            move_data={'events': result.events, 'changes': result.board_changes},
+            is_valid=True
+        )
+        GameEvent.objects.bulk_create([
+            GameEvent(
+                game_id=game_id,
+                move=move,
+                event_type=event['type'],
+                event_data=event.get('data', {})
+            )
+            for event in result.events
+        ])
+
+        save_engine_pieces(engine_pieces, before)
+        if winner:
+            # Stats, the final keyframe and the lobby update run off the move path
+            postgame.game_finished(game_id)
+        else:
+            replay.record_keyframe(game, move_number)
+            if clocks is not None:
+                for held_player in players:
+                    if held_player.id == player.id:
+                        held_player.clock_remaining_ms = clocks[str(player.id)]
+            # Only keep the new board once it is really committed, batch and all
+            transaction.on_commit(
+                lambda: resident.put(game_id, new_version, engine_pieces, players, move_number)
+            )
+        if game.turn_deadline is not None:
+            _schedule_flag(game_id, game_updates['turn_deadline'])
+
+    legal_moves = None
+    if not winner:
+        # The engine already holds the new board: cache its moves for the new version
+        pieces = legalmoves.from_engine(engine)
+        legalmoves.store(game_id, new_version, pieces)
+        if legalmoves.PUSH_LEGAL_MOVES and next_player_id:
+            legal_moves = legalmoves.compact(pieces, next_player_id)
+
+    return {
+        'success': True,
+        'move_id': str(move.id),
+        'player_id': str(player.id),
+        'piece_id': str(piece_id),
+        'from': [from_pos.x, from_pos.y],
+        'to': [to_pos.x, to_pos.y],
+        'move_type': move_type,
+        'events': result.events,
+        'board_changes': result.board_changes,
+        'winner': winner,
+        'turn': str(next_player_id) if next_player_id else None,
+        'state_version': new_version,
+        'clocks': clocks,
+        'turn_deadline': game_updates['turn_deadline'].isoformat() if clocks else None,
+        'legal_moves': legal_moves,
+    }
+
+
+def _end_game(game_id, status: str, winner_id, reason: str, **conditions) -> Optional[Dict[str, Any]]:
+    """End an active game that still matches conditions, through the post-game pipeline"""
+    now = timezone.now()
+    with transaction.atomic():
+        ended = Game.objects.filter(pk=game_id, status=Game.Status.ACTIVE, **conditions).update(
+            status=status,
+            winner_id=winner_id,
+            finished_at=now,
+            turn_deadline=None,
+            state_version=F('state_version') + 1,
+            updated_at=now
+        )
+        if not ended:
+            return None
+        postgame.game_finished(game_id)
+    return {'winner': str(winner_id) if winner_id else None, 'reason': reason}
+
+
+def flag_game(game_id) -> Optional[Dict[str, Any]]:
+    """
+    End a game whose player to move ran out of time; the opponent wins.
+
+    Returns None if the game is not active or its deadline has not passed,
+    e.g. because a move reset it after the timer was set.
+    """
+    game = Game.objects.filter(pk=game_id, status=Game.Status.ACTIVE).only(
+        'current_turn_player', 'turn_deadline'
+    ).first()
+    if game is None or game.turn_deadline is None or game.turn_deadline > timezone.now():
+        return None
+
+    loser_id = game.current_turn_player_id
+    winner_id = Player.objects.filter(game_id=game_id).exclude(pk=loser_id).values_list('pk', flat=True).first()
+    with transaction.atomic():
+        result = _end_game(game_id, Game.Status.FINISHED, winner_id, 'timeout', turn_deadline=game.turn_deadline)
+        if result is not None:
+            Player.objects.filter(pk=loser_id).update(clock_remaining_ms=0)
+    return result
+
+
+def abandon_game(game_id, player_id) -> Optional[Dict[str, Any]]:
+    """
+    Mark an active game abandoned once a player stayed offline too long.
+
+    An opponent who is still online wins by forfeit. Returns None if the
+    game is not active or the player came back.
+    """
+    player_ids = list(Player.objects.filter(game_id=game_id).values_list('pk', flat=True))
+    online = presence.online_players(game_id, player_ids)
+    if str(player_id) in online:
+        return None
+
+    winner_id = next((pk for pk in player_ids if str(pk) in online), None)
+    return _end_game(game_id, Game.Status.ABANDONED, winner_id, 'abandoned')
@@ -0,0 +1,198 @@
+"""
+Spectators for TI Chess
+
+Spectators connect to ws/game/<id>/spectate/ and join a spectator group of
+their own, so the players' game group only ever holds the players. They
+never see individual events. Publishing a game event only marks the game
+dirty in this process; a relay loop running SPECTATOR_FRAME_RATE times per
+second builds one frame per dirty game from the versioned board cache,
+encodes it once and sends it to the spectator group. However many events
+happen between two frames, and however many spectators watch, the move
+path pays for a dictionary write.
+
+Each spectator socket keeps at most SPECTATOR_QUEUE_SIZE undelivered frames
+and drops the oldest when a new one arrives, so a slow watcher skips ahead
+to the latest board instead of falling behind.
+
+Spectator counts are kept per process: each process writes how many
+spectators of a game it holds under its own key, with a SPECTATOR_TTL
+timeout that the relay loop refreshes every third of the TTL. A per-game
+registry lists the processes with spectators. The count of a game is the
+sum over the registry, so the sockets of a crashed process stop counting
+once its key expires.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+
+from .syncpool import database_sync_to_async, sync_to_async
+from . import board, events
+
+
+logger = logging.getLogger(__name__)
+
+SPECTATOR_FRAME_RATE = getattr(settings, 'SPECTATOR_FRAME_RATE', 4)
+SPECTATOR_QUEUE_SIZE = getattr(settings, 'SPECTATOR_QUEUE_SIZE', 1)
+SPECTATOR_TTL = getattr(settings, 'SPECTATOR_TTL', 30)
+
+PROCESS_ID = uuid.uuid4().hex
+
+_lock = threading.Lock()
+# game_id -> names of the events since the last frame
+_dirty: Dict[str, List[str]] = {}
+# game_id -> spectator sockets of this process
+_local: Dict[str, int] = {}
+_runner = None
+_last_heartbeat = 0.0
+
+
+def group_name(game_id) -> str:
+    return f'game_{game_id}_spectators'
+
+
+def _count_key(game_id, process: Optional[str] = None) -> str:
+    return f'spectators:{game_id}:{process or PROCESS_ID}'
+
+
+def _registry_key(game_id) -> str:
+    return f'spectators:{game_id}:processes'
+
+
+def _publish(game_id: str):
+    """Write this process's spectator count of a game with a fresh TTL"""
+    count = _local.get(game_id, 0)
+    if not count:
+        cache.delete(_count_key(game_id))
+        return
+
+    cache.set(_count_key(game_id), count, timeout=SPECTATOR_TTL)
+    # Rewrite the registry without the processes whose counts expired
+    processes = cache.get(_registry_key(game_id)) or []
+    alive = cache.get_many([_count_key(game_id, process) for process in processes])
+    processes = [
+        process for process in processes
+        if process != PROCESS_ID and _count_key(game_id, process) in alive
+    ]
+    cache.set(_registry_key(game_id), processes + [PROCESS_ID], timeout=SPECTATOR_TTL)
+
+
+def counts(game_ids: Iterable[str]) -> Dict[str, int]:
+    """Spectator sockets of each game, across processes"""
+    game_ids = [str(game_id) for game_id in game_ids]
+    registries = cache.get_many([_registry_key(game_id) for game_id in game_ids])
+    keys = {
+        game_id: [_count_key(game_id, process) for process in registries.get(_registry_key(game_id), [])]
+        for game_id in game_ids
+    }
+    values = cache.get_many([key for game_keys in keys.values() for key in game_keys])
+    return {
+        game_id: sum(values.get(key, 0) for key in game_keys)
+        for game_id, game_keys in keys.items()
+    }
+
+
+def watching(game_id) -> int:
+    """Number of spectator sockets of a game, across processes"""
+    return counts([game_id])[str(game_id)]
+
+
+def joined(game_id):
+    game_id = str(game_id)
+    with _lock:
+        _local[game_id] = _local.get(game_id, 0) + 1
+    _publish(game_id)
+
+
+def left(game_id):
+    game_id = str(game_id)
+    with _lock:
+        remaining = _local.pop(game_id, 0) - 1
+        if remaining > 0:
+            _local[game_id] = remaining
+    _publish(game_id)
+
+
+def heartbeat():
+    """Refresh the TTL of every count this process holds"""
+    with _lock:
+        game_ids = list(_local)
+    for game_id in game_ids:
+        _publish(game_id)
+
+
+def mark(game_id, event: str):
+    """Note that a game changed; spectators see it in the next frame"""
+    with _lock:
+        _dirty.setdefault(str(game_id), []).append(event)
+
+
+def drain() -> Dict[str, List[str]]:
+    """Take the games changed since the last frame that have spectators"""
+    global _dirty
+    with _lock:
+        dirty, _dirty = _dirty, {}
+    if not dirty:
+        return {}
+
+    watched = counts(dirty)
+    return {game_id: names for game_id, names in dirty.items() if watched[game_id] > 0}
+
+
+def build_frame(game_id, event_names: List[str]) -> Dict[str, Any]:
+    """Encoded spectator frame with the latest board of a game"""
+    version = board.current_version(game_id)
+    message = {
+        'event': 'spectator_frame',
+        'data': {
+            'board': board.get_board(game_id, version),
+            'events': event_names,
+            'spectators': watching(game_id),
+        }
+    }
+    return events.encode(game_id, message)
+
+
+async def tick(channel_layer):
+    """Send one frame to the spectators of every game that changed"""
+    global _last_heartbeat
+    if time.monotonic() - _last_heartbeat >= SPECTATOR_TTL / 3:
+        _last_heartbeat = time.monotonic()
+        await sync_to_async(heartbeat)()
+
+    dirty = await sync_to_async(drain)()
+    for game_id, names in dirty.items():
+        try:
+            frames = await database_sync_to_async(build_frame)(game_id, names)
+        except Exception as e:
+            logger.error(f"Error building spectator frame for game {game_id}: {e}")
+            continue
+        await channel_layer.group_send(group_name(game_id), {
+            'type': 'spectator_frame',
+            **frames
+        })
+
+
+async def _run(channel_layer):
+    while True:
+        await asyncio.sleep(1 / SPECTATOR_FRAME_RATE)
+        try:
+            await tick(channel_layer)
+        except Exception as e:
+            logger.error(f"Error relaying spectator frames: {e}")
+
+
+def ensure_running(channel_layer):
+    """Start the relay loop on the current event loop if it is not running"""
+    global _runner
+    if SPECTATOR_FRAME_RATE <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    if _runner is None or _runner.done() or _runner.get_loop() is not loop:
+        _runner = loop.create_task(_run(channel_layer))
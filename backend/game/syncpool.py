@@ -0,0 +1,124 @@
+"""
+Instrumented sync-to-async bridges for TI Chess
+
+Synchronous work called from consumers and background loops (database
+queries, cache calls) runs through asgiref's thread-sensitive executor,
+which under an ASGI server is a single thread shared by every connection
+of the process. Django's async ORM methods (aget, aupdate, ...) run there
+too. When calls arrive faster than that thread completes them they queue,
+and every socket of the worker waits behind the queue.
+
+The wrappers here are drop-in replacements for asgiref's sync_to_async
+and channels' database_sync_to_async that track how many calls are
+waiting for the thread and running on it, the peak queue depth and how
+long calls waited. snapshot() is served by /api/metrics/. Async ORM calls
+made directly are not counted but do occupy the same thread, so a rising
+wait time with a flat queue depth points at them.
+"""
+
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from asgiref.sync import sync_to_async as _sync_to_async  # type: ignore
+from channels.db import database_sync_to_async as _database_sync_to_async  # type: ignore
+
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {}
+
+
+def reset():
+    with _lock:
+        _state.update(
+            waiting=0,
+            running=0,
+            peak_waiting=0,
+            calls=0,
+            wait_seconds=0.0,
+            max_wait_seconds=0.0,
+        )
+
+
+reset()
+
+
+def snapshot() -> Dict[str, Any]:
+    """Queue depth and wait times of this process's sync calls"""
+    with _lock:
+        state = dict(_state)
+    calls = state['calls']
+    return {
+        'waiting': state['waiting'],
+        'running': state['running'],
+        'peak_waiting': state['peak_waiting'],
+        'calls': calls,
+        'avg_wait_ms': round(state['wait_seconds'] * 1000 / calls, 3) if calls else 0.0,
+        'max_wait_ms': round(state['max_wait_seconds'] * 1000, 3),
+    }
+
+
+class _Call:
+    """Bookkeeping of one call; queued until the thread picks it up or its caller gives up"""
+
+    __slots__ = ('queued', 'queued_at')
+
+    def __init__(self):
+        self.queued_at = time.perf_counter()
+        self.queued = True
+        with _lock:
+            _state['waiting'] += 1
+            _state['peak_waiting'] = max(_state['peak_waiting'], _state['waiting'])
+
+    def start(self):
+        waited = time.perf_counter() - self.queued_at
+        with _lock:
+            if self.queued:
+                _state['waiting'] -= 1
+                self.queued = False
+            _state['running'] += 1
+            _state['calls'] += 1
+            _state['wait_seconds'] += waited
+            _state['max_wait_seconds'] = max(_state['max_wait_seconds'], waited)
+
+    def finish(self):
+        with _lock:
+            _state['running'] -= 1
+
+    def abandon(self):
+        with _lock:
+            if self.queued:
+                _state['waiting'] -= 1
+                self.queued = False
+
+
+def _instrument(func: Callable, bridge: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        call = _Call()
+
+        def run():
+            call.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                call.finish()
+
+        try:
+            return await bridge(run)()
+        finally:
+            # Cancelled before the thread got to it
+            call.abandon()
+
+    return wrapper
+
+
+def sync_to_async(func: Callable, *, thread_sensitive: bool = True) -> Callable:
+    """asgiref's sync_to_async, counted"""
+    return _instrument(func, functools.partial(_sync_to_async, thread_sensitive=thread_sensitive))
+
+
+def database_sync_to_async(func: Callable) -> Callable:
+    """channels' database_sync_to_async (closes stale connections), counted"""
+    return _instrument(func, _database_sync_to_async)
@@ -0,0 +1,25 @@
+"""
+Celery tasks for TI Chess
+"""
+
+import logging
+from celery import shared_task  # type: ignore
+
+from . import archive, postgame
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def archive_finished_games(days=None, limit=None):
+    """Periodic job moving long-finished games into the compressed archive"""
+    archives = archive.archive_games(days=days, limit=limit)
+    logger.info(f"Archived {len(archives)} games")
+    return len(archives)
+
+
+@shared_task(acks_late=True)
+def finalize_finished_games(game_ids=None):
+    """Post-game processing; without game_ids sweeps every unprocessed game"""
+    return postgame.finalize_games(game_ids)
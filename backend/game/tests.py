@@ -2,13 +2,46 @@
 Tests for game models
 """
 
-from django.test import TestCase
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from game.models import Game, Player, Piece, Move
 
 User = get_user_model()
 
 
+def create_game(name, alice=None, bob=None, **fields):
+    """An active game between Alice and Bob with Alice to move; alice and bob are extra Player fields"""
+    fields.setdefault('status', Game.Status.ACTIVE)
+    game = Game.objects.create(name=name, **fields)
+    players = (
+        Player.objects.create(game=game, name='Alice', **(alice or {})),
+        Player.objects.create(game=game, name='Bob', **(bob or {})),
+    )
+    game.current_turn_player = players[0]
+    game.save()
+    return (game,) + players
+
+
+def place_talent_rows(game, alice, bob):
+    """A row of eight Talents for each side, Alice's on y=1 and Bob's on y=6"""
+    for x in range(8):
+        Piece.objects.create(game=game, owner=alice, piece_type=Piece.PieceType.TALENT,
+                             position_x=x, position_y=1)
+        Piece.objects.create(game=game, owner=bob, piece_type=Piece.PieceType.TALENT,
+                             position_x=x, position_y=6)
+
+
+class GameTestCase(TestCase):
+    """Test case starting from an empty cache"""
+    
+    def setUp(self):
+        cache.clear()
+
+
 class GameModelTests(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='player1', email='player1@example.com')
@@ -165,4 +198,2381 @@ class GameEngineTests(TestCase):
         self.engine.load_board_state(pieces, {'player1': None, 'player2': None})
         
         winner = self.engine.check_win_condition()
-        self.assertEqual(winner, 'player1')  # player1 should win
\ No newline at end of file
+        self.assertEqual(winner, 'player1')  # player1 should win
+
+class ReplaySeekTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from game import replay
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game, self.alice, self.bob = create_game('Replay Game', alice={'is_host': True})
+        place_talent_rows(self.game, self.alice, self.bob)
+        replay.capture_snapshot(self.game, 0)
+    
+    def _move(self, player, from_pos, to_pos):
+        piece = Piece.objects.get(game=self.game, position_x=from_pos[0], position_y=from_pos[1], is_active=True)
+        response = self.client.post(f'/api/games/{self.game.id}/move/', {
+            'piece_id': str(piece.id),
+            'from_x': from_pos[0], 'from_y': from_pos[1],
+            'to_x': to_pos[0], 'to_y': to_pos[1],
+            'player_token': str(player.player_token),
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return piece
+    
+    def _seek(self, move_number):
+        return self.client.get(f'/api/games/{self.game.id}/replay/position/', {'move': move_number})
+    
+    def test_seek_rebuilds_board_between_keyframes(self):
+        """Positions between keyframes are rebuilt from the previous keyframe"""
+        moved = self._move(self.alice, (0, 1), (0, 3))
+        self._move(self.bob, (1, 6), (1, 4))
+        
+        response = self._seek(1)
+        self.assertEqual(response.status_code, 200)
+        board = response.json()['board']
+        self.assertEqual(board[3][0]['id'], str(moved.id))
+        self.assertIsNone(board[1][0])
+        self.assertIsNotNone(board[6][1])
+        self.assertEqual(response.json()['move']['to'], [0, 3])
+        self.assertEqual(response.json()['keyframes'], [0])
+        
+        start = self._seek(0).json()
+        self.assertEqual(start['board'][1][0]['id'], str(moved.id))
+        self.assertIsNone(start['move'])
+    
+    def test_keyframes_recorded_on_interval(self):
+        """A keyframe is stored every REPLAY_KEYFRAME_INTERVAL moves"""
+        from unittest import mock
+        from game import replay
+        
+        with mock.patch.object(replay, 'KEYFRAME_INTERVAL', 2):
+            self._move(self.alice, (0, 1), (0, 3))
+            self._move(self.bob, (1, 6), (1, 4))
+        
+        self.assertEqual(replay.keyframe_index(self.game), [0, 2])
+        board = self._seek(2).json()['board']
+        self.assertIsNotNone(board[3][0])
+        self.assertIsNotNone(board[4][1])
+    
+    def test_seek_out_of_range(self):
+        """Seeking past the last move is rejected"""
+        self.assertEqual(self._seek(5).status_code, 400)
+        self.assertEqual(self._seek('abc').status_code, 400)
+    
+    def test_finished_game_positions_are_cached(self):
+        """Finished game positions are served from the cache"""
+        self._move(self.alice, (0, 1), (0, 3))
+        Game.objects.filter(pk=self.game.pk).update(status=Game.Status.FINISHED)
+        cache.clear()
+        
+        first = self._seek(1).json()
+        with self.assertNumQueries(1):
+            second = self._seek(1).json()
+        self.assertEqual(first, second)
+
+
+class ReplayStreamTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        self.client = APIClient()
+        self.game = Game.objects.create(name='Stream Game', status=Game.Status.FINISHED)
+        self.alice = Player.objects.create(game=self.game, name='Alice')
+        self.bob = Player.objects.create(game=self.game, name='Bob')
+        piece = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                     position_x=0, position_y=1)
+        
+        for number in range(1, 6):
+            move = Move.objects.create(game=self.game, player=self.alice if number % 2 else self.bob,
+                                       piece=piece, move_type=Move.MoveType.MOVE, from_x=0, from_y=1,
+                                       to_x=0, to_y=2, move_number=number, is_valid=True)
+            move.events.create(game=self.game, event_type='piece_moved', event_data={'n': number})
+    
+    def _stream(self, **params):
+        import json
+        
+        response = self.client.get(f'/api/games/{self.game.id}/replay/stream/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+    
+    def test_stream_emits_header_moves_and_end(self):
+        """Streams one line per move between the game header and end record"""
+        records = self._stream()
+        
+        self.assertEqual(records[0]['type'], 'game')
+        self.assertEqual([r['move_number'] for r in records[1:-1]], [1, 2, 3, 4, 5])
+        self.assertEqual(records[1]['player_name'], 'Alice')
+        self.assertEqual(records[1]['events'][0]['event_data'], {'n': 1})
+        self.assertEqual(records[-1], {'type': 'end', 'count': 5, 'next_after_move': None})
+    
+    def test_stream_cursor_pages(self):
+        """after_move and limit page through the history"""
+        records = self._stream(after_move=1, limit=2)
+        
+        self.assertEqual([r['move_number'] for r in records[1:-1]], [2, 3])
+        self.assertEqual(records[-1]['next_after_move'], 3)
+        
+        records = self._stream(after_move=3, limit=2)
+        self.assertEqual(records[-1]['next_after_move'], None)
+    
+    def test_stream_query_count_is_flat(self):
+        """Moves, players, pieces and events are fetched in a fixed number of queries"""
+        from django.test.utils import CaptureQueriesContext
+        from django.db import connection
+        
+        with CaptureQueriesContext(connection) as queries:
+            self._stream()
+        # game, players, moves with player/piece, events
+        self.assertEqual(len(queries), 4)
+    
+    def test_async_stream_matches_sync_stream(self):
+        """The ASGI iterator yields the same lines as the sync iterator"""
+        from asgiref.sync import async_to_sync
+        from game import replay
+        
+        async def collect():
+            return ''.join([chunk async for chunk in replay.aiter_replay_ndjson(self.game)])
+        
+        self.assertEqual(async_to_sync(collect)(), ''.join(replay.iter_replay_ndjson(self.game)))
+    
+    def test_abandoned_stream_closes_cursor(self):
+        """Closing the stream mid-way closes the move iterator instead of leaving it to the GC"""
+        from unittest import mock
+        from django.db.models.query import QuerySet
+        from game import replay
+        
+        closed, held = [], []
+        iterator = QuerySet.iterator
+        
+        def tracked(queryset, *args, **kwargs):
+            rows = iterator(queryset, *args, **kwargs)
+            
+            def wrapper():
+                try:
+                    yield from rows
+                finally:
+                    closed.append(True)
+            # Kept referenced, so only an explicit close finishes it
+            held.append(wrapper())
+            return held[-1]
+        
+        with mock.patch.object(QuerySet, 'iterator', tracked):
+            lines = replay.iter_replay_ndjson(self.game, chunk_size=1)
+            next(lines)
+            next(lines)
+            lines.close()
+        self.assertEqual(closed, [True])
+
+
+class GameArchiveTests(GameTestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from rest_framework.test import APIClient
+        from game import replay
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game, self.alice, self.bob = create_game('Old Game')
+        place_talent_rows(self.game, self.alice, self.bob)
+        replay.capture_snapshot(self.game, 0)
+        
+        for player, from_pos, to_pos in [(self.alice, (0, 1), (0, 3)), (self.bob, (1, 6), (1, 4)),
+                                         (self.alice, (2, 1), (2, 2))]:
+            piece = Piece.objects.get(game=self.game, position_x=from_pos[0], position_y=from_pos[1])
+            response = self.client.post(f'/api/games/{self.game.id}/move/', {
+                'piece_id': str(piece.id),
+                'from_x': from_pos[0], 'from_y': from_pos[1], 'to_x': to_pos[0], 'to_y': to_pos[1],
+                'player_token': str(player.player_token),
+            }, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+        
+        Game.objects.filter(pk=self.game.pk).update(
+            status=Game.Status.FINISHED,
+            winner=self.alice,
+            finished_at=timezone.now() - timedelta(days=60),
+            finalized_at=timezone.now() - timedelta(days=60)
+        )
+    
+    def _replay_views(self):
+        import json
+        
+        base = f'/api/games/{self.game.id}'
+        stream = self.client.get(f'{base}/replay/stream/', {'after_move': 1})
+        return {
+            'replay': self.client.get(f'{base}/replay/').json(),
+            'position': self.client.get(f'{base}/replay/position/', {'move': 2}).json(),
+            'stream': [json.loads(line) for line in b''.join(stream.streaming_content).decode().splitlines()],
+            'board': self.client.get(f'{base}/board/').json()['board'],
+            'detail': self.client.get(f'{base}/').json()['moves_count'],
+        }
+    
+    def test_archive_serves_identical_replays(self):
+        """Replays read from the archive match the ones built from hot rows"""
+        from django.core.management import call_command
+        from game.models import GameArchive, GameEvent, GameSnapshot
+        
+        before = self._replay_views()
+        cache.clear()
+        
+        call_command('ti_archive_games', stdout=open('/dev/null', 'w'))
+        
+        archive = GameArchive.objects.get(game=self.game)
+        self.assertEqual(archive.move_count, 3)
+        self.assertLess(len(archive.payload), archive.raw_size)
+        for model in (Piece, Move, GameEvent, GameSnapshot):
+            self.assertFalse(model.objects.filter(game=self.game).exists(), model.__name__)
+        self.assertTrue(Player.objects.filter(game=self.game).exists())
+        
+        self.assertEqual(self._replay_views(), before)
+    
+    def test_recent_and_live_games_are_kept(self):
+        """Only games that ended before the cutoff are archived"""
+        from game import archive
+        
+        self.assertEqual(list(archive.archivable_games(days=90)), [])
+        Game.objects.filter(pk=self.game.pk).update(status=Game.Status.ACTIVE)
+        self.assertEqual(list(archive.archivable_games(days=30)), [])
+    
+    def test_unfinalized_games_are_kept(self):
+        """Games still waiting for post-game processing are not archived"""
+        from game import archive
+        
+        self.assertEqual(list(archive.archivable_games(days=30)), [self.game])
+        Game.objects.filter(pk=self.game.pk).update(finalized_at=None)
+        self.assertEqual(list(archive.archivable_games(days=30)), [])
+    
+    def test_archive_is_resumable(self):
+        """Re-running archive_game finishes an interrupted purge"""
+        from unittest import mock
+        from game import archive
+        from game.models import GameArchive
+        
+        with mock.patch.object(archive, 'purge_hot_rows'):
+            archive.archive_game(self.game)
+        self.assertTrue(Move.objects.filter(game=self.game).exists())
+        
+        archive.archive_game(self.game, batch_size=2)
+        self.assertEqual(GameArchive.objects.filter(game=self.game).count(), 1)
+        self.assertFalse(Piece.objects.filter(game=self.game).exists())
+
+
+class PostGameTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        User = get_user_model()
+        self.ann = User.objects.create_user(username='ann', password='pw')
+        self.ben = User.objects.create_user(username='ben', password='pw')
+        
+        self.game, self.alice, self.bob = create_game('Final Game', alice={'user': self.ann},
+                                                      bob={'user': self.ben})
+        # Bob has no Investor left, so Alice's next move wins
+        Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.INVESTOR,
+                             level=4, position_x=7, position_y=0)
+        self.piece = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                          position_x=0, position_y=1)
+        Piece.objects.create(game=self.game, owner=self.bob, piece_type=Piece.PieceType.TALENT,
+                             position_x=0, position_y=6)
+    
+    def _winning_move(self):
+        response = self.client.post(f'/api/games/{self.game.id}/move/', {
+            'piece_id': str(self.piece.id), 'from_x': 0, 'from_y': 1, 'to_x': 0, 'to_y': 2,
+            'player_token': str(self.alice.player_token),
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['winner'], str(self.alice.id))
+        return response
+    
+    def _stats(self, user):
+        user.refresh_from_db()
+        return user.games_played, user.games_won
+    
+    def test_winning_move_defers_post_game_work(self):
+        """The winning move only marks the game finished and queues the rest"""
+        from game.models import GameSnapshot
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._winning_move()
+        
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, Game.Status.FINISHED)
+        self.assertIsNone(self.game.finalized_at)
+        self.assertEqual(self._stats(self.ann), (0, 0))
+        self.assertEqual(len(callbacks), 1)
+        
+        callbacks[0]()
+        self.game.refresh_from_db()
+        self.assertIsNotNone(self.game.finalized_at)
+        self.assertEqual(self._stats(self.ann), (1, 1))
+        self.assertEqual(self._stats(self.ben), (1, 0))
+        self.assertTrue(GameSnapshot.objects.filter(game=self.game, move_number=1).exists())
+    
+    def test_processing_is_idempotent(self):
+        """Redelivered messages and the sweep never count a game twice"""
+        from game import postgame
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._winning_move()
+        
+        self.assertEqual(postgame.finalize_games([self.game.id]), 0)
+        self.assertEqual(postgame.finalize_games(), 0)
+        self.assertEqual(self._stats(self.ann), (1, 1))
+    
+    def test_sweep_processes_in_batches(self):
+        """The sweep picks up every finished game that was never processed"""
+        from django.utils import timezone
+        from game import postgame
+        
+        games = [self.game]
+        for n in range(4):
+            game = Game.objects.create(name=f'Old {n}')
+            Player.objects.create(game=game, name='Alice', user=self.ann)
+            winner = Player.objects.create(game=game, name='Bob', user=self.ben)
+            games.append(game)
+            Game.objects.filter(pk=game.pk).update(winner=winner)
+        Game.objects.filter(pk__in=[g.pk for g in games]).update(
+            status=Game.Status.FINISHED, finished_at=timezone.now()
+        )
+        
+        self.assertEqual(postgame.finalize_games(batch_size=2), 5)
+        self.assertEqual(self._stats(self.ann), (5, 0))
+        self.assertEqual(self._stats(self.ben), (5, 4))
+
+
+class QueryBudgetTests(GameTestCase):
+    """Listing endpoints run a fixed number of queries regardless of size"""
+    
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        self.games = [self._create_game(f'Game {i}') for i in range(4)]
+        self.game = self.games[0]
+    
+    def _create_game(self, name):
+        game, *players = create_game(name)
+        
+        for x in range(4):
+            for player, y in zip(players, (1, 6)):
+                piece = Piece.objects.create(game=game, owner=player, piece_type=Piece.PieceType.INVESTOR,
+                                             level=4, position_x=x, position_y=y)
+        for number in range(1, 4):
+            move = Move.objects.create(game=game, player=players[number % 2], piece=piece,
+                                       move_type=Move.MoveType.MOVE, from_x=0, from_y=0,
+                                       to_x=0, to_y=1, move_number=number)
+            move.events.create(game=game, event_type='piece_moved')
+        return game
+    
+    def _get(self, url, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+    
+    def test_game_list(self):
+        """Games, players and pieces: 3 queries"""
+        data = self._get('/api/games/', 3)['results']
+        self.assertEqual(len(data), 4)
+        self.assertEqual(data[0]['moves_count'], 3)
+        self.assertEqual(data[0]['players'][0]['investor_count'], 4)
+        self.assertEqual(data[0]['players'][0]['pieces'][0]['owner_name'], 'Alice')
+        self.assertEqual(data[0]['current_turn_player_name'], 'Alice')
+    
+    def test_active_games(self):
+        """Lobby listing: 3 queries"""
+        data = self._get('/api/games/active/', 3)
+        self.assertEqual(len(data), 4)
+    
+    def test_game_detail(self):
+        """Single game: 3 queries"""
+        data = self._get(f'/api/games/{self.game.id}/', 3)
+        self.assertEqual(data['moves_count'], 3)
+    
+    def test_player_list(self):
+        """Paginated players: players and pieces"""
+        data = self._get('/api/players/', 2)
+        self.assertEqual(len(data['results']), 8)
+        self.assertEqual(data['results'][0]['investor_count'], 4)
+    
+    def test_move_list(self):
+        """Paginated moves: moves with player/piece, and events"""
+        data = self._get('/api/moves/', 2, game_id=str(self.game.id))
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(data['results'][0]['player_name'], 'Bob')
+    
+    def test_board(self):
+        """Board: version, game, pieces with owners, players and their pieces"""
+        data = self._get(f'/api/games/{self.game.id}/board/', 5)
+        self.assertEqual(data['board'][1][0]['owner_name'], 'Alice')
+        self.assertEqual(data['current_turn_player']['name'], 'Alice')
+    
+    def test_consumer_game_data(self):
+        """Consumer game state: 3 queries"""
+        from asgiref.sync import async_to_sync
+        from game.consumers import GameConsumer
+        
+        consumer = GameConsumer()
+        consumer.game_id = str(self.game.id)
+        with self.assertNumQueries(3):
+            data = async_to_sync(consumer.get_game_data)()
+        self.assertEqual(len(data['players']), 2)
+
+
+class LobbyCacheTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game = Game.objects.create(name='Lobby Game')
+        Player.objects.create(game=self.game, name='Alice', is_host=True)
+    
+    def test_lobby_served_from_cache(self):
+        """Repeated lobby polls do not touch the database"""
+        first = self.client.get('/api/games/active/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/games/active/')
+        
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_if_none_match_returns_304(self):
+        """A matching ETag is answered with 304 Not Modified"""
+        etag = self.client.get('/api/games/active/')['ETag']
+        
+        response = self.client.get('/api/games/active/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_join_invalidates_lobby(self):
+        """Joining a game refreshes the cached lobby"""
+        etag = self.client.get('/api/games/active/')['ETag']
+        
+        self.client.post(f'/api/games/{self.game.id}/join/', {'player_name': 'Bob'}, format='json')
+        
+        response = self.client.get('/api/games/active/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()[0]['players']), 2)
+    
+    def test_create_invalidates_lobby(self):
+        """Creating a game adds it to the cached lobby"""
+        self.client.get('/api/games/active/')
+        self.client.post('/api/games/', {'name': 'New Game', 'hostName': 'Carol'}, format='json')
+        
+        names = [game['name'] for game in self.client.get('/api/games/active/').json()]
+        self.assertIn('New Game', names)
+    
+    def test_concurrent_misses_rebuild_once(self):
+        """Simultaneous cache misses are collapsed into one rebuild"""
+        import threading
+        import time
+        from unittest import mock
+        from game import lobby
+        
+        calls = []
+        
+        def slow_build(include_private=False):
+            calls.append(include_private)
+            time.sleep(0.2)
+            return {'etag': '"lobby-test"', 'data': []}
+        
+        results = []
+        with mock.patch.object(lobby, 'build_lobby', side_effect=slow_build):
+            threads = [threading.Thread(target=lambda: results.append(lobby.get_lobby())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+
+
+class LobbyConsumerTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game = Game.objects.create(name='Lobby Game')
+        Player.objects.create(game=self.game, name='Alice', is_host=True)
+    
+    def test_snapshot_then_deltas(self):
+        """Viewers get one snapshot, then deltas for lifecycle events"""
+        from asgiref.sync import async_to_sync
+        from channels.db import database_sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from rest_framework.test import APIClient
+        from game.consumers import LobbyConsumer
+        
+        client = APIClient()
+        
+        def join():
+            client.post(f'/api/games/{self.game.id}/join/', {'player_name': 'Bob'}, format='json')
+        
+        def create():
+            client.post('/api/games/', {'name': 'Second Game', 'hostName': 'Carol'}, format='json')
+        
+        async def run():
+            communicator = WebsocketCommunicator(LobbyConsumer.as_asgi(), '/ws/lobby/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['event'], 'lobby_snapshot')
+            self.assertEqual([g['name'] for g in snapshot['data']], ['Lobby Game'])
+            
+            await database_sync_to_async(join)()
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['event'], 'player_count_changed')
+            self.assertEqual(delta['data']['game_id'], str(self.game.id))
+            self.assertEqual(delta['data']['player_count'], 2)
+            self.assertEqual([p['name'] for p in delta['data']['players']], ['Alice', 'Bob'])
+            
+            await database_sync_to_async(create)()
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['event'], 'game_added')
+            self.assertEqual(delta['data']['name'], 'Second Game')
+            self.assertEqual(delta['data']['player_count'], 1)
+            self.assertEqual(set(delta['data']['players'][0]), {'id', 'name', 'color'})
+            
+            await communicator.disconnect()
+        
+        async_to_sync(run)()
+    
+    def test_delta_is_encoded_once_for_all_viewers(self):
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.db import database_sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from game import codec, lobby
+        from game.consumers import LobbyConsumer
+        
+        async def run():
+            viewers = [WebsocketCommunicator(LobbyConsumer.as_asgi(), '/ws/lobby/') for _ in range(3)]
+            for viewer in viewers:
+                await viewer.connect()
+                await viewer.receive_json_from()
+            
+            with mock.patch.object(codec, 'dumps', wraps=codec.dumps) as dumps:
+                await database_sync_to_async(lobby._broadcast)('game_removed', {'game_id': str(self.game.id)})
+                deltas = [await viewer.receive_json_from() for viewer in viewers]
+            
+            for viewer in viewers:
+                await viewer.disconnect()
+            return dumps.call_count, deltas
+        
+        calls, deltas = async_to_sync(run)()
+        
+        self.assertEqual(calls, 1)
+        self.assertEqual(deltas, [{'event': 'game_removed', 'data': {'game_id': str(self.game.id)}}] * 3)
+    
+    def test_finished_game_removed(self):
+        """Finishing a game removes it from the lobby"""
+        from unittest import mock
+        from game import lobby
+        
+        self.game.status = Game.Status.FINISHED
+        with mock.patch.object(lobby, '_broadcast') as broadcast:
+            lobby.status_changed(self.game)
+        broadcast.assert_called_once_with('game_removed', {'game_id': str(self.game.id)})
+
+
+class PresenceTests(GameTestCase):
+    def setUp(self):
+        from game import presence
+        
+        super().setUp()
+        presence._pending.clear()
+        presence._tracked.clear()
+        self.game = Game.objects.create(name='Presence Game')
+        self.alice = Player.objects.create(game=self.game, name='Alice', is_host=True)
+    
+    def _player(self):
+        self.alice.refresh_from_db()
+        return self.alice
+    
+    def test_flapping_connection_is_one_write(self):
+        """Drops and reconnects within the grace period coalesce into one write"""
+        from game import presence
+        
+        with self.assertNumQueries(0):
+            self.assertTrue(presence.connect(self.game.id, self.alice.id, 'chan-1'))
+            for n in range(2, 6):
+                presence.disconnect(self.game.id, self.alice.id, f'chan-{n - 1}')
+                self.assertFalse(presence.connect(self.game.id, self.alice.id, f'chan-{n}'))
+        
+        self.assertEqual(presence.expire(), [])
+        self.assertEqual(presence.flush(), 1)
+        self.assertTrue(self._player().is_connected)
+        self.assertEqual(presence.flush(), 0)
+    
+    def test_flush_leaves_state_version_alone(self):
+        """Presence writes do not make in-flight moves stale"""
+        from game import presence
+        
+        version = self.game.state_version
+        presence.connect(self.game.id, self.alice.id, 'chan-1')
+        presence.flush()
+        
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.state_version, version)
+    
+    def test_lapsed_player_goes_offline(self):
+        """A player whose key expires is flushed as offline"""
+        from game import presence
+        
+        presence.connect(self.game.id, self.alice.id, 'chan-1')
+        presence.flush()
+        seen = self._player().last_seen
+        
+        cache.delete(presence._key(self.game.id, self.alice.id))
+        self.assertEqual(presence.expire(), [(str(self.game.id), str(self.alice.id))])
+        presence.flush()
+        
+        player = self._player()
+        self.assertFalse(player.is_connected)
+        self.assertGreater(player.last_seen, seen)
+        self.assertEqual(presence.online_players(self.game.id, [self.alice.id]), set())
+    
+    def test_saves_do_not_touch_last_seen(self):
+        """last_seen only changes when presence is flushed"""
+        seen = self.alice.last_seen
+        self.alice.color = '#ff6b6b'
+        self.alice.save()
+        self.assertEqual(self._player().last_seen, seen)
+    
+    def test_consumer_announces_presence(self):
+        """Reconnecting sockets announce presence without writing to the database"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import presence
+        from game.routing import websocket_urlpatterns
+        
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            
+            await communicator.send_json_to({
+                'action': 'reconnect', 'data': {'player_token': str(self.alice.player_token)}
+            })
+            events = {}
+            for _ in range(2):
+                event = await communicator.receive_json_from()
+                events[event['event']] = event['data']
+            self.assertIn('game_state', events)
+            self.assertEqual(events['presence_changed'], {'player_id': str(self.alice.id), 'is_connected': True})
+            
+            await communicator.send_json_to({'action': 'heartbeat'})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+        
+        with mock.patch.object(presence, 'FLUSH_INTERVAL', 0):
+            async_to_sync(run)()
+        
+        self.assertFalse(self._player().is_connected)
+        self.assertEqual(presence.online_players(self.game.id, [self.alice.id]), {str(self.alice.id)})
+        presence.flush()
+        self.assertTrue(self._player().is_connected)
+
+
+class EventSyncTests(GameTestCase):
+    def setUp(self):
+        from game import presence
+        
+        super().setUp()
+        presence._pending.clear()
+        presence._tracked.clear()
+        self.game = Game.objects.create(name='Sync Game')
+        self.alice = Player.objects.create(game=self.game, name='Alice', is_host=True)
+    
+    def test_events_are_sequenced(self):
+        """Recorded events get increasing sequence numbers and stay buffered"""
+        from game import events
+        
+        start = events.current_seq(self.game.id)
+        first = events.record(self.game.id, 'color_changed', {'color': '#ff6b6b'})
+        second = events.record(self.game.id, 'player_ready_changed', {'is_ready': True})
+        
+        self.assertEqual([first['seq'], second['seq']], [start + 1, start + 2])
+        self.assertEqual(events.since(self.game.id, start), [first, second])
+        self.assertEqual(events.since(self.game.id, second['seq']), [])
+    
+    def test_gaps_need_a_snapshot(self):
+        """Gaps beyond the buffer, expired events and unknown sequences return None"""
+        from game import events
+        
+        start = events.current_seq(self.game.id)
+        for n in range(events.EVENT_BUFFER_SIZE + 1):
+            events.record(self.game.id, 'color_changed', {'n': n})
+        
+        self.assertIsNone(events.since(self.game.id, start))
+        self.assertEqual(len(events.since(self.game.id, start + 1)), events.EVENT_BUFFER_SIZE)
+        self.assertIsNone(events.since(self.game.id, start + events.EVENT_BUFFER_SIZE + 5))
+        
+        cache.delete(events._event_key(self.game.id, start + 3))
+        self.assertIsNone(events.since(self.game.id, start + 1))
+    
+    def test_reconnect_resumes_from_last_seq(self):
+        """A reconnecting client gets only the events it missed"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import events, presence
+        from game.routing import websocket_urlpatterns
+        
+        async def reconnect(last_seq=None):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            data = {'player_token': str(self.alice.player_token)}
+            if last_seq is not None:
+                data['last_seq'] = last_seq
+            await communicator.send_json_to({'action': 'reconnect', 'data': data})
+            received = []
+            while True:
+                message = await communicator.receive_json_from()
+                received.append(message)
+                if message['event'] in ('resumed', 'game_state'):
+                    break
+            await communicator.disconnect()
+            return received
+        
+        with mock.patch.object(presence, 'FLUSH_INTERVAL', 0):
+            received = async_to_sync(reconnect)()
+            state = next(m for m in received if m['event'] == 'game_state')
+            last_seq = state['seq']
+            
+            missed = events.record(self.game.id, 'color_changed', {'player_id': str(self.alice.id)})
+            received = async_to_sync(reconnect)(last_seq)
+            
+            self.assertEqual(received[0], missed)
+            self.assertEqual(received[-1]['event'], 'resumed')
+            self.assertNotIn('game_state', [m['event'] for m in received])
+            
+            received = async_to_sync(reconnect)(last_seq - events.EVENT_BUFFER_SIZE - 1)
+            self.assertEqual(received[-1]['event'], 'game_state')
+            self.assertGreaterEqual(received[-1]['seq'], missed['seq'])
+    
+    def test_frames_covered_by_snapshot_are_dropped(self):
+        """Frames a snapshot or resume covered are not sent again; late frames after it still are"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from game.consumers import GameConsumer
+        
+        consumer = GameConsumer()
+        consumer.subprotocol = None
+        sent = []
+        
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+        
+        with mock.patch.object(consumer, 'send', send):
+            consumer.mark_covered(10)
+            # 12 overtakes 11 on the channel layer; 11 must not be lost
+            for seq in (9, 10, 12, 11, 13):
+                async_to_sync(consumer.game_frame)({'seq': seq, 'text': str(seq), 'bytes': None})
+        self.assertEqual(sent, ['12', '11', '13'])
+
+
+    def test_broadcasts_are_encoded_once(self):
+        """Every socket of a game gets the frame encoded by the sender"""
+        import json
+        from unittest import mock
+        import msgpack
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import codec, events, protocol
+        from game.routing import websocket_urlpatterns
+        
+        async def run():
+            sockets = [
+                WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/',
+                                      subprotocols=subprotocols)
+                for subprotocols in ([], [], ['ti-chess.msgpack'])
+            ]
+            for communicator in sockets:
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            
+            with mock.patch.object(codec, 'dumps', wraps=codec.dumps) as dumps, \
+                    mock.patch.object(protocol, 'encode', wraps=protocol.encode) as encode:
+                message = await events.publish(get_channel_layer(), self.game.id, 'color_changed', {
+                    'player_id': str(self.alice.id), 'color': '#ff6b6b'
+                })
+                received = [await communicator.receive_output() for communicator in sockets]
+            
+            self.assertEqual((dumps.call_count, encode.call_count), (1, 1))
+            self.assertEqual(json.loads(received[0]['text']), message)
+            self.assertEqual(received[0]['text'], received[1]['text'])
+            frame = msgpack.unpackb(received[2]['bytes'], raw=False, ext_hook=protocol._ext_hook)
+            self.assertEqual(frame, [protocol.EVENT_CODES['color_changed'], message['data'], message['seq']])
+            for communicator in sockets:
+                await communicator.disconnect()
+        
+        async_to_sync(run)()
+
+
+class SpectatorTests(GameTestCase):
+    def setUp(self):
+        from game import spectators
+        
+        super().setUp()
+        spectators._dirty.clear()
+        spectators._local.clear()
+        self.game = Game.objects.create(name='Watched Game')
+        self.alice = Player.objects.create(game=self.game, name='Alice', is_host=True)
+    
+    def test_changes_coalesce_per_watched_game(self):
+        """Only games with spectators get a frame, one per tick however many events happened"""
+        from game import spectators
+        
+        quiet = Game.objects.create(name='Quiet Game')
+        spectators.joined(self.game.id)
+        for event in ('move_made', 'presence_changed', 'move_made'):
+            spectators.mark(self.game.id, event)
+        spectators.mark(quiet.id, 'move_made')
+        
+        self.assertEqual(spectators.drain(), {
+            str(self.game.id): ['move_made', 'presence_changed', 'move_made']
+        })
+        self.assertEqual(spectators.drain(), {})
+        
+        spectators.left(self.game.id)
+        self.assertEqual(spectators.watching(self.game.id), 0)
+    
+    def test_frames_carry_no_player_tokens(self):
+        """Spectator frames are read-only: no token a spectator could reconnect with"""
+        from game import spectators
+        
+        bob = Player.objects.create(game=self.game, name='Bob')
+        Game.objects.filter(pk=self.game.pk).update(current_turn_player=bob)
+        
+        frames = spectators.build_frame(self.game.id, ['move_made'])
+        
+        self.assertIn(str(bob.id), frames['text'])
+        self.assertNotIn('player_token', frames['text'])
+        for player in (self.alice, bob):
+            self.assertNotIn(str(player.player_token), frames['text'])
+            if frames.get('bytes') is not None:
+                self.assertNotIn(str(player.player_token).encode(), frames['bytes'])
+    
+    def test_counts_of_a_dead_process_expire(self):
+        """Counts carry a TTL that only a live process refreshes"""
+        from unittest import mock
+        from game import spectators
+        
+        # Another process registered two spectators and then crashed
+        with mock.patch.object(spectators, 'PROCESS_ID', 'crashed'):
+            spectators.joined(self.game.id)
+            spectators.joined(self.game.id)
+        spectators._local.clear()
+        spectators.joined(self.game.id)
+        self.assertEqual(spectators.watching(self.game.id), 3)
+        
+        # Its key times out; this process's heartbeat keeps its own count
+        cache.delete(spectators._count_key(self.game.id, 'crashed'))
+        spectators.heartbeat()
+        self.assertEqual(spectators.watching(self.game.id), 1)
+        self.assertEqual(cache.get(spectators._registry_key(self.game.id)), [spectators.PROCESS_ID])
+    
+    def test_slow_spectator_keeps_latest_frame(self):
+        """Frames queued behind a slow send are dropped oldest first"""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from game.consumers import SpectatorConsumer
+        
+        async def run():
+            sent = []
+            release = asyncio.Event()
+            
+            async def slow_send(message):
+                await release.wait()
+                sent.append(message['text'])
+            
+            consumer = SpectatorConsumer()
+            consumer.base_send = slow_send
+            await consumer.spectator_frame({'text': 'frame-0', 'bytes': None})
+            await asyncio.sleep(0)
+            for n in range(1, 5):
+                await consumer.spectator_frame({'text': f'frame-{n}', 'bytes': None})
+            release.set()
+            await consumer.writer
+            return sent
+        
+        self.assertEqual(async_to_sync(run)(), ['frame-0', 'frame-4'])
+    
+    def test_spectators_are_separate_from_players(self):
+        """Spectators get coalesced read-only frames and never join the players' group"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import events, spectators
+        from game.routing import websocket_urlpatterns
+        
+        async def run():
+            player = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+            watcher = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/spectate/'
+            )
+            for communicator in (player, watcher):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            
+            frame = await watcher.receive_json_from()
+            self.assertEqual(frame['event'], 'spectator_frame')
+            self.assertEqual(frame['data']['spectators'], 1)
+            self.assertEqual(len(frame['data']['board']['board']), 8)
+            
+            layer = get_channel_layer()
+            for color in ('#ff6b6b', '#4ecdc4', '#45b7d1'):
+                await events.publish(layer, self.game.id, 'color_changed', {'color': color})
+            for _ in range(3):
+                self.assertEqual((await player.receive_json_from())['event'], 'color_changed')
+            self.assertTrue(await watcher.receive_nothing())
+            
+            await spectators.tick(layer)
+            frame = await watcher.receive_json_from()
+            self.assertEqual(frame['data']['events'], ['color_changed'] * 3)
+            self.assertTrue(await watcher.receive_nothing())
+            self.assertTrue(await player.receive_nothing())
+            
+            await watcher.send_json_to({'action': 'make_move', 'data': {}})
+            self.assertEqual((await watcher.receive_json_from())['event'], 'error')
+            for communicator in (player, watcher):
+                await communicator.disconnect()
+        
+        with mock.patch.object(spectators, 'SPECTATOR_FRAME_RATE', 0):
+            async_to_sync(run)()
+        self.assertEqual(spectators.watching(self.game.id), 0)
+
+
+class RateLimitTests(GameTestCase):
+    def setUp(self):
+        from game import metrics
+        
+        super().setUp()
+        metrics.reset()
+        self.game = Game.objects.create(name='Limited Game')
+    
+    def test_token_bucket(self):
+        """Buckets allow a burst, then refill at their rate"""
+        from game.ratelimit import TokenBucket
+        
+        now = [0.0]
+        bucket = TokenBucket(2, 3, clock=lambda: now[0])
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+        now[0] += 0.5
+        self.assertEqual([bucket.take() for _ in range(2)], [True, False])
+        now[0] += 10
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+    
+    def test_flooding_client_is_limited_then_closed(self):
+        """Frames over an action's limit are rejected, and persistent flooding closes the socket"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import metrics, ratelimit
+        from game.routing import websocket_urlpatterns
+        
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            
+            for _ in range(2):
+                await communicator.send_json_to({'action': 'ready', 'data': {'ready': True}})
+            errors = [await communicator.receive_json_from() for _ in range(2)]
+            # Not joined: the first frame reaches the handler, the second is refused
+            self.assertEqual(errors[0]['data']['message'], 'Not authenticated')
+            self.assertEqual(errors[1]['data'], {
+                'message': 'Rate limit exceeded', 'code': 'rate_limited', 'action': 'ready'
+            })
+            
+            await communicator.send_json_to({'action': 'ready', 'data': {'ready': True}})
+            closed = await communicator.receive_output()
+            self.assertEqual(closed, {'type': 'websocket.close', 'code': ratelimit.CLOSE_POLICY_VIOLATION})
+        
+        with mock.patch.dict(ratelimit.ACTION_RATES, {'ready': (0.001, 1)}), \
+                mock.patch.object(ratelimit, 'VIOLATION_RATE', (0.001, 1)):
+            async_to_sync(run)()
+        
+        self.assertEqual(metrics.get('ws.frames_rejected'), 2)
+        self.assertEqual(metrics.get('ws.frames_rejected.ready'), 2)
+        self.assertEqual(metrics.get('ws.connections_closed'), 1)
+        
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.json()['counters']['ws.frames_rejected'], 2)
+    
+    def test_full_inbox_drops_frames(self):
+        """Frames beyond the bounded inbound queue are dropped and counted"""
+        import asyncio
+        import json
+        from asgiref.sync import async_to_sync
+        from game import metrics
+        from game.consumers import GameConsumer
+        
+        async def run():
+            sent = []
+            
+            async def sink(message):
+                sent.append(message)
+            
+            consumer = GameConsumer()
+            consumer.base_send = sink
+            consumer.inbox = asyncio.Queue(maxsize=1)
+            # A handler is still busy with earlier frames
+            consumer.worker = asyncio.get_running_loop().create_future()
+            for _ in range(2):
+                await consumer.receive(text_data=json.dumps({'action': 'heartbeat'}))
+            consumer.worker.cancel()
+            return sent
+        
+        sent = async_to_sync(run)()
+        self.assertEqual(metrics.get('ws.frames_dropped'), 1)
+        self.assertEqual(json.loads(sent[0]['text'])['data']['message'], 'Too many pending messages')
+    
+    def test_unhashable_action_is_malformed(self):
+        """A list or dict action is refused without killing the consumer"""
+        import json
+        from asgiref.sync import async_to_sync
+        from game.consumers import GameConsumer
+        
+        async def run():
+            sent = []
+            
+            async def sink(message):
+                sent.append(message)
+            
+            consumer = GameConsumer()
+            consumer.base_send = sink
+            for frame in ({'action': ['make_move']}, {'action': {'a': 1}}, {'action': 'ready', 'data': []}):
+                await consumer.receive(text_data=json.dumps(frame))
+            return sent
+        
+        sent = async_to_sync(run)()
+        self.assertEqual(len(sent), 3)
+        for message in sent:
+            self.assertTrue(json.loads(message['text'])['data']['message'].startswith('Malformed message'))
+
+
+class CodecTests(TestCase):
+    def test_encodes_like_stdlib(self):
+        """orjson and the stdlib fallback produce the same data for serializer output"""
+        import json
+        import uuid
+        from datetime import datetime, timezone as dt_timezone
+        from decimal import Decimal
+        from unittest import mock
+        from rest_framework.utils.serializer_helpers import ReturnDict
+        from game import codec
+        
+        value = ReturnDict({
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'at': datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc),
+            'price': Decimal('1.50'),
+            'nested': [{'x': 1, 'y': None}],
+        }, serializer=None)
+        expected = {
+            'id': '12345678-1234-5678-1234-567812345678',
+            'at': '2024-05-01T12:30:00Z',
+            'price': '1.50',
+            'nested': [{'x': 1, 'y': None}],
+        }
+        
+        self.assertEqual(codec.loads(codec.dumps(value)), expected)
+        with mock.patch.object(codec, 'orjson', None):
+            self.assertEqual(json.loads(codec.dumps(value)), expected)
+        # Values orjson refuses fall back to the stdlib
+        self.assertEqual(codec.loads(codec.dumps({1: 'a'})), {'1': 'a'})
+        with self.assertRaises(ValueError):
+            codec.loads('{"unterminated": ')
+    
+    def test_rest_api_uses_codec(self):
+        """REST responses are rendered and requests parsed by the codec"""
+        from unittest import mock
+        from game import codec
+        
+        with mock.patch.object(codec, 'dumps_bytes', wraps=codec.dumps_bytes) as dumps_bytes:
+            response = self.client.get('/api/health/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(dumps_bytes.call_count, 1)
+        
+        response = self.client.post('/api/games/', '{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+
+class BinaryProtocolTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game, self.alice, self.bob = create_game('Binary Game', alice={'is_host': True})
+        self.pieces = [
+            Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                 position_x=x, position_y=1)
+            for x in range(8)
+        ]
+    
+    def _unpack(self, frame):
+        import msgpack
+        from game import protocol
+        
+        # Sequenced game events carry their seq as a third element
+        return msgpack.unpackb(frame, raw=False, ext_hook=protocol._ext_hook)[:2]
+    
+    def test_negotiation_prefers_msgpack(self):
+        """MessagePack is chosen when offered, JSON otherwise"""
+        from game import protocol
+        
+        self.assertEqual(protocol.negotiate(['ti-chess.json', 'ti-chess.msgpack']), 'ti-chess.msgpack')
+        self.assertEqual(protocol.negotiate(['ti-chess.json']), 'ti-chess.json')
+        self.assertIsNone(protocol.negotiate([]))
+    
+    def test_move_made_is_compact(self):
+        """Moves are packed with piece references and 16-byte UUIDs"""
+        import json
+        from game import protocol
+        
+        index = protocol.PieceIndex.load(self.game.id)
+        piece = self.pieces[3]
+        message = {'event': 'move_made', 'data': {
+            'move_id': '6a0b1c3e-1b9d-4c43-9d5e-0f9b8e3c2a11', 'player_id': str(self.alice.id),
+            'piece_id': str(piece.id), 'from': [3, 1], 'to': [3, 2],
+            'events': [{'type': 'piece_moved', 'data': {'piece_id': str(piece.id)}}],
+            'board_changes': [{'x': 3, 'y': 1, 'piece': None}, {'x': 3, 'y': 2, 'piece': str(piece.id)}],
+            'winner': None, 'turn': str(self.bob.id), 'state_version': 9,
+            'turn_deadline': '2026-10-19T12:04:00+00:00', 'premove': True,
+        }}
+        
+        frame = protocol.encode(message, index)
+        code, payload = self._unpack(frame)
+        
+        self.assertEqual(code, protocol.EVENT_CODES['move_made'])
+        self.assertEqual(payload[2], 3)
+        self.assertEqual(payload[3:8], [3, 1, 3, 2, 9])
+        self.assertEqual(payload[11], [[3, 1, None], [3, 2, 3]])
+        self.assertEqual(payload[10][0]['data']['piece_id'], str(piece.id))
+        self.assertEqual(payload[14:], ['2026-10-19T12:04:00+00:00', True])
+        self.assertLess(len(frame), len(json.dumps(message)) / 2)
+    
+    def test_make_move_decodes_to_json_shape(self):
+        """Binary actions decode to the same shape as JSON frames"""
+        import msgpack
+        from game import protocol
+        
+        index = protocol.PieceIndex.load(self.game.id)
+        frame = msgpack.packb([protocol.ACTION_CODES['make_move'], [5, 5, 1, 5, 2, 3]])
+        
+        self.assertEqual(protocol.decode(frame, index), {'action': 'make_move', 'data': {
+            'piece_id': str(self.pieces[5].id), 'from': [5, 1], 'to': [5, 2], 'state_version': 3,
+        }})
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.decode(b'\xc1', index)
+    
+    def test_consumer_speaks_msgpack(self):
+        """A client offering the msgpack subprotocol plays over binary frames"""
+        from unittest import mock
+        import msgpack
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game import presence, protocol
+        from game.routing import websocket_urlpatterns
+        
+        async def receive_event(communicator, name):
+            while True:
+                code, payload = self._unpack(await communicator.receive_from())
+                if code == protocol.EVENT_CODES[name]:
+                    return payload
+        
+        async def run():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/',
+                subprotocols=['ti-chess.msgpack']
+            )
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, 'ti-chess.msgpack')
+            
+            await communicator.send_to(bytes_data=msgpack.packb([
+                protocol.ACTION_CODES['reconnect'], {'player_token': str(self.alice.player_token)}
+            ]))
+            state = await receive_event(communicator, 'game_state')
+            self.assertEqual(state['piece_index'], [str(p.id) for p in self.pieces])
+            
+            await communicator.send_to(bytes_data=msgpack.packb([
+                protocol.ACTION_CODES['make_move'], [0, 0, 1, 0, 2, 0]
+            ]))
+            move = await receive_event(communicator, 'move_made')
+            self.assertEqual(move[1:8], [str(self.alice.id), 0, 0, 1, 0, 2, 1])
+            await communicator.disconnect()
+        
+        with mock.patch.object(presence, 'FLUSH_INTERVAL', 0):
+            async_to_sync(run)()
+
+
+class BoardVersionTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game = Game.objects.create(name='Board Game')
+        Player.objects.create(game=self.game, name='Alice', is_host=True)
+        self.url = f'/api/games/{self.game.id}/board/'
+    
+    def _version(self):
+        self.game.refresh_from_db(fields=['state_version'])
+        return self.game.state_version
+    
+    def test_bump_state_version_is_atomic_increment(self):
+        """bump_state_version increments in the database"""
+        Game.objects.filter(pk=self.game.pk).bump_state_version()
+        Game.objects.filter(pk=self.game.pk).bump_state_version()
+        self.assertEqual(self._version(), 2)
+    
+    def test_board_carries_version_etag(self):
+        """Board responses carry state_version as the ETag"""
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.json()['state_version'], 0)
+        self.assertEqual(response['ETag'], f'"board-{self.game.id}-0"')
+    
+    def test_conditional_get_returns_304(self):
+        """Unchanged boards are answered with 304 after one query"""
+        etag = self.client.get(self.url)['ETag']
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_cached_payload_per_version(self):
+        """The payload for an unchanged version is served from the cache"""
+        first = self.client.get(self.url).json()
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url).json()
+        self.assertEqual(first, second)
+    
+    def test_join_bumps_version(self):
+        """State changes invalidate the previous ETag"""
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(f'/api/games/{self.game.id}/join/', {'player_name': 'Bob'}, format='json')
+        
+        self.assertEqual(self._version(), 1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['players']), 2)
+    
+    def test_missing_game_returns_404(self):
+        """Unknown games are reported as not found"""
+        import uuid
+        
+        response = self.client.get(f'/api/games/{uuid.uuid4()}/board/')
+        self.assertEqual(response.status_code, 404)
+
+
+class KeysetPaginationTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game = Game.objects.create(name='Long Game', status=Game.Status.ACTIVE)
+        player = Player.objects.create(game=self.game, name='Alice')
+        piece = Piece.objects.create(game=self.game, owner=player, piece_type=Piece.PieceType.TALENT,
+                                     position_x=0, position_y=1)
+        for number in range(1, 8):
+            Move.objects.create(game=self.game, player=player, piece=piece, move_type=Move.MoveType.MOVE,
+                                from_x=0, from_y=1, to_x=0, to_y=2, move_number=number)
+    
+    def _pages(self, url, params):
+        """Follow next links, returning move numbers per page and queries per page"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        pages, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                data = self.client.get(url, params).json()
+            params = None
+            pages.append([move['move_number'] for move in data['results']])
+            queries.append(len(captured))
+            url = data['next']
+        return pages, queries
+    
+    def test_moves_require_game_id(self):
+        """Unfiltered move listings are rejected"""
+        response = self.client.get('/api/moves/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('game_id', response.json())
+    
+    def test_moves_paginate_by_cursor(self):
+        """Pages follow move order and deep pages cost the same as the first"""
+        pages, queries = self._pages('/api/moves/', {'game_id': str(self.game.id), 'page_size': 3})
+        
+        self.assertEqual(pages, [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(len(set(queries)), 1)
+    
+    def test_page_size_is_capped(self):
+        """page_size above the cap falls back to the maximum"""
+        from unittest import mock
+        from game.pagination import MoveCursorPagination
+        
+        with mock.patch.object(MoveCursorPagination, 'max_page_size', 2):
+            data = self.client.get('/api/moves/', {'game_id': str(self.game.id), 'page_size': 1000}).json()
+        self.assertEqual(len(data['results']), 2)
+    
+    def test_games_paginate_newest_first(self):
+        """Games are paged newest first without a COUNT query"""
+        second = Game.objects.create(name='Newer Game')
+        
+        data = self.client.get('/api/games/', {'page_size': 1}).json()
+        self.assertNotIn('count', data)
+        self.assertEqual(data['results'][0]['id'], str(second.id))
+        self.assertEqual(self.client.get(data['next']).json()['results'][0]['id'], str(self.game.id))
+    
+    def test_game_pages_are_cached_until_lobby_event(self):
+        """Each cursor page is cached and retired with the lobby generation"""
+        from game import lobby
+        
+        first = self.client.get('/api/games/', {'page_size': 1}).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/games/', {'page_size': 1}).json(), first)
+        
+        newer = Game.objects.create(name='Newer Game')
+        self.assertEqual(self.client.get('/api/games/', {'page_size': 1}).json(), first)
+        lobby.invalidate()
+        self.assertEqual(self.client.get('/api/games/', {'page_size': 1}).json()['results'][0]['id'], str(newer.id))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are only checked against Postgres')
+class QueryPlanTests(GameTestCase):
+    """
+    EXPLAIN every query issued on the hot paths and fail on a full table scan
+    of a game table. Production runs Postgres; SQLite plans tiny test tables
+    differently, so run with DATABASE_URL pointing at a Postgres database.
+    """
+    
+    LARGE_TABLES = {
+        'game_game', 'game_player', 'game_piece', 'game_move',
+        'game_gameevent', 'game_gamesnapshot',
+    }
+    
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from game import replay
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game, self.alice, self.bob = create_game('Plan Game')
+        place_talent_rows(self.game, self.alice, self.bob)
+        replay.capture_snapshot(self.game, 0)
+    
+    def _capture(self, func):
+        """Run func, returning the (sql, params) of every statement it executed"""
+        statements = []
+        
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+        
+        with connection.execute_wrapper(record):
+            func()
+        return [
+            (sql, params) for sql, params in statements
+            if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))
+        ]
+    
+    def _full_scans(self, sql, params):
+        """Names of game tables read with a full scan by this statement"""
+        import json
+        
+        with connection.cursor() as cursor:
+            # Discourage sequential scans so any that remain have no index
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        
+        found = set()
+        
+        def walk(node):
+            if node.get('Node Type') == 'Seq Scan':
+                found.add(node.get('Relation Name'))
+            for child in node.get('Plans', []):
+                walk(child)
+        
+        walk(plan[0]['Plan'])
+        return found & self.LARGE_TABLES
+    
+    def assertNoFullScans(self, func):
+        statements = self._capture(func)
+        self.assertTrue(statements)
+        for sql, params in statements:
+            scans = self._full_scans(sql, params)
+            self.assertFalse(scans, f'Full scan of {scans} in: {sql}')
+    
+    def _make_move(self):
+        piece = Piece.objects.get(game=self.game, position_x=0, position_y=1, is_active=True)
+        response = self.client.post(f'/api/games/{self.game.id}/move/', {
+            'piece_id': str(piece.id), 'from_x': 0, 'from_y': 1, 'to_x': 0, 'to_y': 3,
+            'player_token': str(self.alice.player_token),
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+    
+    def test_active_games(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/games/active/'))
+    
+    def test_board(self):
+        self.assertNoFullScans(lambda: self.client.get(f'/api/games/{self.game.id}/board/'))
+    
+    def test_move(self):
+        self.assertNoFullScans(self._make_move)
+    
+    def test_replay(self):
+        self._make_move()
+        self.assertNoFullScans(lambda: self.client.get(f'/api/games/{self.game.id}/replay/'))
+        self.assertNoFullScans(lambda: self.client.get(f'/api/games/{self.game.id}/replay/position/', {'move': 1}))
+    
+    def test_consumer_queries(self):
+        from asgiref.sync import async_to_sync
+        from game.consumers import GameConsumer
+        
+        consumer = GameConsumer()
+        consumer.game_id = str(self.game.id)
+        
+        def run():
+            consumer.player = async_to_sync(consumer.get_player_by_token)(str(self.alice.player_token))
+            async_to_sync(consumer.check_can_start_game)()
+            async_to_sync(consumer.get_game_data)()
+        
+        self.assertNoFullScans(run)
+    
+    def test_consumer_move(self):
+        from asgiref.sync import async_to_sync
+        from game.consumers import GameConsumer
+        from game.engine import Position
+        
+        consumer = GameConsumer()
+        consumer.game_id = str(self.game.id)
+        consumer.player = self.alice
+        piece = Piece.objects.get(game=self.game, position_x=0, position_y=1)
+        
+        def run():
+            result = async_to_sync(consumer.process_move)(str(piece.id), Position(0, 1), Position(0, 3))
+            self.assertTrue(result['success'], result)
+        
+        self.assertNoFullScans(run)
+
+
+class MoveConcurrencyTests(GameTestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        
+        super().setUp()
+        self.client = APIClient()
+        self.game, self.alice, self.bob = create_game('Race Game')
+        self.piece = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                          position_x=0, position_y=1)
+        Piece.objects.create(game=self.game, owner=self.bob, piece_type=Piece.PieceType.TALENT,
+                             position_x=0, position_y=6)
+        self.url = f'/api/games/{self.game.id}/move/'
+    
+    def _move(self, player, **extra):
+        return self.client.post(self.url, {
+            'piece_id': str(self.piece.id), 'from_x': 0, 'from_y': 1, 'to_x': 0, 'to_y': 2,
+            'player_token': str(player.player_token), **extra
+        }, format='json')
+    
+    def test_move_returns_new_version(self):
+        """A committed move reports the state_version it produced"""
+        response = self._move(self.alice, state_version=0)
+        
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['state_version'], 1)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.state_version, 1)
+        self.assertEqual(self.game.current_turn_player_id, self.bob.id)
+    
+    def test_stale_version_is_rejected(self):
+        """Moves based on an outdated state get 409 with the current version"""
+        Game.objects.filter(pk=self.game.pk).bump_state_version()
+        
+        response = self._move(self.alice, state_version=0)
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['code'], 'stale_state')
+        self.assertEqual(response.json()['state_version'], 1)
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+    
+    def test_concurrent_commit_loses_race(self):
+        """A state change during evaluation makes the compare-and-swap fail"""
+        from unittest import mock
+        from game import services
+        
+        load_engine = services.load_engine
+        
+        def racing_load_engine(game_id):
+            loaded = load_engine(game_id)
+            Game.objects.filter(pk=game_id).bump_state_version()
+            return loaded
+        
+        with mock.patch.object(services, 'load_engine', racing_load_engine):
+            response = self._move(self.alice)
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['state_version'], 1)
+        self.piece.refresh_from_db()
+        self.assertEqual(self.piece.position_y, 1)
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+    
+    def test_next_move_uses_resident_board(self):
+        """After a committed move, the next move of the game is applied without loading the board"""
+        from unittest import mock
+        from game import resident, services
+        
+        resident.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._move(self.alice).status_code, 200)
+        
+        bob_piece = Piece.objects.get(game=self.game, owner=self.bob)
+        with mock.patch.object(services, 'load_engine', side_effect=AssertionError('board loaded')):
+            response = self.client.post(self.url, {
+                'piece_id': str(bob_piece.id), 'from_x': 0, 'from_y': 6, 'to_x': 0, 'to_y': 5,
+                'player_token': str(self.bob.player_token), 'state_version': 1
+            }, format='json')
+        
+        self.assertEqual(response.status_code, 200, response.content)
+        bob_piece.refresh_from_db()
+        self.assertEqual(bob_piece.position_y, 5)
+        self.assertEqual(Move.objects.get(game=self.game, piece=bob_piece).move_number, 2)
+        resident.clear()
+    
+    def test_wrong_turn_is_rejected(self):
+        """Players cannot move out of turn"""
+        response = self._move(self.bob)
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Not your turn')
+
+
+class GameActorTests(GameTestCase):
+    def setUp(self):
+        from game import metrics
+        
+        super().setUp()
+        metrics.reset()
+        self.game, self.alice, self.bob = create_game('Actor Game')
+        self.pieces = [
+            Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                 position_x=x, position_y=1)
+            for x in range(2)
+        ]
+    
+    def test_commands_apply_in_order_in_batches(self):
+        """Concurrent submissions run one at a time, in submission order, batched per transaction"""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from game import actors, metrics
+        
+        applied = []
+        
+        def command(n):
+            applied.append(n)
+            if n == 2:
+                raise ValueError('bad command')
+            return n * 10
+        
+        async def run():
+            return await asyncio.gather(
+                *(actors.submit(self.game.id, command, n) for n in range(5)),
+                return_exceptions=True
+            )
+        
+        results = async_to_sync(run)()
+        self.assertEqual(applied, [0, 1, 2, 3, 4])
+        self.assertEqual(results[:2] + results[3:], [0, 10, 30, 40])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(metrics.get('actor.commands'), 5)
+        self.assertLess(metrics.get('actor.batches'), 5)
+    
+    def test_full_queue_is_refused(self):
+        """Submissions beyond the queue bound fail fast"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from game import actors
+        
+        async def run():
+            actor = actors.actor_for(self.game.id)
+            accepted = [actor.submit(int, '1'), actor.submit(int, '2')]
+            with self.assertRaises(actors.GameBusy):
+                actor.submit(int, '3')
+            return [await future for future in accepted]
+        
+        with mock.patch.object(actors, 'ACTOR_QUEUE_SIZE', 2):
+            self.assertEqual(async_to_sync(run)(), [1, 2])
+    
+    def test_concurrent_moves_from_two_sockets(self):
+        """Two sockets moving at once are serialized: one move commits, the other sees the new turn"""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from game import actors, services
+        from game.engine import Position
+        
+        async def run():
+            return await asyncio.gather(*(
+                actors.submit(self.game.id, services.apply_move, self.game.id, self.alice,
+                              str(piece.id), Position(piece.position_x, 1), Position(piece.position_x, 2))
+                for piece in self.pieces
+            ))
+        
+        first, second = async_to_sync(run)()
+        self.assertTrue(first['success'])
+        self.assertEqual(second, {'success': False, 'error': 'Not your turn'})
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 1)
+
+
+class GameAffinityTests(GameTestCase):
+    def setUp(self):
+        from game import metrics
+        
+        super().setUp()
+        metrics.reset()
+        self.game, self.alice, self.bob = create_game('Affinity Game')
+        self.piece = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                          position_x=0, position_y=1)
+        self.move = {
+            'game_id': str(self.game.id), 'player_id': str(self.alice.id), 'piece_id': str(self.piece.id),
+            'from_pos': [0, 1], 'to_pos': [0, 2], 'expected_version': None,
+        }
+    
+    def test_ring_moves_few_games_when_a_worker_joins(self):
+        """Adding a worker only moves games to the new worker, about 1/N of them"""
+        import uuid
+        from game.affinity import HashRing
+        
+        games = [str(uuid.uuid4()) for _ in range(2000)]
+        before = HashRing(['w1', 'w2', 'w3'])
+        after = HashRing(['w1', 'w2', 'w3', 'w4'])
+        
+        moved = [game for game in games if before.owner(game) != after.owner(game)]
+        self.assertTrue(all(after.owner(game) == 'w4' for game in moved))
+        self.assertLess(len(moved), len(games) * 0.4)
+        self.assertEqual({before.owner(game) for game in games}, {'w1', 'w2', 'w3'})
+    
+    def test_commands_are_forwarded_to_the_owner(self):
+        """A worker that does not own a game forwards its commands; the owner leaving hands the game off"""
+        from asgiref.sync import async_to_sync
+        from channels.layers import InMemoryChannelLayer
+        from game import affinity, metrics
+        
+        async def run():
+            layer = InMemoryChannelLayer()
+            workers = [affinity.AffinityWorker(layer), affinity.AffinityWorker(layer)]
+            for worker in workers:
+                await worker.start()
+            workers[0].refresh()
+            workers[1].refresh()
+            
+            owner = next(w for w in workers if w.owner(self.game.id) == w.channel)
+            other = next(w for w in workers if w is not owner)
+            result = await other.submit(self.game.id, 'apply_move', self.move)
+            self.assertTrue(result['success'], result)
+            self.assertEqual(metrics.get('affinity.commands_forwarded'), 1)
+            self.assertEqual(metrics.get('affinity.commands_received'), 1)
+            
+            await owner.stop()
+            other.refresh()
+            self.assertEqual(other.owner(self.game.id), other.channel)
+            await other.stop()
+        
+        async_to_sync(run)()
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 1)
+    
+    def test_unresponsive_owner_times_out_without_local_apply(self):
+        """A forward that times out is reported, not applied a second time locally"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.layers import InMemoryChannelLayer
+        from game import affinity, metrics
+        
+        async def run():
+            worker = affinity.AffinityWorker(InMemoryChannelLayer())
+            await worker.start()
+            worker.ring = affinity.HashRing(['specific.gone!worker'])
+            result = await worker.submit(self.game.id, 'apply_move', self.move)
+            await worker.stop()
+            return result
+        
+        with mock.patch.object(affinity, 'FORWARD_TIMEOUT', 0.05):
+            result = async_to_sync(run)()
+        self.assertFalse(result['success'])
+        self.assertEqual(result['code'], 'timeout')
+        self.assertEqual(metrics.get('affinity.forward_timeouts'), 1)
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+    
+    def test_repeated_command_is_applied_once(self):
+        """The owner answers a command delivered twice with the first outcome"""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from channels.layers import InMemoryChannelLayer
+        from game import affinity, metrics
+        
+        async def run():
+            worker = affinity.AffinityWorker(InMemoryChannelLayer())
+            message = {
+                'game_id': str(self.game.id), 'command': 'apply_move',
+                'command_id': 'c1', 'kwargs': self.move,
+            }
+            return await asyncio.gather(worker.apply_once(message), worker.apply_once(dict(message)))
+        
+        first, second = async_to_sync(run)()
+        self.assertTrue(first['success'], first)
+        self.assertEqual(first, second)
+        self.assertEqual(metrics.get('affinity.commands_repeated'), 1)
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 1)
+
+
+class ServerLoopTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.game, self.alice, self.bob = create_game('Server Loop Game')
+        self.alice_talent = Piece.objects.create(game=self.game, owner=self.alice,
+                                                 piece_type=Piece.PieceType.TALENT, position_x=0, position_y=1)
+        self.bob_talent = Piece.objects.create(game=self.game, owner=self.bob,
+                                               piece_type=Piece.PieceType.TALENT, position_x=0, position_y=6)
+    
+    def test_middleware_starts_background_loops_on_server_loop(self):
+        """The timer wheel and spectator relay run on the server loop, whatever the first request"""
+        import asyncio
+        import threading
+        from game import clocks, serverloop, spectators
+        
+        async def app(scope, receive, send):
+            pass
+        
+        async def stop_background():
+            for runner in (clocks._runner, spectators._runner):
+                runner.cancel()
+        
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(
+                serverloop.ServerLoopMiddleware(app)({'type': 'http'}, None, None), loop
+            ).result(5)
+            self.assertTrue(serverloop.running())
+            self.assertIs(clocks._runner.get_loop(), loop)
+            self.assertIs(spectators._runner.get_loop(), loop)
+            asyncio.run_coroutine_threadsafe(stop_background(), loop).result(5)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+    
+    def test_socket_move_after_rest_move(self):
+        """A REST move served through ASGI leaves the game's actor usable by the game's sockets"""
+        import asyncio
+        import json
+        import threading
+        from channels.routing import URLRouter
+        from channels.testing import HttpCommunicator, WebsocketCommunicator
+        from django.core.asgi import get_asgi_application
+        from game.routing import websocket_urlpatterns
+        
+        # A server loop of its own, like daphne's, rather than one made by async_to_sync
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        
+        def on_loop(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result(10)
+        
+        async def next_event(communicator, name):
+            while True:
+                message = await communicator.receive_json_from(timeout=5)
+                if message.get('event') == name:
+                    return message['data']
+        
+        socket = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+        body = json.dumps({
+            'piece_id': str(self.alice_talent.id), 'from_x': 0, 'from_y': 1, 'to_x': 0, 'to_y': 2,
+            'player_token': str(self.alice.player_token)
+        }).encode()
+        rest = HttpCommunicator(
+            get_asgi_application(), 'POST', f'/api/games/{self.game.id}/move/', body=body,
+            headers=[(b'host', b'testserver'), (b'content-type', b'application/json'),
+                     (b'content-length', str(len(body)).encode())]
+        )
+        try:
+            connected, _ = on_loop(socket.connect())
+            self.assertTrue(connected)
+            on_loop(socket.send_json_to({
+                'action': 'reconnect', 'data': {'player_token': str(self.bob.player_token)}
+            }))
+            on_loop(next_event(socket, 'game_state'))
+            
+            response = on_loop(rest.get_response(timeout=5))
+            self.assertEqual(response['status'], 200, response['body'])
+            self.assertEqual(on_loop(next_event(socket, 'move_made'))['player_id'], str(self.alice.id))
+            
+            on_loop(socket.send_json_to({
+                'action': 'make_move',
+                'data': {'piece_id': str(self.bob_talent.id), 'from': [0, 6], 'to': [0, 5]}
+            }))
+            move = on_loop(next_event(socket, 'move_made'))
+            on_loop(socket.disconnect())
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+        
+        self.assertEqual(move['player_id'], str(self.bob.id))
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 2)
+
+
+class SyncPoolTests(TestCase):
+    def setUp(self):
+        from game import syncpool
+        
+        syncpool.reset()
+    
+    def test_queue_depth_and_wait_are_tracked(self):
+        """Calls queued behind the sync thread are counted, with their wait"""
+        import asyncio
+        import time
+        from asgiref.sync import async_to_sync
+        from game import syncpool
+        
+        def work():
+            time.sleep(0.02)
+            return syncpool.snapshot()['running']
+        
+        async def run():
+            return await asyncio.gather(*(syncpool.sync_to_async(work)() for _ in range(3)))
+        
+        self.assertEqual(async_to_sync(run)(), [1, 1, 1])
+        
+        stats = syncpool.snapshot()
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual((stats['waiting'], stats['running']), (0, 0))
+        self.assertGreaterEqual(stats['peak_waiting'], 2)
+        self.assertGreaterEqual(stats['max_wait_ms'], 20)
+        
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.json()['sync_pool']['calls'], 3)
+    
+    def test_consumer_uses_async_orm(self):
+        """Consumer reads and writes run without the instrumented bridge"""
+        from asgiref.sync import async_to_sync
+        from game import syncpool
+        from game.consumers import GameConsumer
+        
+        game = Game.objects.create(name='Async Game')
+        alice = Player.objects.create(game=game, name='Alice', is_host=True)
+        Player.objects.create(game=game, name='Bob', is_ready=True)
+        
+        version = game.state_version
+        consumer = GameConsumer()
+        consumer.game_id = str(game.id)
+        
+        async def run():
+            consumer.player = await consumer.get_player_by_token(str(alice.player_token))
+            before = await consumer.check_can_start_game()
+            await consumer.update_player_ready(consumer.player.id, True)
+            return before, await consumer.check_can_start_game()
+        
+        self.assertEqual(async_to_sync(run)(), (False, True))
+        game.refresh_from_db()
+        self.assertEqual(game.state_version, version + 1)
+        self.assertEqual(syncpool.snapshot()['calls'], 0)
+
+
+class AsyncViewTests(TestCase):
+    def test_read_endpoints_are_async(self):
+        import asyncio
+        from game.views import ActiveGamesView, GameBoardView, HealthCheckView, api_root
+        
+        for view in (ActiveGamesView, GameBoardView, HealthCheckView):
+            self.assertTrue(view.view_is_async, view)
+        self.assertTrue(asyncio.iscoroutinefunction(api_root))
+        
+        response = self.client.get('/root/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('games', response.json()['endpoints'])
+    
+    def test_board_version_is_kept_in_process(self):
+        """A board version served once needs only the version lookup afterwards"""
+        game = Game.objects.create(name='Board Game')
+        Player.objects.create(game=game, name='Alice', is_host=True)
+        url = f'/api/games/{game.id}/board/'
+        
+        first = self.client.get(url)
+        cache.clear()
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+    
+    def test_static_middleware_stays_async(self):
+        """Non-static requests pass the WhiteNoise middleware without leaving the loop"""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from ti_chess.middleware import AsyncWhiteNoiseMiddleware
+        
+        async def get_response(request):
+            return HttpResponse('view')
+        
+        middleware = AsyncWhiteNoiseMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/api/health/'))
+        self.assertEqual(response.content, b'view')
+
+
+class TimerWheelTests(TestCase):
+    def test_timers_fire_on_their_tick(self):
+        """Timers across all levels fire on their deadline tick, never early"""
+        import random
+        from game.timerwheel import TimerWheel
+        
+        now = [0.0]
+        wheel = TimerWheel(tick=1, bits=3, levels=3, clock=lambda: now[0])
+        rng = random.Random(7)
+        # Up to beyond the 8 ** 3 ticks the wheel covers
+        delays = [rng.randint(1, 700) for _ in range(300)]
+        timers = {wheel.schedule(delay, lambda: None): delay for delay in delays}
+        cancelled = list(timers)[:20]
+        for timer in cancelled:
+            wheel.cancel(timer)
+        self.assertEqual(len(wheel), 280)
+        
+        fired = {}
+        for second in range(1, 701):
+            now[0] = second
+            for timer in wheel.advance():
+                fired[timer] = second
+        
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(set(fired), set(timers) - set(cancelled))
+        for timer, second in fired.items():
+            self.assertEqual(second, timers[timer])
+    
+    def test_late_advance_catches_up(self):
+        from game.timerwheel import TimerWheel
+        
+        now = [0.0]
+        wheel = TimerWheel(tick=0.5, bits=2, levels=2, clock=lambda: now[0])
+        first = wheel.schedule(1, lambda: 'first')
+        second = wheel.schedule(4, lambda: 'second')
+        
+        now[0] = 10
+        self.assertEqual([timer.fire() for timer in wheel.advance()], ['first', 'second'])
+        self.assertFalse(first.active or second.active)
+
+
+class GameClockTests(GameTestCase):
+    def setUp(self):
+        from django.utils import timezone
+        
+        super().setUp()
+        self.game, self.alice, self.bob = create_game(
+            'Timed Game', alice={'clock_remaining_ms': 60000}, bob={'clock_remaining_ms': 45000},
+            clock_initial=60, clock_increment=2, turn_deadline=timezone.now() + timezone.timedelta(seconds=30)
+        )
+        self.piece = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                          position_x=0, position_y=1)
+        for owner, x in ((self.alice, 7), (self.bob, 6)):
+            Piece.objects.create(game=self.game, owner=owner, piece_type=Piece.PieceType.INVESTOR,
+                                 level=4, position_x=x, position_y=7)
+    
+    def _move(self):
+        from game import services
+        from game.engine import Position
+        
+        return services.apply_move(self.game.id, self.alice, str(self.piece.id), Position(0, 1), Position(0, 2))
+    
+    def _expire(self):
+        from django.utils import timezone
+        
+        Game.objects.filter(pk=self.game.pk).update(turn_deadline=timezone.now() - timezone.timedelta(seconds=1))
+    
+    def test_move_banks_time_and_starts_opponent_clock(self):
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+        
+        result = self._move()
+        
+        self.assertTrue(result['success'], result)
+        self.assertAlmostEqual(result['clocks'][str(self.alice.id)], 32000, delta=1000)
+        self.assertEqual(result['clocks'][str(self.bob.id)], 45000)
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.clock_remaining_ms, result['clocks'][str(self.alice.id)])
+        
+        deadline = parse_datetime(result['turn_deadline'])
+        self.assertAlmostEqual((deadline - timezone.now()).total_seconds(), 45, delta=1)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.turn_deadline, deadline)
+    
+    def test_committed_move_schedules_flag(self):
+        """The new deadline reaches the timer wheel once the move commits, socket or not"""
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from django.utils.dateparse import parse_datetime
+        from game import clocks
+        from game.timerwheel import TimerWheel
+        
+        with mock.patch.object(clocks, '_wheel', TimerWheel(tick=0.01)), \
+                mock.patch.object(clocks, '_flags', {}):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = self._move()
+            self.assertTrue(result['success'], result)
+            self.assertNotIn(str(self.game.id), clocks._flags)
+            
+            async_to_sync(clocks.tick)()
+            
+            deadline, timer = clocks._flags[str(self.game.id)]
+            self.assertEqual(deadline, parse_datetime(result['turn_deadline']))
+            self.assertTrue(timer.active)
+    
+    def test_untimed_opponent_gets_no_deadline(self):
+        """A player without a clock cannot be flagged, rather than having 0 ms left"""
+        Player.objects.filter(pk=self.bob.pk).update(clock_remaining_ms=None)
+        
+        result = self._move()
+        
+        self.assertTrue(result['success'], result)
+        self.assertIsNone(result['clocks'])
+        self.assertIsNone(result['turn_deadline'])
+        self.game.refresh_from_db()
+        self.assertIsNone(self.game.turn_deadline)
+    
+    def test_flag_ends_game_for_opponent(self):
+        from game import services
+        
+        self.assertIsNone(services.flag_game(self.game.id))
+        self._expire()
+        self.assertEqual(self._move()['code'], 'flagged')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            result = services.flag_game(self.game.id)
+        
+        self.assertEqual(result, {'winner': str(self.bob.id), 'reason': 'timeout'})
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, Game.Status.FINISHED)
+        self.assertEqual(self.game.winner, self.bob)
+        self.assertIsNotNone(self.game.finalized_at)
+        self.assertIsNone(services.flag_game(self.game.id))
+    
+    def test_abandoned_game_is_forfeited_to_online_opponent(self):
+        from game import presence, services
+        
+        presence.connect(self.game.id, self.alice.id, 'alice-socket')
+        self.assertIsNone(services.abandon_game(self.game.id, self.alice.id))
+        
+        # Alice's presence lapses while Bob stays
+        presence.connect(self.game.id, self.bob.id, 'bob-socket')
+        cache.delete(presence._key(self.game.id, self.alice.id))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            result = services.abandon_game(self.game.id, self.alice.id)
+        
+        self.assertEqual(result, {'winner': str(self.bob.id), 'reason': 'abandoned'})
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, Game.Status.ABANDONED)
+        self.assertIsNotNone(self.game.finalized_at)
+    
+    def test_wheel_flags_game_and_announces_it(self):
+        """The per-process wheel ends an expired game and publishes game_ended"""
+        import asyncio
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from game import clocks, codec, events
+        from game.timerwheel import TimerWheel
+        
+        self._expire()
+        self.game.refresh_from_db()
+        layer = get_channel_layer()
+        
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add(events.group_name(self.game.id), channel)
+            clocks._channel_layer = layer
+            clocks.schedule_flag(self.game.id, self.game.turn_deadline)
+            await asyncio.sleep(0.03)
+            await clocks.tick()
+            return codec.loads((await layer.receive(channel))['text'])
+        
+        with mock.patch.object(clocks, '_wheel', TimerWheel(tick=0.01)):
+            message = async_to_sync(run)()
+        
+        self.assertEqual(message['event'], 'game_ended')
+        self.assertEqual(message['data'], {'winner': str(self.bob.id), 'reason': 'timeout'})
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, Game.Status.FINISHED)
+
+
+class PremoveTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game, self.alice, self.bob = create_game('Premove Game')
+        self.alice_talent = Piece.objects.create(game=self.game, owner=self.alice,
+                                                 piece_type=Piece.PieceType.TALENT, position_x=2, position_y=4)
+        self.bob_talent = Piece.objects.create(game=self.game, owner=self.bob,
+                                               piece_type=Piece.PieceType.TALENT, position_x=5, position_y=6)
+        for owner, x in ((self.alice, 7), (self.bob, 6)):
+            Piece.objects.create(game=self.game, owner=owner, piece_type=Piece.PieceType.INVESTOR,
+                                 level=4, position_x=x, position_y=7)
+    
+    def _premove(self, player, piece, from_pos, to_pos):
+        from game import services
+        
+        return services.queue_premove_command(self.game.id, player.id, str(piece.id), from_pos, to_pos)
+    
+    def _alice_moves(self, to_pos):
+        from game import services
+        
+        return services.apply_move_command(self.game.id, self.alice.id, str(self.alice_talent.id), [2, 4], to_pos)
+    
+    def test_premove_plays_when_turn_passes(self):
+        from game import premoves
+        
+        queued = self._premove(self.bob, self.bob_talent, [5, 6], [5, 5])
+        self.assertEqual(queued['premoves'], [
+            {'piece_id': str(self.bob_talent.id), 'from': [5, 6], 'to': [5, 5]}
+        ])
+        self.assertEqual(queued['moves'], [])
+        
+        result = self._alice_moves([2, 3])
+        
+        self.assertTrue(result['success'], result)
+        self.assertEqual(len(result['premoves_played']), 1)
+        premove = result['premoves_played'][0]
+        self.assertTrue(premove['premove'])
+        self.assertEqual(premove['player_id'], str(self.bob.id))
+        self.assertEqual(premove['turn'], str(self.alice.id))
+        self.assertEqual(premove['state_version'], result['state_version'] + 1)
+        self.assertEqual(premoves.get(self.game.id, self.bob.id), [])
+        self.bob_talent.refresh_from_db()
+        self.assertEqual((self.bob_talent.position_x, self.bob_talent.position_y), (5, 5))
+    
+    def test_rest_move_plays_premove_and_broadcasts_both(self):
+        """REST moves go through the game's actor and reach the game's sockets like socket moves"""
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from game import codec, events
+        
+        self._premove(self.bob, self.bob_talent, [5, 6], [5, 5])
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(events.group_name(self.game.id), channel)
+        
+        response = self.client.post(f'/api/games/{self.game.id}/move/', {
+            'piece_id': str(self.alice_talent.id), 'from_x': 2, 'from_y': 4, 'to_x': 2, 'to_y': 3,
+            'player_token': str(self.alice.player_token)
+        }, format='json')
+        
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(response.json()['premoves_played']), 1)
+        messages = [codec.loads(async_to_sync(layer.receive)(channel)['text']) for _ in range(2)]
+        self.assertEqual([message['event'] for message in messages], ['move_made', 'move_made'])
+        self.assertEqual([message['data']['player_id'] for message in messages],
+                         [str(self.alice.id), str(self.bob.id)])
+        self.assertTrue(messages[1]['data']['premove'])
+    
+    def test_illegal_premove_discards_queue(self):
+        from game import premoves
+        
+        self._premove(self.bob, self.bob_talent, [5, 6], [5, 3])
+        self._premove(self.bob, self.bob_talent, [5, 3], [5, 2])
+        
+        # Alice blocks the path of Bob's first premove
+        result = self._alice_moves([5, 4])
+        
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['premoves_played'], [])
+        self.assertEqual(premoves.get(self.game.id, self.bob.id), [])
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.current_turn_player, self.bob)
+    
+    def test_queue_limit_and_premove_on_own_turn(self):
+        from game import premoves
+        
+        for _ in range(premoves.PREMOVE_LIMIT):
+            self.assertTrue(self._premove(self.bob, self.bob_talent, [5, 6], [5, 5])['success'])
+        self.assertEqual(self._premove(self.bob, self.bob_talent, [5, 6], [5, 5])['code'], 'premove_limit')
+        
+        # It is already Alice's turn: her premove is played at once and Bob's follows
+        result = self._premove(self.alice, self.alice_talent, [2, 4], [2, 3])
+        
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['premoves'], [])
+        self.assertEqual([move['player_id'] for move in result['moves']], [str(self.alice.id), str(self.bob.id)])
+        self.assertEqual(len(premoves.get(self.game.id, self.bob.id)), premoves.PREMOVE_LIMIT - 1)
+
+
+class InvestorTransformTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game, self.alice, self.bob = create_game('Transform Game')
+        self.investor = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.INVESTOR,
+                                             level=4, position_x=3, position_y=7)
+        self.talent = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                           position_x=3, position_y=6)
+        Piece.objects.create(game=self.game, owner=self.bob, piece_type=Piece.PieceType.INVESTOR,
+                             level=4, position_x=3, position_y=0)
+    
+    def test_transform_is_applied_by_the_owner_as_a_turn(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import InMemoryChannelLayer
+        from game import affinity
+        
+        async def run():
+            worker = affinity.AffinityWorker(InMemoryChannelLayer())
+            await worker.start()
+            worker.refresh()
+            result = await worker.submit(self.game.id, 'investor_transform', {
+                'game_id': str(self.game.id), 'player_id': str(self.alice.id),
+                'investor_id': str(self.investor.id), 'target_piece_id': str(self.talent.id),
+                'expected_version': None,
+            })
+            await worker.stop()
+            return result
+        
+        result = async_to_sync(run)()
+        
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['move_type'], Move.MoveType.INVESTOR_TRANSFORM)
+        self.assertEqual((result['from'], result['to']), ([3, 7], [3, 6]))
+        self.talent.refresh_from_db()
+        self.assertEqual(self.talent.transform_count, 1)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.current_turn_player, self.bob)
+        self.assertEqual(Move.objects.get(game=self.game).move_type, Move.MoveType.INVESTOR_TRANSFORM)
+    
+    def test_transform_of_enemy_piece_is_rejected(self):
+        from game import services
+        
+        bob_talent = Piece.objects.create(game=self.game, owner=self.bob, piece_type=Piece.PieceType.TALENT,
+                                          position_x=4, position_y=7)
+        
+        result = services.investor_transform_command(self.game.id, self.alice.id, str(self.investor.id),
+                                                     str(bob_talent.id))
+        
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error'], 'Can only transform allied pieces')
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+    
+    def test_piece_placement_is_rejected(self):
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from game.routing import websocket_urlpatterns
+        
+        async def place():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'action': 'reconnect',
+                                             'data': {'player_token': str(self.alice.player_token)}})
+            while (await communicator.receive_json_from())['event'] != 'game_state':
+                pass
+            await communicator.send_json_to({'action': 'place_piece',
+                                             'data': {'piece_id': str(self.talent.id), 'position': [0, 6]}})
+            while True:
+                message = await communicator.receive_json_from()
+                if message['event'] == 'error':
+                    break
+            await communicator.disconnect()
+            return message
+        
+        message = async_to_sync(place)()
+        
+        self.assertEqual(message['data']['code'], 'unsupported')
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+
+
+class LegalMovesTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game, self.alice, self.bob = create_game('Moves Game')
+        self.talent = Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.TALENT,
+                                           position_x=0, position_y=0)
+        self.investor = Piece.objects.create(game=self.game, owner=self.bob, piece_type=Piece.PieceType.INVESTOR,
+                                             level=4, position_x=7, position_y=7)
+        Piece.objects.create(game=self.game, owner=self.alice, piece_type=Piece.PieceType.INVESTOR,
+                             level=4, position_x=1, position_y=0)
+    
+    def test_piece_moves_endpoint_is_cached_per_version(self):
+        url = f'/api/games/{self.game.id}/pieces/{self.talent.id}/moves/'
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['from'], [0, 0])
+        self.assertEqual(data['state_version'], self.game.state_version)
+        # Up to 3 squares straight, blocked on the right by its own Investor
+        self.assertEqual(sorted(data['moves']), [[0, 1], [0, 2], [0, 3]])
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).json(), data)
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        
+        missing = self.client.get(f'/api/games/{self.game.id}/pieces/{self.game.id}/moves/')
+        self.assertEqual(missing.status_code, 404)
+    
+    def test_moves_of_a_newer_board_are_not_cached_for_an_older_version(self):
+        """A move committed while the board loads does not leave its moves under the previous version"""
+        from unittest import mock
+        from django.db.models import F
+        from game import legalmoves, services
+        
+        version = self.game.state_version
+        load_engine = services.load_engine
+        
+        def load_after_move(game_id):
+            Piece.objects.filter(pk=self.talent.pk).update(position_y=1)
+            Game.objects.filter(pk=game_id).update(state_version=F('state_version') + 1)
+            return load_engine(game_id)
+        
+        with mock.patch.object(services, 'load_engine', load_after_move):
+            pieces = legalmoves.get_moves(self.game.id, version)
+        self.assertEqual(pieces[str(self.talent.id)]['from'], [0, 1])
+        self.assertIsNone(cache.get(legalmoves._cache_key(self.game.id, version)))
+    
+    def test_move_pushes_moves_of_side_to_move(self):
+        from game import legalmoves, services
+        from game.engine import Position
+        
+        result = services.apply_move(self.game.id, self.alice, str(self.talent.id), Position(0, 0), Position(0, 1))
+        
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['turn'], str(self.bob.id))
+        # Bob's Investor in the corner reaches three squares
+        (squares,) = result['legal_moves']
+        self.assertEqual(squares[0], 63)
+        self.assertEqual(sorted(squares[1:]), [54, 55, 62])
+        
+        # The new version was cached from the engine that applied the move
+        with self.assertNumQueries(0):
+            pieces = legalmoves.get_moves(self.game.id, result['state_version'])
+        self.assertEqual(pieces[str(self.talent.id)]['from'], [0, 1])
@@ -0,0 +1,119 @@
+"""
+Hierarchical timer wheel
+
+Holds many timers in a few rings of slots instead of one sleeping task or
+heap entry per timer. Level 0 has one slot per tick. Each level above
+covers a whole turn of the level below per slot, so 4 levels of 64 slots
+at 0.25 s ticks reach about 48 days.
+
+Scheduling and cancelling are O(1). Advancing by one tick visits one
+level-0 slot. Each time a lower level completes a turn, one slot of the
+level above is emptied into the levels below ("cascading"). A timer
+cascades at most once per level, so the cost per tick does not grow with
+the number of timers, only with the timers that expire.
+
+The wheel is not thread-safe; use it from one event loop.
+"""
+
+import time
+from typing import Any, Callable, List, Optional, Set
+
+
+class Timer:
+    """A scheduled callback; pass it to TimerWheel.cancel to drop it"""
+
+    __slots__ = ('tick', 'callback', 'args', 'slot')
+
+    def __init__(self, tick: int, callback: Callable, args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Set['Timer']] = None
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+    def fire(self) -> Any:
+        return self.callback(*self.args)
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.25, bits: int = 6, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        self.resolution = tick
+        self.bits = bits
+        self.levels = levels
+        self.clock = clock
+        self.mask = (1 << bits) - 1
+        self.wheels: List[List[Set[Timer]]] = [
+            [set() for _ in range(1 << bits)] for _ in range(levels)
+        ]
+        self.current = self._tick_of(clock())
+        self.count = 0
+
+    def _tick_of(self, moment: float) -> int:
+        return int(moment / self.resolution)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _place(self, timer: Timer):
+        delta = max(timer.tick - self.current, 0)
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)) or level == self.levels - 1:
+                break
+        # Beyond the top level: park in the last reachable slot and cascade again
+        tick = min(timer.tick, self.current + (1 << (self.bits * self.levels)) - 1)
+        if delta == 0:
+            tick = self.current
+        slot = self.wheels[level][(tick >> (self.bits * level)) & self.mask]
+        slot.add(timer)
+        timer.slot = slot
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """Run callback(*args) once delay seconds have passed, at tick resolution"""
+        # Round up so a timer never fires early
+        tick = max(-int(-(self.clock() + delay) // self.resolution), self.current + 1)
+        timer = Timer(tick, callback, args)
+        self._place(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer: Timer):
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.count -= 1
+
+    def _cascade(self, level: int):
+        index = (self.current >> (self.bits * level)) & self.mask
+        slot = self.wheels[level][index]
+        self.wheels[level][index] = set()
+        for timer in slot:
+            self._place(timer)
+
+    def advance(self, now: Optional[float] = None) -> List[Timer]:
+        """Move the wheel up to now and return the timers that expired, in deadline order"""
+        target = self._tick_of(self.clock() if now is None else now)
+        due: List[Timer] = []
+        while self.current < target:
+            self.current += 1
+            # Refill lower levels from the top down when their turn completes
+            for level in range(self.levels - 1, 0, -1):
+                if self.current & ((1 << (self.bits * level)) - 1) == 0:
+                    self._cascade(level)
+
+            index = self.current & self.mask
+            slot = self.wheels[0][index]
+            self.wheels[0][index] = set()
+            for timer in slot:
+                if timer.tick <= self.current:
+                    timer.slot = None
+                    self.count -= 1
+                    due.append(timer)
+                else:
+                    # Parked beyond the range of the wheel
+                    self._place(timer)
+        due.sort(key=lambda timer: timer.tick)
+        return due
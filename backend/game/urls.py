@@ -5,7 +5,10 @@ URL Configuration for game app
 
 from django.urls import path, include  # type: ignore
 from rest_framework.routers import DefaultRouter  # type: ignore
-from .views import GameViewSet, PlayerViewSet, MoveViewSet, ActiveGamesView, HealthCheckView
+from .views import (
+    GameViewSet, PlayerViewSet, MoveViewSet,
+    ActiveGamesView, GameBoardView, PieceMovesView, HealthCheckView, MetricsView
+)
 
 router = DefaultRouter()
 router.register(r'games', GameViewSet)
@@ -15,7 +18,10 @@ router.register(r'moves', MoveViewSet)
 urlpatterns = [
     # Custom game endpoints (must come before router)
     path('games/active/', ActiveGamesView.as_view(), name='active-games'),
+    path('games/<uuid:pk>/board/', GameBoardView.as_view(), name='game-board'),
+    path('games/<uuid:pk>/pieces/<uuid:piece_id>/moves/', PieceMovesView.as_view(), name='piece-moves'),
     path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     
     # Router URLs (includes games/, players/, moves/)
     path('', include(router.urls)),
@@ -3,39 +3,52 @@
 Django REST Framework views for TI Chess API
 """
 
+import concurrent.futures
 import logging
+import os
+from channels.layers import get_channel_layer  # type: ignore
 from django.utils import timezone  # type: ignore
+from django.http import HttpResponse, StreamingHttpResponse  # type: ignore
 from django.shortcuts import get_object_or_404, render  # type: ignore
+from django.core.cache import cache  # type: ignore
 from django.views.decorators.cache import cache_page  # type: ignore
 from django.utils.decorators import method_decorator  # type: ignore
+from django.views import View  # type: ignore
 from rest_framework import status, viewsets, permissions  # type: ignore
-from rest_framework.decorators import action, api_view  # type: ignore
+from rest_framework.decorators import action  # type: ignore
+from rest_framework.exceptions import ValidationError  # type: ignore
 from rest_framework.response import Response  # type: ignore
 from rest_framework.views import APIView  # type: ignore
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiResponse  # type: ignore
 
-from .models import Game, Player, Move, Piece, GameEvent
+from .models import Game, Player, Move
 from .serializers import (
     GameSerializer, GameCreateSerializer, JoinGameSerializer,
     PlayerSerializer, MoveSerializer, MoveCreateSerializer,
-    GameReplaySerializer, BoardStateSerializer, PieceSerializer,
+    GameReplaySerializer, PieceSerializer,
     InvestorTransformSerializer, PiecePlacementSerializer
 )
-from .engine import GameEngine, GamePiece, Position, PieceType
+from .pagination import GameCursorPagination, PlayerCursorPagination, MoveCursorPagination
+from . import (
+    affinity, archive, board as board_state, codec, events, legalmoves, lobby, metrics, replay,
+    serverloop, syncpool
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds a REST move waits for the game's actor, or for the owner it forwards to
+REST_MOVE_TIMEOUT = affinity.FORWARD_TIMEOUT * 2
 
-@extend_schema(
-    summary="API Root",
-    description="TI Chess API Root - Welcome to the TI Chess API",
-    responses={200: OpenApiResponse(description="API information")}
-)
-@api_view(['GET'])
-def api_root(request):
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    """JSON response for the async views, which DRF cannot serve"""
+    return HttpResponse(codec.dumps_bytes(data), status=status, content_type='application/json')
+
+
+async def api_root(request):
     """API root endpoint with service information"""
-    return Response({
+    return json_response({
         'message': 'Welcome to TI Chess API',
         'version': '1.0.0',
         'status': 'operational',
@@ -56,6 +69,20 @@ def api_root(request):
     })
 
 
+async def lobby_response(request, include_private: bool = False):
+    """Serve the cached lobby, answering matching If-None-Match with 304"""
+    entry = await lobby.aget_lobby(include_private)
+    
+    if request.headers.get('If-None-Match') == entry['etag']:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = json_response(entry['data'])
+    
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def frontend_view(request, path=''):
     """Serve the React frontend for all paths"""
     return render(request, 'index.html')
@@ -66,6 +93,13 @@ class GameViewSet(viewsets.ModelViewSet):
     queryset = Game.objects.all()
     serializer_class = GameSerializer
     permission_classes = [permissions.AllowAny]  # Adjust for production
+    pagination_class = GameCursorPagination
+    
+    def get_queryset(self):
+        """Prefetch serializer data for retrieve/update responses"""
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            return Game.objects.with_details()
+        return Game.objects.all()
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -75,20 +109,37 @@ class GameViewSet(viewsets.ModelViewSet):
     @extend_schema(
         summary="List active games",
         description="Get list of games waiting for players or currently active",
+        parameters=[
+            OpenApiParameter('cursor', str, description='Cursor from the previous page'),
+            OpenApiParameter('page_size', int, description='Games per page (max 100)'),
+        ],
         responses={200: GameSerializer(many=True)}
     )
     def list(self, request):
-        """List active/joinable games"""
-        queryset = Game.objects.filter(
-            status__in=[Game.Status.WAITING, Game.Status.ACTIVE]
-        ).select_related().prefetch_related('players').order_by('-created_at')[:20]  # Limit to 20 games
-        
-        # Filter public games or games user is part of
-        if not request.user.is_authenticated:
-            queryset = queryset.filter(is_public=True)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        """List active/joinable games, newest first"""
+        # Private games are only listed for authenticated users
+        include_private = request.user.is_authenticated
+        
+        # Pages are cached per cursor until the next lobby event
+        key = lobby.listing_key(
+            include_private,
+            request.query_params.get('cursor'),
+            request.query_params.get('page_size'),
+            request.get_host()
+        )
+        data = cache.get(key)
+        if data is None:
+            queryset = Game.objects.filter(
+                status__in=[Game.Status.WAITING, Game.Status.ACTIVE]
+            )
+            if not include_private:
+                queryset = queryset.filter(is_public=True)
+            
+            page = self.paginate_queryset(queryset.with_details())
+            serializer = self.get_serializer(page, many=True)
+            data = codec.loads(codec.dumps_bytes(self.get_paginated_response(serializer.data).data))
+            cache.set(key, data, timeout=lobby.LOBBY_CACHE_TIMEOUT)
+        return Response(data)
     
     @extend_schema(
         summary="Create new game",
@@ -101,6 +152,7 @@ class GameViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         game = serializer.save()
+        lobby.game_added(game)
         
         response_serializer = GameSerializer(game)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -155,6 +207,8 @@ class GameViewSet(viewsets.ModelViewSet):
             color=serializer.validated_data['color'],
             user=request.user if request.user.is_authenticated else None
         )
+        Game.objects.filter(pk=game.pk).bump_state_version()
+        lobby.players_changed(game)
         
         return Response({
             'player_token': str(player.player_token),
@@ -162,50 +216,14 @@ class GameViewSet(viewsets.ModelViewSet):
             'message': 'Successfully joined game'
         })
     
-    @extend_schema(
-        summary="Get game board state",
-        description="Get current board state of the game",
-        responses={200: BoardStateSerializer}
-    )
-    @action(detail=True, methods=['get'])
-    def board(self, request, pk=None):
-        """Get current board state"""
-        game = get_object_or_404(Game, pk=pk)
-        
-        # Build board state
-        board = [[None for _ in range(8)] for _ in range(8)]
-        pieces = game.pieces.filter(is_active=True)
-        
-        for piece in pieces:
-            board[piece.position_y][piece.position_x] = {
-                'id': str(piece.id),
-                'owner_id': str(piece.owner.id),
-                'owner_name': piece.owner.name,
-                'owner_color': piece.owner.color,
-                'type': piece.piece_type,
-                'level': piece.level,
-                'transform_count': piece.transform_count,
-                'temporary_buffs': piece.temporary_buffs
-            }
-        
-        data = {
-            'board': board,
-            'players': game.players.all(),
-            'current_turn_player': game.current_turn_player,
-            'game_status': game.status,
-            'turn_count': game.turn_count
-        }
-        
-        serializer = BoardStateSerializer(data)
-        return Response(serializer.data)
-    
     @extend_schema(
         summary="Make a move",
         description="Submit a move in the game (REST fallback)",
         request=MoveCreateSerializer,
         responses={
             200: OpenApiResponse(description="Move successful"),
-            400: OpenApiResponse(description="Invalid move")
+            400: OpenApiResponse(description="Invalid move"),
+            409: OpenApiResponse(description="Move was based on an outdated state_version")
         }
     )
     @action(detail=True, methods=['post'])
@@ -238,17 +256,43 @@ class GameViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Process move using game engine
+        # Applied by the worker that owns the game, in order with socket moves
+        move_data = serializer.validated_data
         try:
-            result = self._process_move_with_engine(game, player, serializer.validated_data)
+            # On the server loop: the game's actor outlives this request
+            result = serverloop.run(affinity.submit, game.id, 'apply_move', {
+                'game_id': str(game.id),
+                'player_id': str(player.id),
+                'piece_id': str(move_data['piece_id']),
+                'from_pos': [move_data['from_x'], move_data['from_y']],
+                'to_pos': [move_data['to_x'], move_data['to_y']],
+                'expected_version': move_data.get('state_version'),
+                'move_type': move_data['move_type'],
+            }, timeout=REST_MOVE_TIMEOUT)
             
             if result['success']:
+                # Sockets of the game see the move, and the premoves it triggered, as usual
+                channel_layer = get_channel_layer()
+                if channel_layer is not None:
+                    serverloop.run(events.publish_moves, channel_layer, game.id, [result] + result['premoves_played'])
                 return Response(result)
+            elif result.get('code') == 'stale_state':
+                return Response(result, status=status.HTTP_409_CONFLICT)
+            elif result.get('code') in ('busy', 'timeout'):
+                return Response(
+                    {'error': result['error'], 'code': result['code']},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
             else:
                 return Response(
                     {'error': result.get('error', 'Invalid move')},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+        except concurrent.futures.TimeoutError:
+            return Response(
+                {'error': 'Game server did not respond, try again', 'code': 'timeout'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         except Exception as e:
             logger.error(f"Error processing move: {e}")
             return Response(
@@ -264,182 +308,178 @@ class GameViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def replay(self, request, pk=None):
         """Get game replay data"""
-        game = get_object_or_404(Game, pk=pk)
+        game = get_object_or_404(Game.objects.select_related('archive'), pk=pk)
+        archived = archive.load(game)
         
+        players = list(game.players.with_pieces())
         replay_data = {
             'game_id': game.id,
-            'moves': game.moves.all().order_by('move_number'),
-            'players': game.players.all(),
+            'moves': [] if archived else game.moves.select_related('player', 'piece').prefetch_related('events').order_by('move_number'),
+            'players': players,
             'created_at': game.created_at,
             'finished_at': game.finished_at,
-            'winner': game.winner
+            'winner': next((p for p in players if p.id == game.winner_id), None)
         }
         
-        serializer = GameReplaySerializer(replay_data)
-        return Response(serializer.data)
+        data = GameReplaySerializer(replay_data).data
+        if archived:
+            data['moves'] = archived.records()
+            data['players'] = archived.players
+            data['winner'] = archived.player(game.winner_id)
+        return Response(data)
     
-    def _process_move_with_engine(self, game: Game, player: Player, move_data: dict):
-        """Process move using game engine"""
-        # Load current game state
-        pieces = list(game.pieces.filter(is_active=True))
-        players_dict = {str(p.id): p for p in game.players.all()}
-        
-        # Initialize engine
-        engine = GameEngine()
-        engine_pieces = []
-        
-        for piece in pieces:
-            engine_pieces.append(GamePiece(
-                id=str(piece.id),
-                owner_id=str(piece.owner.id),
-                piece_type=PieceType(piece.piece_type),
-                level=piece.level,
-                position=Position(piece.position_x, piece.position_y),
-                transform_count=piece.transform_count,
-                temporary_buffs=piece.temporary_buffs,
-                is_active=piece.is_active
-            ))
-        
-        engine.load_board_state(engine_pieces, players_dict)
-        
-        # Validate and apply move
-        from_pos = Position(move_data['from_x'], move_data['from_y'])
-        to_pos = Position(move_data['to_x'], move_data['to_y'])
+    @extend_schema(
+        summary="Stream game replay",
+        description="Stream the move history as NDJSON, one move per line, starting after a cursor",
+        parameters=[
+            OpenApiParameter('after_move', int, description='Only stream moves after this move number'),
+            OpenApiParameter('limit', int, description='Maximum number of moves to stream'),
+        ],
+        responses={
+            200: OpenApiResponse(description="NDJSON stream of game, move and end records"),
+            400: OpenApiResponse(description="Invalid cursor")
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='replay/stream')
+    def replay_stream(self, request, pk=None):
+        """Stream game replay data as NDJSON"""
+        game = get_object_or_404(Game.objects.select_related('archive'), pk=pk)
         
-        result = engine.apply_move(
-            str(move_data['piece_id']), 
-            from_pos, 
-            to_pos, 
-            str(player.id)
-        )
+        try:
+            after_move = int(request.query_params.get('after_move', 0))
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'after_move and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if result.success:
-            # Save move to database
-            move_number = (game.moves.last().move_number + 1) if game.moves.exists() else 1
-            piece = get_object_or_404(Piece, id=move_data['piece_id'])
-            
-            move = Move.objects.create(
-                game=game,
-                player=player,
-                piece=piece,
-                move_type=move_data.get('move_type', Move.MoveType.MOVE),
-                from_x=from_pos.x,
-                from_y=from_pos.y,
-                to_x=to_pos.x,
-                to_y=to_pos.y,
-                move_number=move_number,
-                move_data={'events': result.events, 'changes': result.board_changes},
-                is_valid=True
+        if after_move < 0 or (limit is not None and limit < 1):
+            return Response(
+                {'error': 'after_move must be >= 0 and limit must be >= 1'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Update pieces in database
-            self._update_pieces_from_engine(pieces, engine_pieces)
-            
-            # Save events
-            for event in result.events:
-                GameEvent.objects.create(
-                    game=game,
-                    move=move,
-                    event_type=event['type'],
-                    event_data=event.get('data', {})
-                )
-            
-            # Check for winner
-            winner = engine.check_win_condition()
-            if winner:
-                game.winner_id = winner
-                game.status = Game.Status.FINISHED
-                game.finished_at = timezone.now()
-                game.save()
-            
-            # Advance turn
-            self._advance_turn(game)
-            
-            return {
-                'success': True,
-                'move_id': str(move.id),
-                'player_id': str(player.id),
-                'from': [from_pos.x, from_pos.y],
-                'to': [to_pos.x, to_pos.y],
-                'events': result.events,
-                'board_changes': result.board_changes,
-                'winner': winner,
-                'turn': str(game.current_turn_player.id) if game.current_turn_player else None
-            }
+        
+        # ASGI requests need an async iterator to stream without buffering
+        if hasattr(request._request, 'scope'):
+            lines = replay.aiter_replay_ndjson(game, after_move=after_move, limit=limit)
         else:
-            return {
-                'success': False,
-                'error': result.error_message
-            }
-    
-    def _update_pieces_from_engine(self, db_pieces, engine_pieces):
-        """Update database pieces from engine state"""
-        engine_dict = {p.id: p for p in engine_pieces}
+            lines = replay.iter_replay_ndjson(game, after_move=after_move, limit=limit)
         
-        for db_piece in db_pieces:
-            engine_piece = engine_dict.get(str(db_piece.id))
-            if engine_piece:
-                db_piece.piece_type = engine_piece.piece_type.value
-                db_piece.level = engine_piece.level
-                db_piece.position_x = engine_piece.position.x
-                db_piece.position_y = engine_piece.position.y
-                db_piece.transform_count = engine_piece.transform_count
-                db_piece.temporary_buffs = engine_piece.temporary_buffs
-                db_piece.is_active = engine_piece.is_active
-                db_piece.save()
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
     
-    def _advance_turn(self, game: Game):
-        """Advance to next player's turn"""
-        players = list(game.players.all())
-        current_index = 0
+    @extend_schema(
+        summary="Seek game replay",
+        description="Get the exact board at a given move plus the keyframe index for scrubbing",
+        parameters=[
+            OpenApiParameter('move', int, description='Move number to seek to (0 is the starting position)')
+        ],
+        responses={
+            200: OpenApiResponse(description="Board at the requested move"),
+            400: OpenApiResponse(description="Invalid move number"),
+            404: OpenApiResponse(description="No replay data for this game")
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='replay/position')
+    def replay_position(self, request, pk=None):
+        """Get the board at a specific move of the replay"""
+        game = get_object_or_404(Game.objects.select_related('archive'), pk=pk)
         
-        for i, player in enumerate(players):
-            if player.id == game.current_turn_player_id:
-                current_index = i
-                break
+        try:
+            move_number = int(request.query_params.get('move', 0))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'move must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        next_index = (current_index + 1) % len(players)
-        game.current_turn_player = players[next_index]
-        game.turn_count += 1
-        game.save()
+        try:
+            return Response(replay.get_position(game, move_number))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except replay.ReplayUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
 
-class ActiveGamesView(APIView):
+class ActiveGamesView(View):
     """View for listing active/joinable games"""
-    permission_classes = [permissions.AllowAny]
     
-    @extend_schema(
-        summary="List active games",
-        description="Get all games that are waiting for players or currently active",
-        responses={200: GameSerializer(many=True)}
-    )
-    def get(self, request):
+    async def get(self, request):
         """Get active/joinable games with performance optimizations"""
         try:
-            games = Game.objects.filter(
-                status__in=[Game.Status.WAITING, Game.Status.ACTIVE],
-                is_public=True
-            ).select_related().prefetch_related('players').order_by('-created_at')[:20]  # Fixed order
-            
-            serializer = GameSerializer(games, many=True)
-            return Response(serializer.data)
+            return await lobby_response(request)
         except Exception as e:
             logger.error(f"Error fetching active games: {e}")
-            return Response(
+            return json_response(
                 {'error': 'Unable to fetch games'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
 
+class GameBoardView(View):
+    """Current board state of a game"""
+    
+    async def get(self, request, pk):
+        """Get current board state"""
+        version = await board_state.acurrent_version(pk)
+        if version is None:
+            return json_response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Unchanged since the client's last poll: a single indexed lookup
+        if request.headers.get('If-None-Match') == board_state.board_etag(pk, version):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = board_state.board_etag(pk, version)
+            return response
+        
+        payload = await board_state.aget_board(pk, version)
+        response = json_response(payload)
+        response['ETag'] = board_state.board_etag(pk, payload['state_version'])
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class PieceMovesView(View):
+    """Squares a piece can move to at the current board version"""
+    
+    async def get(self, request, pk, piece_id):
+        """Get the valid moves of a piece"""
+        version = await board_state.acurrent_version(pk)
+        if version is None:
+            return json_response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = legalmoves.moves_etag(pk, piece_id, version)
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+        
+        entry = (await legalmoves.aget_moves(pk, version)).get(str(piece_id))
+        if entry is None:
+            return json_response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = json_response({
+            'piece_id': str(piece_id),
+            'owner_id': entry['owner_id'],
+            'from': entry['from'],
+            'moves': entry['moves'],
+            'state_version': version
+        })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
 class PlayerViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for player information"""
     queryset = Player.objects.all()
     serializer_class = PlayerSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = PlayerCursorPagination
     
     def get_queryset(self):
         """Filter by game if specified"""
-        queryset = Player.objects.all()
+        queryset = Player.objects.with_pieces()
         game_id = self.request.query_params.get('game_id')
         
         if game_id:
@@ -453,27 +493,45 @@ class MoveViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Move.objects.all()
     serializer_class = MoveSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = MoveCursorPagination
     
     def get_queryset(self):
-        """Filter by game if specified"""
-        queryset = Move.objects.all()
+        """Moves are listed per game; game_id is required"""
+        queryset = Move.objects.select_related('player', 'piece').prefetch_related('events')
         game_id = self.request.query_params.get('game_id')
         
         if game_id:
             queryset = queryset.filter(game_id=game_id)
+        elif self.action == 'list':
+            raise ValidationError({'game_id': 'This query parameter is required.'})
         
         return queryset.order_by('move_number')
 
 
-class HealthCheckView(APIView):
+class HealthCheckView(View):
     """Health check endpoint"""
+    
+    async def get(self, request):
+        """Health check"""
+        return json_response({'status': 'healthy', 'timestamp': timezone.now()})
+
+
+class MetricsView(APIView):
+    """Counters of the worker process serving the request"""
     permission_classes = [permissions.AllowAny]
     
     @extend_schema(
-        summary="Health check",
-        description="Check if the API is healthy",
-        responses={200: OpenApiResponse(description="API is healthy")}
+        summary="Process metrics",
+        description=(
+            "Counters of this worker process, e.g. rejected and dropped WebSocket frames, "
+            "and the queue depth and wait times of its sync calls"
+        ),
+        responses={200: OpenApiResponse(description="Counters by name and sync pool gauges")}
     )
     def get(self, request):
-        """Health check"""
-        return Response({'status': 'healthy', 'timestamp': timezone.now()})
\ No newline at end of file
+        """Metrics of this process"""
+        return Response({
+            'pid': os.getpid(),
+            'counters': metrics.snapshot(),
+            'sync_pool': syncpool.snapshot()
+        })
\ No newline at end of file
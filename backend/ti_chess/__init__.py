@@ -0,0 +1,7 @@
+# Celery is optional; without it background jobs run from management commands
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ('celery_app',)
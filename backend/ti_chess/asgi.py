@@ -14,12 +14,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ti_chess.settings')
 django_asgi_app = get_asgi_application()
 
 from game.routing import websocket_urlpatterns
+from game.serverloop import ServerLoopMiddleware
 
-application = ProtocolTypeRouter({
+application = ServerLoopMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(websocket_urlpatterns)
         )
     ),
-})
\ No newline at end of file
+}))
\ No newline at end of file
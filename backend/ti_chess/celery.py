@@ -0,0 +1,13 @@
+# type: ignore
+"""
+Celery application for TI Chess background jobs
+"""
+
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ti_chess.settings')
+
+app = Celery('ti_chess')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
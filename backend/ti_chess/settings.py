@@ -44,7 +44,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ti_chess.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,6 +101,102 @@ else:
         },
     }
 
+# Cache: shared Redis cache in production, per-process memory locally
+if REDIS_URL and not DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Seconds a cached lobby listing may be served between lifecycle events
+LOBBY_CACHE_TIMEOUT = config('LOBBY_CACHE_TIMEOUT', default=30, cast=int)
+
+# Seconds a board payload stays cached for its (game, state_version)
+BOARD_CACHE_TIMEOUT = config('BOARD_CACHE_TIMEOUT', default=300, cast=int)
+
+# Replay keyframes: a GameSnapshot is stored every N moves for seeking
+REPLAY_KEYFRAME_INTERVAL = config('REPLAY_KEYFRAME_INTERVAL', default=10, cast=int)
+# Rows fetched per database round trip when streaming replays
+REPLAY_STREAM_CHUNK_SIZE = config('REPLAY_STREAM_CHUNK_SIZE', default=200, cast=int)
+
+# Presence: seconds without a heartbeat before a player is offline, seconds a
+# dropped socket has to reconnect, and seconds between batched database writes
+PRESENCE_TTL = config('PRESENCE_TTL', default=60, cast=int)
+PRESENCE_GRACE = config('PRESENCE_GRACE', default=10, cast=int)
+PRESENCE_FLUSH_INTERVAL = config('PRESENCE_FLUSH_INTERVAL', default=5, cast=int)
+
+# Game events kept for reconnecting clients to resume from
+GAME_EVENT_BUFFER_SIZE = config('GAME_EVENT_BUFFER_SIZE', default=100, cast=int)
+GAME_EVENT_BUFFER_TTL = config('GAME_EVENT_BUFFER_TTL', default=3600, cast=int)
+
+# Spectators: coalesced board frames per second, undelivered frames kept
+# per socket before the oldest is dropped, and seconds a process's spectator
+# count outlives its last heartbeat
+SPECTATOR_FRAME_RATE = config('SPECTATOR_FRAME_RATE', default=4, cast=float)
+SPECTATOR_QUEUE_SIZE = config('SPECTATOR_QUEUE_SIZE', default=1, cast=int)
+SPECTATOR_TTL = config('SPECTATOR_TTL', default=30, cast=int)
+
+# WebSocket abuse limits: frames queued per socket before new ones are dropped.
+# Per-action token buckets are in game.ratelimit (WS_ACTION_RATES overrides them)
+WS_INBOUND_QUEUE_SIZE = config('WS_INBOUND_QUEUE_SIZE', default=16, cast=int)
+
+# Per-game command actors: queued commands before submissions are refused,
+# commands applied per transaction, and idle seconds before an actor stops
+GAME_ACTOR_QUEUE_SIZE = config('GAME_ACTOR_QUEUE_SIZE', default=64, cast=int)
+GAME_ACTOR_BATCH_SIZE = config('GAME_ACTOR_BATCH_SIZE', default=16, cast=int)
+GAME_ACTOR_IDLE_TIMEOUT = config('GAME_ACTOR_IDLE_TIMEOUT', default=30, cast=int)
+
+# Game affinity: each game's commands are applied by one worker process, chosen
+# by consistent hashing. Needs the shared Redis channel layer and cache, so it
+# defaults on under the same condition that selects them above
+GAME_AFFINITY = config('GAME_AFFINITY', default=bool(REDIS_URL and not DEBUG), cast=bool)
+GAME_AFFINITY_MEMBER_TTL = config('GAME_AFFINITY_MEMBER_TTL', default=15, cast=int)
+GAME_AFFINITY_FORWARD_TIMEOUT = config('GAME_AFFINITY_FORWARD_TIMEOUT', default=5, cast=float)
+GAME_AFFINITY_COMMAND_MEMORY = config('GAME_AFFINITY_COMMAND_MEMORY', default=1024, cast=int)
+# Boards of recently played games kept in memory by the worker that owns them
+GAME_RESIDENT_GAMES = config('GAME_RESIDENT_GAMES', default=512, cast=int)
+
+# Turn clocks and abandonment: seconds per timer wheel tick, and seconds a
+# player of an active game may stay offline before the game is abandoned
+GAME_TIMER_TICK = config('GAME_TIMER_TICK', default=0.25, cast=float)
+GAME_ABANDON_TIMEOUT = config('GAME_ABANDON_TIMEOUT', default=120, cast=int)
+
+# Moves a player may queue to play as soon as the turn passes to them
+GAME_PREMOVE_LIMIT = config('GAME_PREMOVE_LIMIT', default=3, cast=int)
+
+# Include the legal moves of the side to move in every move_made event
+GAME_PUSH_LEGAL_MOVES = config('GAME_PUSH_LEGAL_MOVES', default=True, cast=bool)
+
+# Cold archive: games ended this many days ago move to GameArchive
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=30, cast=int)
+# Hot rows deleted per transaction while archiving
+ARCHIVE_DELETE_BATCH_SIZE = config('ARCHIVE_DELETE_BATCH_SIZE', default=1000, cast=int)
+
+# Celery (optional): background jobs use Redis when available
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL or 'memory://')
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not REDIS_URL, cast=bool)
+CELERY_BEAT_SCHEDULE = {
+    'archive-finished-games': {
+        'task': 'game.tasks.archive_finished_games',
+        'schedule': 60 * 60 * 24,
+    },
+    # Catches games whose "game finished" message was lost
+    'finalize-finished-games': {
+        'task': 'game.tasks.finalize_finished_games',
+        'schedule': 60 * 5,
+    },
+}
+# Finished games processed per transaction by the post-game pipeline
+POSTGAME_BATCH_SIZE = config('POSTGAME_BATCH_SIZE', default=100, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -141,6 +237,15 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'game.codec.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'game.codec.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
@@ -29,6 +29,7 @@ import { toast } from 'react-hot-toast';
 
 import { Game, GameStatus } from '@/types';
 import gameService from '@/services/gameService';
+import { subscribeToLobby } from '@/services/lobbySocket';
 
 const LobbyPage: React.FC = () => {
   const navigate = useNavigate();
@@ -58,10 +59,17 @@ const LobbyPage: React.FC = () => {
 
   useEffect(() => {
     loadGames();
-    
-    // Auto-refresh every 30 seconds
-    const interval = setInterval(() => loadGames(false), 30000);
-    return () => clearInterval(interval);
+
+    // Live updates are pushed over the lobby socket; poll only if it drops
+    let interval: ReturnType<typeof setInterval> | null = null;
+    const unsubscribe = subscribeToLobby(setGames, () => {
+      interval = setInterval(() => loadGames(false), 30000);
+    });
+
+    return () => {
+      unsubscribe();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   const handleCreateGame = () => {
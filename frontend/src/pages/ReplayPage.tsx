@@ -126,55 +126,41 @@ const ReplayPage: React.FC = () => {
     setPieces(initialPieces);
   };
 
-  const updateBoardToMoveIndex = (moveIndex: number) => {
-    // This would reconstruct the board state at the given move
-    // For now, we'll use a simplified approach
-    
-    if (moveIndex === 0) {
-      // Reset to initial position
-      if (game?.players) {
+  const updateBoardToMoveIndex = async (moveIndex: number) => {
+    if (!gameId) return;
+
+    // Seek directly to the position instead of replaying from move 1
+    try {
+      const position = await gameService.getReplayPosition(gameId, moveIndex);
+      const seekedPieces: Piece[] = [];
+
+      position.board.forEach((row: any[], y: number) => {
+        row.forEach((cell: any, x: number) => {
+          if (!cell) return;
+          seekedPieces.push({
+            id: cell.id,
+            pieceType: cell.type as PieceType,
+            level: cell.level,
+            positionX: x,
+            positionY: y,
+            transformCount: cell.transform_count,
+            temporaryBuffs: cell.temporary_buffs || {},
+            isActive: true,
+            ownerName: cell.owner_name,
+            ownerColor: cell.owner_color,
+            createdAt: '',
+            updatedAt: '',
+          });
+        });
+      });
+
+      setPieces(seekedPieces);
+    } catch (error) {
+      console.error('Failed to seek replay:', error);
+      if (moveIndex === 0 && game?.players) {
         initializePieces(game.players);
       }
-      return;
     }
-
-    // Apply moves up to the current index
-    // This is simplified - in a real implementation, you'd replay all moves
-    // from the beginning to reconstruct the exact board state
-    
-    setPieces(prevPieces => {
-      const newPieces = [...prevPieces];
-      const currentMove = moves[moveIndex - 1];
-      
-      if (currentMove) {
-        // Find and update the piece that moved
-        const pieceIndex = newPieces.findIndex(p => 
-          p.positionX === currentMove.fromX && 
-          p.positionY === currentMove.fromY
-        );
-        
-        if (pieceIndex !== -1 && currentMove.toX !== null && currentMove.toY !== null) {
-          // Check for captures
-          const capturedIndex = newPieces.findIndex(p => 
-            p.positionX === currentMove.toX && 
-            p.positionY === currentMove.toY
-          );
-          
-          if (capturedIndex !== -1) {
-            newPieces.splice(capturedIndex, 1);
-          }
-          
-          // Move the piece
-          newPieces[pieceIndex] = {
-            ...newPieces[pieceIndex],
-            positionX: currentMove.toX,
-            positionY: currentMove.toY,
-          };
-        }
-      }
-      
-      return newPieces;
-    });
   };
 
   const handlePlayPause = () => {
@@ -100,11 +100,20 @@ export class GameService {
 
   async getMoves(gameId: string): Promise<Move[]> {
     try {
-      const response = await api.get('/moves/', {
-        params: { game_id: gameId },
+      // Move listings are cursor-paginated; follow next until the last page
+      const moves: Move[] = [];
+      let response = await api.get('/moves/', {
+        params: { game_id: gameId, page_size: 100 },
       });
-      // Ensure we always return an array
-      return Array.isArray(response.data) ? response.data : [];
+      while (true) {
+        if (Array.isArray(response.data?.results)) {
+          moves.push(...response.data.results);
+        }
+        if (!response.data?.next) {
+          return moves;
+        }
+        response = await api.get(response.data.next);
+      }
     } catch (error) {
       console.error('Failed to fetch moves:', error);
       // Return empty array on error
@@ -118,6 +127,13 @@ export class GameService {
     return response.data;
   }
 
+  async getReplayPosition(gameId: string, moveNumber: number): Promise<any> {
+    const response = await api.get(`/games/${gameId}/replay/position/`, {
+      params: { move: moveNumber },
+    });
+    return response.data;
+  }
+
   // Health check
   async healthCheck(): Promise<{ status: string; timestamp: string }> {
     const response = await api.get('/health/');
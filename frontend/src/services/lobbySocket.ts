@@ -0,0 +1,59 @@
+import { Game } from '@/types';
+
+type LobbyListener = (games: Game[]) => void;
+
+/**
+ * Subscribe to the lobby WebSocket. The server sends one snapshot on
+ * connect and then small deltas, which are folded into the local list.
+ * Returns an unsubscribe function.
+ */
+export function subscribeToLobby(onChange: LobbyListener, onClose?: () => void): () => void {
+  const currentHost = window.location.host;
+  const wsBaseUrl = import.meta.env.VITE_WS_BASE_URL || `ws://${currentHost}`;
+  const socket = new WebSocket(`${wsBaseUrl}/ws/lobby/`);
+  let games: any[] = [];
+  let closedByClient = false;
+
+  socket.onmessage = (message) => {
+    const { event, data } = JSON.parse(message.data);
+
+    switch (event) {
+      case 'lobby_snapshot':
+        games = data;
+        break;
+      case 'game_added':
+        games = [data, ...games.filter((game) => game.id !== data.id)];
+        break;
+      case 'player_count_changed':
+        games = games.map((game) =>
+          game.id === data.game_id
+            ? { ...game, players: data.players }
+            : game
+        );
+        break;
+      case 'game_status_changed':
+        games = games.map((game) =>
+          game.id === data.game_id ? { ...game, status: data.status } : game
+        );
+        break;
+      case 'game_removed':
+        games = games.filter((game) => game.id !== data.game_id);
+        break;
+      default:
+        return;
+    }
+
+    onChange(games as Game[]);
+  };
+
+  socket.onclose = () => {
+    if (!closedByClient && onClose) {
+      onClose();
+    }
+  };
+
+  return () => {
+    closedByClient = true;
+    socket.close();
+  };
+}
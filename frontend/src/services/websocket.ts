@@ -9,6 +9,13 @@ class WebSocketService {
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 5;
   private reconnectDelay = 1000;
+  private heartbeatInterval = 20000;
+  private heartbeatTimer: ReturnType<typeof setInterval> | null = null;
+  // Highest seq up to which every event was received, and events received past a gap
+  private lastSeq: number | null = null;
+  private aheadSeqs: Set<number> = new Set();
+  private gapTimer: ReturnType<typeof setTimeout> | null = null;
+  private gapTimeout = 1000;
 
   connect(gameId: string, playerToken?: string): Promise<void> {
     return new Promise((resolve, reject) => {
@@ -34,16 +41,22 @@ class WebSocketService {
         console.log('WebSocket connected to game:', gameId);
         this.reconnectAttempts = 0;
         
-        // Auto-reconnect if we have a player token
+        // Auto-reconnect if we have a player token, resuming after the last event seen
         if (this.playerToken) {
-          this.sendMessage('reconnect', { player_token: this.playerToken });
+          const data: Record<string, any> = { player_token: this.playerToken };
+          if (this.lastSeq !== null) {
+            data.last_seq = this.lastSeq;
+          }
+          this.sendMessage('reconnect', data);
         }
         
+        this.startHeartbeat();
         resolve();
       });
 
       this.socket.on('disconnect', (reason) => {
         console.log('WebSocket disconnected:', reason);
+        this.stopHeartbeat();
         this.emit('connection_lost', { reason });
       });
 
@@ -77,12 +90,14 @@ class WebSocketService {
   }
 
   disconnect(): void {
+    this.stopHeartbeat();
     if (this.socket) {
       this.socket.disconnect();
       this.socket = null;
     }
     this.gameId = null;
     this.playerToken = null;
+    this.resetSeq(null);
     this.eventHandlers.clear();
   }
 
@@ -95,6 +110,23 @@ class WebSocketService {
     this.socket.emit('message', message);
   }
 
+  // Keeps the player marked online while the tab is idle
+  private startHeartbeat(): void {
+    this.stopHeartbeat();
+    this.heartbeatTimer = setInterval(() => {
+      if (this.socket?.connected && this.playerToken) {
+        this.sendMessage('heartbeat');
+      }
+    }, this.heartbeatInterval);
+  }
+
+  private stopHeartbeat(): void {
+    if (this.heartbeatTimer) {
+      clearInterval(this.heartbeatTimer);
+      this.heartbeatTimer = null;
+    }
+  }
+
   // Game-specific message methods
   joinGame(playerName: string, playerToken?: string): void {
     this.sendMessage('join_game', {
@@ -166,10 +198,19 @@ class WebSocketService {
   }
 
   private handleMessage(message: WSEvent): void {
-    const { event, data } = message;
+    const { event, data, seq } = message;
     
     console.log('WebSocket message received:', event, data);
     
+    if (seq !== undefined) {
+      if (event === 'game_state') {
+        this.resetSeq(seq);
+      } else if (!this.trackSeq(seq)) {
+        // Already received, or reflected in a newer game_state
+        return;
+      }
+    }
+    
     // Emit the specific event
     this.emit(event, data);
     
@@ -177,6 +218,52 @@ class WebSocketService {
     this.emit('message', message);
   }
 
+  private resetSeq(seq: number | null): void {
+    this.lastSeq = seq;
+    this.aheadSeqs.clear();
+    this.clearGapTimer();
+  }
+
+  // Events can arrive out of order; returns false for one already received
+  private trackSeq(seq: number): boolean {
+    if (this.lastSeq === null) {
+      this.lastSeq = seq;
+      return true;
+    }
+    if (seq <= this.lastSeq || this.aheadSeqs.has(seq)) {
+      return false;
+    }
+
+    this.aheadSeqs.add(seq);
+    while (this.aheadSeqs.has(this.lastSeq + 1)) {
+      this.lastSeq += 1;
+      this.aheadSeqs.delete(this.lastSeq);
+    }
+
+    if (this.aheadSeqs.size === 0) {
+      this.clearGapTimer();
+    } else if (!this.gapTimer) {
+      this.gapTimer = setTimeout(() => this.resumeGap(), this.gapTimeout);
+    }
+    return true;
+  }
+
+  // A missing event did not turn up: fetch it from the server's event buffer
+  private resumeGap(): void {
+    this.gapTimer = null;
+    if (this.aheadSeqs.size === 0 || !this.playerToken || !this.socket?.connected) {
+      return;
+    }
+    this.sendMessage('reconnect', { player_token: this.playerToken, last_seq: this.lastSeq });
+  }
+
+  private clearGapTimer(): void {
+    if (this.gapTimer) {
+      clearTimeout(this.gapTimer);
+      this.gapTimer = null;
+    }
+  }
+
   // Connection state
   get isConnected(): boolean {
     return this.socket?.connected || false;
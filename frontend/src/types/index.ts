@@ -151,6 +151,7 @@ export interface WSMessage {
 export interface WSEvent {
   event: string;
   data: Record<string, any>;
+  seq?: number;
 }
 
 export interface JoinGameRequest {